@@ -0,0 +1,375 @@
+"""qCamera benchmarks
+
+Micro benchmarks of the acquisition, ring buffer and display paths
+using simulated cameras and the stand-in SDKs of
+:mod:`qcamera.fake_sdk`, so that they run on any machine without
+camera hardware or SDKs. Results are written as JSON and can be
+compared against an earlier run to catch regressions::
+
+    python benchmarks/bench.py -o baseline.json
+    ... make changes ...
+    python benchmarks/bench.py -o new.json --compare baseline.json
+
+Each result records the group and name of the benchmark, its
+parameters and timing statistics per call in seconds.
+
+"""
+
+from __future__ import print_function, division
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+import platform
+import subprocess
+import argparse
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'viewer'))
+
+from transforms import transform_image, get_scale, roi_statistics
+
+_timer = getattr(time, 'perf_counter', time.time)
+
+# Cameras to benchmark: (name, class name, stand-in SDK class name,
+# extra kwargs). Drivers with a stand-in SDK run their real code path
+# against it; the others are simulated.
+DRIVERS = [
+    ('andor', 'AndorCamera', 'FakeAndorSDK', {'wait_for_temp': False}),
+    ('sensicam', 'Sensicam', 'FakeSensicamSDK', {'coc_cache': None}),
+    ('thorlabs_dcx', 'ThorlabsDCx', 'FakeUEyeSDK', {}),
+    ('opencv', 'OpenCVCamera', None, {})
+]
+
+# Frame sizes (square) and ring buffer lengths to test.
+FRAME_SIZES = [128, 512, 1024]
+BUFFER_LENGTHS = [16, 128]
+
+# Modules to time importing in a fresh interpreter, and the import
+# time in seconds each should stay within (including NumPy).
+IMPORTS = ['qcamera', 'qcamera.andor']
+IMPORT_BUDGET = 0.5
+
+# Optional dependencies which importing qcamera must not pull in.
+HEAVY_MODULES = ['cv2', 'tables', 'scipy']
+
+_IMPORT_SCRIPT = '''
+import sys, time, json
+sys.path.insert(0, %r)
+timer = getattr(time, 'perf_counter', time.time)
+t0 = timer()
+import %s
+print(json.dumps([timer() - t0, [m for m in %r if m in sys.modules]]))
+'''
+
+# Benchmarks
+# =============================================================================
+
+def measure(func, repeat=5, number=None, min_time=0.05):
+    """Time func and return a dict of statistics per call.
+
+    func is called number times in each of repeat rounds. If number
+    is None, it is chosen such that a round takes at least min_time
+    seconds.
+
+    """
+    if number is None:
+        number = 1
+        while True:
+            t0 = _timer()
+            for i in range(number):
+                func()
+            if _timer() - t0 >= min_time or number >= 1e6:
+                break
+            number *= 2
+    times = []
+    for r in range(repeat):
+        t0 = _timer()
+        for i in range(number):
+            func()
+        times.append((_timer() - t0)/number)
+    times = np.array(times)
+    return {
+        'repeat': repeat,
+        'number': number,
+        'mean': float(np.mean(times)),
+        'median': float(np.median(times)),
+        'min': float(np.min(times)),
+        'stdev': float(np.std(times))
+    }
+
+def _result(group, name, params, timing, nbytes=None):
+    """Combine a benchmark identification with its timing."""
+    result = {'group': group, 'name': name, 'params': params}
+    result.update(timing)
+    result['rate'] = 1./timing['median'] if timing['median'] > 0 else None
+    if nbytes is not None:
+        result['bytes_per_second'] = nbytes*result['rate']
+    return result
+
+def bench_acquisition(tmpdir, repeat):
+    """get_image and get_images throughput of each driver."""
+    import qcamera
+    from qcamera import fake_sdk
+    results = []
+    for name, cls_name, sdk_name, kwargs in DRIVERS:
+        kwargs = dict(kwargs)
+        simulation = {'pacing': 'free', 'seed': 0, 'shot_noise': False}
+        if sdk_name is None:
+            kwargs.update(real=False, simulation=simulation)
+        else:
+            # No exposure or readout delays: measure the driver only.
+            sdk = getattr(fake_sdk, sdk_name)(
+                time_scale=0, simulation=simulation)
+            kwargs.update(real=True, sdk=sdk)
+        try:
+            cls = getattr(qcamera, cls_name)
+            cam = cls(buffer_dir=tmpdir, buffer_backend='memory',
+                      logger='bench.' + name, **kwargs)
+        except Exception as e:
+            print("Skipping %s: %s" % (name, e), file=sys.stderr)
+            continue
+        try:
+            cam.start()
+            nbytes = cam.get_image().nbytes
+            params = {'driver': name, 'sdk': sdk_name,
+                      'shape': list(cam.get_frame_format()[0])}
+            for recording in (False, True):
+                cam.rbuffer.set_recording_state(recording)
+                p = dict(params, recording=recording)
+                timing = measure(lambda: cam.release(cam.get_image()), repeat)
+                results.append(
+                    _result('acquisition', 'get_image', p, timing, nbytes))
+                timing = measure(lambda: cam.release(cam.get_images(16)), repeat)
+                results.append(
+                    _result('acquisition', 'get_images', dict(p, n=16),
+                            timing, 16*nbytes))
+        finally:
+            cam.rbuffer.close()
+            try:
+                cam.stop()
+                cam.close()
+            except Exception:
+                pass
+    return results
+
+def bench_ring_buffer(tmpdir, repeat):
+    """Ring buffer writes and reads for different frame sizes, buffer
+    lengths and backends.
+
+    """
+    from qcamera.ring_buffer import RING_BUFFERS
+    results = []
+    for backend in sorted(RING_BUFFERS):
+        for size in FRAME_SIZES:
+            for N in BUFFER_LENGTHS:
+                img = np.random.randint(0, 2**12, (size, size)).astype(np.uint16)
+                stack = np.tile(img, (16, 1, 1))
+                params = {'backend': backend, 'size': size, 'N': N}
+                rb = RING_BUFFERS[backend](
+                    N=N, directory=tmpdir, filename='bench_%s.h5' % backend,
+                    logger='bench.rbuffer')
+                try:
+                    timing = measure(lambda: rb.write(img), repeat)
+                    results.append(_result(
+                        'ring_buffer', 'write', params, timing, img.nbytes))
+                    timing = measure(lambda: rb.write_many(stack), repeat)
+                    results.append(_result(
+                        'ring_buffer', 'write_many', dict(params, n=16),
+                        timing, stack.nbytes))
+                    rb.drain()
+                    timing = measure(lambda: rb.read(N//2), repeat)
+                    results.append(_result(
+                        'ring_buffer', 'read', params, timing, img.nbytes))
+                finally:
+                    rb.close()
+    return results
+
+def bench_viewer(tmpdir, repeat):
+    """Display transformations and ROI statistics of the viewer."""
+    results = []
+    for size in FRAME_SIZES:
+        img = np.random.randint(0, 2**12, (size, size)).astype(np.uint16)
+        for rotation in (0, 1):
+            for mirror in ((False, False), (True, True)):
+                params = {'size': size, 'rotation': rotation,
+                          'mirror': list(mirror)}
+                # Transformations only create views, so time a pass
+                # over the pixels of the view like the display makes.
+                timing = measure(lambda: get_scale(
+                    transform_image(img, rotation, mirror)), repeat)
+                results.append(_result(
+                    'viewer', 'transform', params, timing, img.nbytes))
+        timing = measure(lambda: get_scale(img), repeat)
+        results.append(_result(
+            'viewer', 'rescale', {'size': size}, timing, img.nbytes))
+        for roi_size in (16, size//2):
+            roi = [10, 10, 10 + roi_size, 10 + roi_size]
+            timing = measure(lambda: roi_statistics(img, roi), repeat)
+            results.append(_result(
+                'viewer', 'roi_statistics',
+                {'size': size, 'roi_size': roi_size}, timing))
+    return results
+
+def bench_import(tmpdir, repeat):
+    """Time importing the package in a fresh interpreter."""
+    results = []
+    for module in IMPORTS:
+        script = _IMPORT_SCRIPT % (ROOT, module, HEAVY_MODULES)
+        times = []
+        for r in range(repeat):
+            output = subprocess.check_output([sys.executable, '-c', script])
+            t, loaded = json.loads(output.decode().strip().splitlines()[-1])
+            times.append(t)
+        timing = {
+            'repeat': repeat,
+            'number': 1,
+            'mean': float(np.mean(times)),
+            'median': float(np.median(times)),
+            'min': float(np.min(times)),
+            'stdev': float(np.std(times))
+        }
+        result = _result('import', 'import', {'module': module}, timing)
+        result['heavy_modules'] = loaded
+        results.append(result)
+    return results
+
+def check_import_budget(results, budget=IMPORT_BUDGET):
+    """Print import benchmarks which exceed the time budget or load
+    heavy optional dependencies and return their number.
+
+    """
+    failures = 0
+    for result in results['results']:
+        if result['group'] != 'import':
+            continue
+        module = result['params']['module']
+        if result['median'] > budget:
+            print("Importing %s took %.3f s (budget: %.3f s)" % (
+                module, result['median'], budget), file=sys.stderr)
+            failures += 1
+        if result['heavy_modules']:
+            print("Importing %s loaded %s" % (
+                module, ', '.join(result['heavy_modules'])), file=sys.stderr)
+            failures += 1
+    return failures
+
+BENCHMARKS = {
+    'import': bench_import,
+    'acquisition': bench_acquisition,
+    'ring_buffer': bench_ring_buffer,
+    'viewer': bench_viewer
+}
+
+# Running and comparing
+# =============================================================================
+
+def get_environment():
+    """Return a description of the machine and code being
+    benchmarked.
+
+    """
+    try:
+        commit = subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'], cwd=ROOT).decode().strip()
+    except Exception:
+        commit = None
+    return {
+        'commit': commit,
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'processor': platform.processor()
+    }
+
+def run(groups, repeat):
+    """Run the benchmarks in groups and return the results."""
+    tmpdir = tempfile.mkdtemp(prefix='qcamera-bench-')
+    results = []
+    try:
+        for group in groups:
+            print("Running %s benchmarks..." % group, file=sys.stderr)
+            results.extend(BENCHMARKS[group](tmpdir, repeat))
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+    return {'environment': get_environment(), 'results': results}
+
+def _key(result):
+    return (result['group'], result['name'],
+            json.dumps(result['params'], sort_keys=True))
+
+def compare(baseline, current, threshold=0.2):
+    """Print the change in median time per benchmark relative to a
+    baseline and return the number of benchmarks which got slower by
+    more than the fraction threshold.
+
+    """
+    old = dict((_key(r), r) for r in baseline['results'])
+    regressions = 0
+    for result in current['results']:
+        key = _key(result)
+        if key not in old:
+            continue
+        ratio = result['median']/old[key]['median']
+        flag = ''
+        if ratio > 1 + threshold:
+            flag = '  SLOWER'
+            regressions += 1
+        elif ratio < 1 - threshold:
+            flag = '  faster'
+        print("%-12s %-15s %-60s %6.2fx%s" % (
+            key[0], key[1], key[2], ratio, flag))
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="qCamera benchmarks")
+    parser.add_argument(
+        '-o', '--output', default=None,
+        help="File to write the JSON results to. Default: stdout.")
+    parser.add_argument(
+        '-g', '--group', action='append', choices=sorted(BENCHMARKS),
+        help="Benchmark group to run. May be given more than once. " +
+        "Default: all.")
+    parser.add_argument(
+        '-r', '--repeat', type=int, default=5,
+        help="Number of timing rounds per benchmark.")
+    parser.add_argument(
+        '-c', '--compare', default=None, metavar='BASELINE',
+        help="Compare with the results in BASELINE and exit with " +
+        "status 1 if any benchmark got slower.")
+    parser.add_argument(
+        '-t', '--threshold', type=float, default=0.2,
+        help="Relative slowdown counted as a regression. Default: 0.2.")
+    parser.add_argument(
+        '-b', '--import-budget', type=float, default=IMPORT_BUDGET,
+        help="Maximum time in seconds for importing qcamera. Exit " +
+        "with status 1 if it is exceeded. Default: %(default)s.")
+    args = parser.parse_args()
+
+    results = run(args.group or sorted(BENCHMARKS), args.repeat)
+    output = json.dumps(results, indent=2, sort_keys=True)
+    if args.output is None:
+        print(output)
+    else:
+        with open(args.output, 'w') as f:
+            f.write(output)
+
+    failed = check_import_budget(results, args.import_budget) > 0
+    if args.compare is not None:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(baseline, results, args.threshold)
+        if regressions > 0:
+            print("%i benchmarks got slower" % regressions, file=sys.stderr)
+            failed = True
+    if failed:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,62 @@
+"""qCamera: a unified camera interface
+
+Camera drivers are loaded lazily: ``import qcamera`` only imports the
+base classes, and a driver module (along with its SDK bindings and
+optional dependencies such as OpenCV) is imported the first time its
+class is accessed, e.g., as ``qcamera.AndorCamera`` or
+``qcamera.get_driver('andor')``.
+
+"""
+
+import sys
+import importlib
+
 from .camera import Camera
-from .sensicam import Sensicam
-from .andor import AndorCamera
-from .thorlabs_dcx import ThorlabsDCx
-from .opencv_camera import OpenCVCamera
+from .engine import AcquisitionEngine
 
 __version__ = "0.2.3"
 
+# Registry of camera drivers: name -> (module, class name).
+DRIVERS = {
+    'andor': ('.andor', 'AndorCamera'),
+    'sensicam': ('.sensicam', 'Sensicam'),
+    'thorlabs_dcx': ('.thorlabs_dcx', 'ThorlabsDCx'),
+    'opencv': ('.opencv_camera', 'OpenCVCamera')
+}
+
+_driver_classes = dict((cls, name) for name, (module, cls) in DRIVERS.items())
+
+__all__ = ['Camera', 'AcquisitionEngine', 'DRIVERS', 'get_driver'] + \
+    sorted(_driver_classes)
+
+def get_driver(name):
+    """Return the camera class registered under name (see
+    :data:`DRIVERS`), importing its module if necessary.
+
+    """
+    try:
+        module, cls = DRIVERS[name]
+    except KeyError:
+        raise ValueError(
+            "Unknown camera driver %r. Valid names are: %s" % (
+                name, ', '.join(sorted(DRIVERS))))
+    return getattr(importlib.import_module(module, __name__), cls)
+
+def __getattr__(name):
+    """Resolve driver class names on first access (PEP 562)."""
+    if name in _driver_classes:
+        cls = get_driver(_driver_classes[name])
+        globals()[name] = cls
+        return cls
+    raise AttributeError(
+        "module %r has no attribute %r" % (__name__, name))
+
+def __dir__():
+    return sorted(set(globals()) | set(_driver_classes))
+
+if sys.version_info < (3, 7):
+    # Module level __getattr__ is not supported, so import the drivers
+    # now. Their optional dependencies are still only loaded on use.
+    for _name in _driver_classes:
+        globals()[_name] = __getattr__(_name)
+    del _name
@@ -0,0 +1,223 @@
+"""asyncio interface for cameras
+
+Blocking calls into camera SDKs (waiting for an exposure or a trigger,
+reading out an image, reconfiguring the hardware) would freeze an
+asyncio event loop. :class:`AsyncCamera` wraps a :class:`Camera` and
+runs all such calls in a dedicated executor thread per camera, so
+that calls for one camera are executed in order while the event loop
+stays responsive.
+
+When a task waiting for an image is cancelled, the wait is cancelled
+with :meth:`Camera.cancel_wait` (e.g., ``CancelWait`` for Andor
+cameras) so that the blocked call returns and the executor thread
+becomes available again. The camera keeps running.
+
+This module requires Python 3.7 or newer and is therefore not
+imported by default::
+
+    from qcamera.aio import AsyncCamera
+
+    async with AsyncCamera(cam) as acam:
+        await acam.aset_exposure_time(10)
+        img = await acam.aget_image()
+        async for img in acam.astream(max_frames=100):
+            process(img)
+
+"""
+
+import asyncio
+import functools
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from .camera import Camera
+from .exceptions import AcquisitionCancelled
+from .frame import Frame
+
+class _Acquisition(object):
+    """A blocking acquisition call submitted to the executor which
+    keeps track of whether it is queued, running or done, so that
+    cancelling it never cancels another call.
+
+    """
+
+    def __init__(self, func):
+        self._func = func
+        self._lock = threading.Lock()
+        self._state = 'queued'
+
+    def __call__(self):
+        with self._lock:
+            if self._state == 'cancelled':
+                raise AcquisitionCancelled(
+                    "Acquisition cancelled before it started.")
+            self._state = 'running'
+        try:
+            return self._func()
+        finally:
+            with self._lock:
+                self._state = 'done'
+
+    def cancel(self, cam):
+        """Try to cancel the call on the given camera. A call which
+        has not started yet is skipped. Returns False if this has to
+        be retried because the camera does not accept the
+        cancellation yet.
+
+        """
+        # Holding the lock keeps the call from finishing (and the
+        # executor from starting the next one) while cancelling.
+        with self._lock:
+            if self._state == 'queued':
+                self._state = 'cancelled'
+                return True
+            elif self._state == 'running':
+                return cam.cancel_wait()
+            return True
+
+class AsyncCamera(object):
+    """asyncio facade over a :class:`Camera`.
+
+    Attributes
+    ----------
+    cam : Camera
+        The wrapped camera. Its methods must not be called directly
+        while asynchronous calls are pending.
+
+    """
+
+    def __init__(self, camera):
+        assert isinstance(camera, Camera)
+        self.cam = camera
+        self._executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix=type(camera).__name__)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, type_, value, tb):
+        await self.aclose()
+
+    async def _run(self, func, *args, **kwargs):
+        """Run func(*args, **kwargs) in the camera's executor
+        thread.
+
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self._executor, functools.partial(func, *args, **kwargs))
+
+    async def _acquire(self, func, *args, **kwargs):
+        """Like :meth:`_run`, but cancel waiting for the image if the
+        calling task is cancelled.
+
+        """
+        loop = asyncio.get_running_loop()
+        call = _Acquisition(functools.partial(func, *args, **kwargs))
+        future = loop.run_in_executor(self._executor, call)
+        try:
+            return await asyncio.shield(future)
+        except asyncio.CancelledError:
+            self.cam.logger.info("Acquisition cancelled.")
+            # The camera only accepts the cancellation once the call
+            # is under way in the executor thread.
+            while not call.cancel(self.cam):
+                await asyncio.sleep(0.001)
+            try:
+                result = await future
+                if isinstance(result, tuple):
+                    result = result[0]
+                elif isinstance(result, Frame):
+                    result = result.data
+                self.cam.release(result)
+            except Exception:
+                pass
+            raise
+
+    async def acall(self, func, *args, **kwargs):
+        """Run an arbitrary blocking function in the camera's executor
+        thread.
+
+        """
+        return await self._run(func, *args, **kwargs)
+
+    async def aclose(self):
+        """Close the ring buffer and the camera and shut down the
+        executor.
+
+        """
+        await self._run(self.cam.rbuffer.close)
+        await self._run(self.cam.close)
+        self._executor.shutdown()
+
+    # Image acquisition
+    # -------------------------------------------------------------------------
+
+    async def aget_image(self, out=None, metadata=False):
+        """Asynchronous version of :meth:`Camera.get_image`."""
+        return await self._acquire(self.cam.get_image, out, metadata)
+
+    async def aget_images(self, n, out=None, metadata=False):
+        """Asynchronous version of :meth:`Camera.get_images`."""
+        return await self._acquire(self.cam.get_images, n, out, metadata)
+
+    async def astream(self, max_frames=None, timeout=None, metadata=False):
+        """Asynchronous version of :meth:`Camera.stream`. Each image
+        is released back to the frame pool when the consumer advances
+        to the next one.
+
+        """
+        if timeout is not None:
+            t_stop = time.time() + timeout
+        count = 0
+        await self._run(self.cam.start)
+        try:
+            while max_frames is None or count < max_frames:
+                if timeout is not None and time.time() >= t_stop:
+                    break
+                img = await self._acquire(self.cam.get_image, None, metadata)
+                count += 1
+                yield img
+                self.cam.release(img.data if metadata else img)
+        finally:
+            await self._run(self.cam.stop)
+
+    async def astart(self):
+        """Asynchronous version of :meth:`Camera.start`."""
+        await self._run(self.cam.start)
+
+    async def astop(self):
+        """Asynchronous version of :meth:`Camera.stop`."""
+        await self._run(self.cam.stop)
+
+    # Settings
+    # -------------------------------------------------------------------------
+
+    async def aset_acquisition_mode(self, mode):
+        """Asynchronous version of :meth:`Camera.set_acquisition_mode`."""
+        await self._run(self.cam.set_acquisition_mode, mode)
+
+    async def aset_trigger_mode(self, mode):
+        """Asynchronous version of :meth:`Camera.set_trigger_mode`."""
+        await self._run(self.cam.set_trigger_mode, mode)
+
+    async def aset_exposure_time(self, t):
+        """Asynchronous version of :meth:`Camera.set_exposure_time`."""
+        await self._run(self.cam.set_exposure_time, t)
+
+    async def aset_gain(self, gain, **kwargs):
+        """Asynchronous version of :meth:`Camera.set_gain`."""
+        await self._run(self.cam.set_gain, gain, **kwargs)
+
+    async def aset_crop(self, crop):
+        """Asynchronous version of :meth:`Camera.set_crop`."""
+        await self._run(self.cam.set_crop, crop)
+
+    async def aset_bins(self, bins):
+        """Asynchronous version of :meth:`Camera.set_bins`."""
+        await self._run(self.cam.set_bins, bins)
+
+    async def aget_cooler_temperature(self):
+        """Asynchronous version of :meth:`Camera.get_cooler_temperature`."""
+        return await self._run(self.cam.get_cooler_temperature)
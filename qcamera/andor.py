@@ -13,14 +13,60 @@ import traceback as tb
 import ctypes
 import numpy as np
 from . import camera
-from .exceptions import AndorError
+from .frame import timestamp_ns
+from .exceptions import AndorError, AcquisitionTimeout
 from .andor_status_codes import *
 from .andor_capabilities import *
 
+_timer = getattr(time, 'perf_counter', time.time)
+
 def _int_ptr(val=0):
     """Utility function to create integer pointers."""
     return ctypes.pointer(ctypes.c_int(val))
 
+class _DriverEvents(object):
+    """A pair of Win32 events: one which the Andor driver signals
+    (see SetDriverEvent) and one for cancelling a wait on it, so that
+    both can be waited for at once.
+
+    """
+    WAIT_TIMEOUT = 0x102
+    INFINITE = 0xFFFFFFFF
+
+    def __init__(self):
+        self.kernel32 = ctypes.windll.kernel32
+        self.kernel32.CreateEventW.restype = ctypes.c_void_p
+        self.handles = (ctypes.c_void_p*2)(
+            self.kernel32.CreateEventW(None, False, False, None),
+            self.kernel32.CreateEventW(None, False, False, None))
+
+    @property
+    def driver(self):
+        """Handle of the event for the driver."""
+        return ctypes.c_void_p(self.handles[0])
+
+    def cancel(self):
+        """Wake up a thread waiting in :meth:`wait`."""
+        self.kernel32.SetEvent(ctypes.c_void_p(self.handles[1]))
+
+    def wait(self, timeout=None):
+        """Wait for either event for up to timeout ms. Returns
+        'driver', 'cancelled' or 'timeout'.
+
+        """
+        timeout = self.INFINITE if timeout is None else int(timeout)
+        result = self.kernel32.WaitForMultipleObjects(
+            2, self.handles, False, timeout)
+        if result == 0:
+            return 'driver'
+        if result == 1:
+            return 'cancelled'
+        return 'timeout'
+
+    def close(self):
+        for handle in self.handles:
+            self.kernel32.CloseHandle(ctypes.c_void_p(handle))
+
 class AndorCamera(camera.Camera):
     """Class for controlling Andor cameras. This is designed
     specifically with the iXon series cameras, but the Andor API is
@@ -49,6 +95,79 @@ class AndorCamera(camera.Camera):
         "external start": 6,
         "software": 10}
 
+    # Supported image data types and the SDK functions which read
+    # them. The 16 bit functions are sufficient for the 14 or 16 bit
+    # ADCs of Andor cameras and transfer half as much data as the
+    # at_32 (32 bits on all platforms) ones.
+    _dtypes = {
+        'uint16': ('GetMostRecentImage16', 'GetAcquiredData16', 'GetImages16',
+                   ctypes.c_uint16),
+        'int32': ('GetMostRecentImage', 'GetAcquiredData', 'GetImages',
+                  ctypes.c_int32)}
+
+    # Readout modes for continuous acquisition. 'latest' reads the
+    # most recent image, skipping any that arrived since the last
+    # read. 'ordered' reads every image from the SDK's circular
+    # buffer in the order they were acquired.
+    _readout_modes = ('latest', 'ordered')
+    readout_mode = 'latest'
+
+    # Series index (counting from 1 since StartAcquisition) of the
+    # next image to read in ordered mode.
+    _next_index = 1
+
+    # Series indices of the images read by the last ordered readout,
+    # and the offset between series indices and sequence numbers.
+    _ordered_indices = None
+    _series_offset = -1
+
+    # Kinetic series settings: number of images, cycle time in ms and,
+    # for fast kinetics, the (rows, offset) of the exposed sub-area.
+    n_kinetics = 1
+    kinetic_cycle_time = 0.
+    fast_kinetics = None
+
+    # True if StartAcquisition was called for a kinetic series which
+    # has not been read yet.
+    _armed = False
+
+    # Interval in s for polling the status at the end of a kinetic
+    # series, growing from _poll_min to _poll_max.
+    _poll_min = 0.0001
+    _poll_max = 0.001
+
+    # Events signalled by the driver, if enabled.
+    _events = None
+
+    # Longest single call to WaitForAcquisitionTimeOut in ms. Waiting
+    # in slices bounds the time until a cancellation is noticed which
+    # arrived just before the SDK call started, as CancelWait only
+    # affects a wait in progress.
+    _wait_slice = 500
+
+    native_dtype = np.dtype(np.uint16)
+
+    # Scratch buffers for raw and filtered images when post-processing
+    # is enabled. The noise filter only works on 32 bit data.
+    _raw_img = None
+    _filtered_img = None
+
+    def __init__(self, **kwargs):
+        """Create an Andor camera. See :meth:`Camera.__init__` and
+        :meth:`_initialize` for keyword arguments. The data type is
+        chosen here so that it also applies to simulated cameras.
+
+        """
+        dtype = kwargs.get('dtype', 'uint16')
+        if dtype not in self._dtypes:
+            raise AndorError(
+                "dtype must be one of " + repr(sorted(self._dtypes)))
+        self.native_dtype = np.dtype(dtype)
+        self._read_image, self._read_series, self._read_images, \
+            self._c_pixel = self._dtypes[dtype]
+        self.missed_frames = []
+        super(AndorCamera, self).__init__(**kwargs)
+
     def _chk(self, status):
         """Checks the error status of an Andor DLL function call. If
         something catastrophic happened, an AndorError exception is
@@ -109,16 +228,28 @@ class AndorCamera(camera.Camera):
             before shutting off. Andor recommends waiting, but for
             quicker debugging, it is useful to not wait to rerun a
             program. Defaults to True.
+        dtype : str
+            Data type of the images, either 'uint16' (the default) or
+            'int32'. Reading 16 bit images halves the amount of data
+            to copy and store.
+        readout_mode : str
+            Readout mode for continuous acquisition (see
+            :meth:`set_readout_mode`). Default: 'latest'.
+        driver_event : bool
+            When True, wait for images on a Win32 event signalled by
+            the driver (SetDriverEvent) instead of in
+            WaitForAcquisitionTimeOut. Windows only. Default: False.
 
         """
         
-        # Try to load the Andor DLL
+        # Try to load the Andor DLL unless a library was given
         # TODO: library name in Linux?
-        self.clib = ctypes.windll.atmcd32d
+        if self.clib is None:
+            self.clib = ctypes.windll.atmcd32d
 
         # Initialize the camera and get the detector size
         # TODO: directory to Initialize?
-        self._chk(self.clib.Initialize("."))
+        self._chk(self.clib.Initialize(b"."))
         xpx, ypx = _int_ptr(), _int_ptr()
         self._chk(self.clib.GetDetector(xpx, ypx))
         self.shape = [xpx.contents.value, ypx.contents.value]
@@ -127,6 +258,9 @@ class AndorCamera(camera.Camera):
         self.set_bins(1)
         self.use_noise_filter = kwargs.get('use_noise_filter', False)
         self.wait_for_temp = kwargs.get('wait_for_temp', True)
+        self.set_readout_mode(kwargs.get('readout_mode', 'latest'))
+        if kwargs.get('driver_event', False):
+            self._enable_driver_event()
 
         # Set default acquisition and trigger modes
         self.set_acquisition_mode('continuous')
@@ -174,6 +308,7 @@ class AndorCamera(camera.Camera):
             'temp_control': True,
             'temp_range': [min_.value, max_.value],
             'shutter': True,
+            'depth': 8*self.native_dtype.itemsize,
         }
         self.props.update(new_props)
 
@@ -208,6 +343,10 @@ class AndorCamera(camera.Camera):
                     result = raw_input("Are you sure you want to exit? y/[n] >>> ")
                     if result.lower() == 'y':
                         break
+        if self._events is not None:
+            self.clib.SetDriverEvent(None)
+            self._events.close()
+            self._events = None
         self._chk(self.clib.ShutDown())
 
     # Image acquisition
@@ -227,48 +366,444 @@ class AndorCamera(camera.Camera):
         if mode == 'continuous':
             self._chk(self.clib.SetKineticCycleTime(0))
 
-    def _acquire_image_data(self):
-        """Acquire the most recent image data from the camera. This
-        will work best in single image acquisition mode.
+    def _get_frame_format(self):
+        """Return the shape and dtype of images for the current crop
+        and binning settings. In fast kinetics mode, images span the
+        width of the sensor and the height of the exposed band.
 
         """
-        # TODO: Check that acquisition was actually started!
-        
-        # Wait for acquisition to finish
-        #self.clib.WaitForAcquisition()
-        while False:
-            status = ctypes.c_int(0)
-            self.clib.GetStatus(ctypes.pointer(status))
-            if ANDOR_CODES[status.value] != 'DRV_SUCCESS':
-                print(ANDOR_CODES[status.value])
-            else:
-                break
-            time.sleep(0.1)
+        if self.acq_mode == 'fast kinetics' and self.fast_kinetics:
+            return ((self.fast_kinetics[0]//self.bins, self.shape[0]//self.bins),
+                    self.native_dtype)
+        nx = (self.crop[1] - self.crop[0] + 1)//self.bins
+        ny = (self.crop[3] - self.crop[2] + 1)//self.bins
+        return (ny, nx), self.native_dtype
+
+    def set_readout_mode(self, mode):
+        """Set how images are read in continuous acquisition mode.
+
+        Parameters
+        ----------
+        mode : str
+            'latest' to read the most recent image, silently skipping
+            any images acquired since the previous read. 'ordered' to
+            read every image from the SDK's circular buffer in order,
+            in batches where possible. Images which were overwritten
+            before they could be read show up as gaps in the sequence
+            numbers of the frame metadata. Their sequence numbers are
+            also recorded as (first, last) ranges in the list
+            :attr:`missed_frames`.
 
-        # Allocate image storage
-        img_size = self.shape[0]*self.shape[1]/self.bins**2
-        c_array = ctypes.c_long*img_size
-        c_img = c_array()
+        """
+        if mode not in self._readout_modes:
+            raise AndorError(
+                "Readout mode must be one of " + repr(self._readout_modes))
+        self.logger.info("Setting readout mode to " + mode)
+        self.readout_mode = mode
+
+    def _ordered(self):
+        """Return True if images are to be read in order from the
+        circular buffer.
+
+        """
+        return self.readout_mode == 'ordered' and self.acq_mode == 'continuous'
+
+    def _acquire_image_data(self, out):
+        """Acquire the most recent image data from the camera. This
+        will work best in single image acquisition mode. In ordered
+        readout mode, read the oldest unread image instead.
+
+        """
+        if self._ordered():
+            return self._read_ordered(out[np.newaxis])
+
+        stats = self._stats
+        if stats is not None:
+            t = timestamp_ns()
+
+        # The noise filter needs 32 bit input and output, so read into
+        # a scratch buffer first if it is to be applied. Otherwise,
+        # the SDK writes directly into out.
+        img_size = out.size
+        c_long_p = ctypes.POINTER(ctypes.c_int32)
+        if self.use_noise_filter:
+            if self._raw_img is None or self._raw_img.shape != out.shape:
+                self._raw_img = np.empty(out.shape, np.int32)
+                self._filtered_img = np.empty(out.shape, np.int32)
+            raw = self._raw_img
+            read_image = self.clib.GetMostRecentImage
+            c_pixel_p = c_long_p
+        else:
+            raw = out
+            read_image = getattr(self.clib, self._read_image)
+            c_pixel_p = ctypes.POINTER(self._c_pixel)
 
         # Trigger or wait for a trigger then acquire data
         if self.trigger_mode == self._trigger_modes['software']:
             self._chk(self.clib.SendSoftwareTrigger())
-        self.clib.WaitForAcquisition()
-        self._chk(self.clib.GetMostRecentImage(ctypes.pointer(c_img), ctypes.c_ulong(img_size)))
+            if stats is not None:
+                t = stats.lap('trigger', t)
+        if not self._wait_for_acquisition():
+            raise AndorError("Acquisition is not running.")
+        if stats is not None:
+            t = stats.lap('wait', t)
+        self._chk(read_image(
+            raw.ctypes.data_as(c_pixel_p), ctypes.c_ulong(img_size)))
+        if stats is not None:
+            t = stats.lap('readout', t)
 
         # Apply noise filter if requested.
         if self.use_noise_filter:
-            c_img_filtered = c_array()
-            self._chk(self.clib.PostProcessNoiseFilter(
-                ctypes.pointer(c_img), ctypes.pointer(c_img_filtered),
-                ctypes.sizeof(c_img), 0, 1, 0,
-                self.shape[0], self.shape[1]))
-            c_img = c_img_filtered
-
-        # Pythonize and return.
-        img_array = np.frombuffer(c_img, dtype=ctypes.c_long)
-        img_array.shape = np.array(self.shape)/self.bins
-        return img_array
+            self._noise_filter(raw, out)
+            if stats is not None:
+                stats.lap('noise filter', t)
+        return out
+
+    def _noise_filter(self, raw, out):
+        """Apply the SDK's median noise filter to the 32 bit image raw
+        and store the result in out.
+
+        """
+        c_long_p = ctypes.POINTER(ctypes.c_int32)
+        filtered = self._filtered_img
+        self._chk(self.clib.PostProcessNoiseFilter(
+            raw.ctypes.data_as(c_long_p),
+            filtered.ctypes.data_as(c_long_p),
+            raw.nbytes, 0, 1, 0,
+            out.shape[1], out.shape[0]))
+        np.copyto(out, filtered, casting='unsafe')
+
+    def _read_ordered(self, out):
+        """Fill the 3D array out with the oldest unread images from
+        the circular buffer, waiting for new images as necessary.
+        Consecutive images are transferred with a single call to
+        GetImages16 (or GetImages).
+
+        """
+        stats = self._stats
+        if stats is not None:
+            t = timestamp_ns()
+        frame_size = out[0].size
+        first, last = ctypes.c_int32(), ctypes.c_int32()
+        valid_first, valid_last = ctypes.c_int32(), ctypes.c_int32()
+        read_images = getattr(self.clib, self._read_images)
+        c_pixel_p = ctypes.POINTER(self._c_pixel)
+        indices = np.empty(len(out), np.int64)
+        i = 0
+        while i < len(out):
+            status = self.clib.GetNumberNewImages(
+                ctypes.byref(first), ctypes.byref(last))
+            if status == ANDOR_STATUS['DRV_NO_NEW_DATA']:
+                if self.trigger_mode == self._trigger_modes['software']:
+                    self._chk(self.clib.SendSoftwareTrigger())
+                if not self._wait_for_acquisition():
+                    raise AndorError("Acquisition is not running.")
+                if stats is not None:
+                    t = stats.lap('wait', t)
+                continue
+            self._chk(status)
+            n = min(last.value - first.value + 1, len(out) - i)
+            status = read_images(
+                first, ctypes.c_int32(first.value + n - 1),
+                out[i:i + n].ctypes.data_as(c_pixel_p),
+                ctypes.c_ulong(n*frame_size),
+                ctypes.byref(valid_first), ctypes.byref(valid_last))
+            if status == ANDOR_STATUS['DRV_P1INVALID']:
+                # The oldest image was overwritten in the meantime.
+                continue
+            self._chk(status)
+            if valid_first.value > self._next_index:
+                self._record_missed(self._next_index, valid_first.value - 1)
+            n = valid_last.value - valid_first.value + 1
+            indices[i:i + n] = np.arange(valid_first.value, valid_last.value + 1)
+            self._next_index = valid_last.value + 1
+            i += n
+            if stats is not None:
+                t = stats.lap('readout', t)
+        if self.use_noise_filter:
+            if self._raw_img is None or self._raw_img.shape != out[0].shape:
+                self._raw_img = np.empty(out[0].shape, np.int32)
+                self._filtered_img = np.empty(out[0].shape, np.int32)
+            for img in out:
+                self._raw_img[...] = img
+                self._noise_filter(self._raw_img, img)
+            if stats is not None:
+                stats.lap('noise filter', t)
+        self._ordered_indices = indices
+        return out
+
+    def _record_missed(self, first, last):
+        """Record that the images with series indices first to last
+        were overwritten before they could be read.
+
+        """
+        first += self._series_offset
+        last += self._series_offset
+        self.logger.warning(
+            "Missed %i images (%i to %i)" % (last - first + 1, first, last))
+        self.missed_frames.append((first, last))
+        if self._stats is not None:
+            self._stats.dropped += last - first + 1
+
+    def _make_metadata(self, n):
+        """Return metadata for n images. Images read in order from
+        the circular buffer are numbered by their position in the
+        acquisition, so that missed images leave gaps in the sequence
+        numbers.
+
+        """
+        meta = super(AndorCamera, self)._make_metadata(n)
+        indices = self._ordered_indices
+        if indices is not None and len(indices) == n:
+            meta['sequence'] = self._series_offset + indices
+            self._sequence = int(meta['sequence'][-1]) + 1
+        self._ordered_indices = None
+        return meta
+
+    def _acquire_image_stack(self, out):
+        """Acquire a series of images. In (fast) kinetics mode, the
+        whole series is acquired as a kinetic series and transferred
+        with a single call to GetAcquiredData. In ordered continuous
+        readout, as many images as are available are transferred at
+        once. Otherwise, images are read one at a time.
+
+        """
+        if self._ordered():
+            return self._read_ordered(out)
+        if self.acq_mode not in ('kinetics', 'fast kinetics'):
+            return super(AndorCamera, self)._acquire_image_stack(out)
+        stats = self._stats
+        if stats is not None:
+            t = timestamp_ns()
+        if self._armed:
+            if len(out) != self.n_kinetics:
+                raise AndorError(
+                    "The armed series has %i images, not %i" % (
+                        self.n_kinetics, len(out)))
+        else:
+            if len(out) != self.n_kinetics:
+                self._set_series_length(len(out))
+            self._chk(self.clib.StartAcquisition())
+        try:
+            if self.trigger_mode == self._trigger_modes['software']:
+                # Each trigger starts a single scan of the series.
+                for i in range(len(out)):
+                    self._chk(self.clib.SendSoftwareTrigger())
+                    self._wait_for_acquisition()
+            self._wait_for_series(len(out))
+        except BaseException:
+            # Don't leave the series running for the next call to
+            # find.
+            self.clib.AbortAcquisition()
+            self._armed = False
+            raise
+        self._armed = False
+        if stats is not None:
+            t = stats.lap('wait series', t)
+        self._chk(getattr(self.clib, self._read_series)(
+            out.ctypes.data_as(ctypes.POINTER(self._c_pixel)),
+            ctypes.c_ulong(out.size)))
+        if stats is not None:
+            stats.lap('readout series', t)
+        return out
+
+    def _wait_for_series(self, n):
+        """Wait until the camera has finished acquiring a series of n
+        images.
+
+        """
+        # A fast kinetics series is acquired as a single image.
+        if self.acq_mode == 'fast kinetics':
+            n = 1
+        acquired = ctypes.c_long()
+        while True:
+            self._chk(self.clib.GetTotalNumberImagesAcquired(
+                ctypes.pointer(acquired)))
+            if acquired.value >= n or not self._wait_for_acquisition():
+                break
+
+        # The status can still be DRV_ACQUIRING for a moment after the
+        # last image has arrived.
+        interval = self._poll_min
+        while self._is_acquiring():
+            self._check_cancelled()
+            time.sleep(interval)
+            interval = min(2*interval, self._poll_max)
+
+    # Waiting for images
+    # -------------------------------------------------------------------------
+
+    def _is_acquiring(self):
+        """Return True if an acquisition is in progress."""
+        status = ctypes.c_int()
+        self._chk(self.clib.GetStatus(ctypes.pointer(status)))
+        return status.value == ANDOR_STATUS['DRV_ACQUIRING']
+
+    def _wait_for_acquisition(self):
+        """Wait until the next image has been acquired. Returns False
+        if no acquisition is running.
+
+        Raises
+        ------
+        AcquisitionTimeout
+            If no image arrives within :attr:`wait_timeout` ms.
+        AcquisitionCancelled
+            If :meth:`cancel_wait` is called while waiting.
+
+        """
+        if self.wait_timeout is not None:
+            deadline = _timer() + self.wait_timeout/1000.
+        while True:
+            self._check_cancelled()
+            timeout = self._wait_slice
+            if self.wait_timeout is not None:
+                remaining = int(1000*(deadline - _timer()))
+                if remaining <= 0:
+                    raise AcquisitionTimeout(
+                        "No image within %g ms." % self.wait_timeout)
+                timeout = min(timeout, remaining)
+            if self._events is not None:
+                # The driver signals the event for all kinds of
+                # events, so check whether it was an image.
+                result = self._events.wait(timeout)
+                if result == 'timeout':
+                    continue
+                if result == 'cancelled':
+                    self._cancel.set()
+                    continue
+                timeout = 0
+            status = self.clib.WaitForAcquisitionTimeOut(timeout)
+            if status == ANDOR_STATUS['DRV_SUCCESS']:
+                return True
+            if status != ANDOR_STATUS['DRV_NO_NEW_DATA']:
+                self._chk(status)
+            elif not self._is_acquiring():
+                return False
+
+    def _cancel_wait(self):
+        """Abort a pending WaitForAcquisitionTimeOut."""
+        if self._events is not None:
+            self._events.cancel()
+        else:
+            self.clib.CancelWait()
+
+    def _enable_driver_event(self):
+        """Have the driver signal a Win32 event for new images."""
+        if not hasattr(ctypes, 'windll'):
+            self.logger.warning("Driver events are only available on Windows.")
+            return
+        events = _DriverEvents()
+        status = self.clib.SetDriverEvent(events.driver)
+        if status != ANDOR_STATUS['DRV_SUCCESS']:
+            self.logger.warning(
+                "SetDriverEvent failed with " + ANDOR_CODES.get(status, str(status)))
+            events.close()
+            return
+        self._events = events
+
+    # Kinetic series
+    # -------------------------------------------------------------------------
+
+    # A kinetic series is configured once, armed with start() and
+    # read with get_series() (or get_images(n_kinetics)). The whole
+    # series is transferred into one (n, height, width) array with a
+    # single call to GetAcquiredData16. When not armed beforehand,
+    # get_images starts the series itself.
+
+    def configure_kinetics(self, n, cycle_time=0., trigger=None):
+        """Configure acquisition of a kinetic series of n full
+        images.
+
+        Parameters
+        ----------
+        n : int
+            Number of images in the series.
+        cycle_time : float
+            Time between the starts of consecutive exposures in ms
+            with internal triggering. The SDK uses the shortest
+            possible cycle time if this is too short. Default: 0.
+        trigger : str or None
+            If given, the trigger mode to use, e.g., 'external' to
+            take each image of the series on an external trigger.
+
+        """
+        if n < 1:
+            raise AndorError("A kinetic series needs at least one image.")
+        self.set_acquisition_mode('kinetics')
+        if trigger is not None:
+            self.set_trigger_mode(trigger)
+        self.kinetic_cycle_time = cycle_time
+        self._chk(self.clib.SetKineticCycleTime(
+            ctypes.c_float(cycle_time/1000.)))
+        self._set_series_length(n)
+
+    def configure_fast_kinetics(self, n, rows, offset=None, trigger=None):
+        """Configure a fast kinetics series of n sub-images. Only a
+        band of rows of the sensor is exposed; after each exposure the
+        charge is shifted under the masked part of the sensor, which
+        is much faster than reading out, and the whole series is read
+        out at the end.
+
+        Parameters
+        ----------
+        n : int
+            Number of sub-images in the series.
+        rows : int
+            Height of the exposed band (and of each sub-image before
+            binning). n*rows must not exceed the height of the
+            sensor.
+        offset : int or None
+            Row of the sensor (counting from 0 at the bottom) at which
+            the exposed band starts. Defaults to the top of the
+            sensor.
+        trigger : str or None
+            If given, the trigger mode to use.
+
+        """
+        if n < 1 or rows < 1 or n*rows > self.shape[1]:
+            raise AndorError(
+                "%i sub-images of %i rows do not fit on the sensor." % (n, rows))
+        if offset is None:
+            offset = self.shape[1] - rows
+        if not 0 <= offset <= self.shape[1] - rows:
+            raise AndorError("Invalid fast kinetics offset %i." % offset)
+        self.set_acquisition_mode('fast kinetics')
+        if trigger is not None:
+            self.set_trigger_mode(trigger)
+        self.fast_kinetics = (rows, offset)
+        self._set_series_length(n)
+
+    def _set_series_length(self, n):
+        """Set the number of images of the kinetic series."""
+        self.n_kinetics = n
+        if self.acq_mode == 'fast kinetics':
+            self._update_fast_kinetics()
+        else:
+            self._chk(self.clib.SetNumberKinetics(n))
+
+    def _update_fast_kinetics(self):
+        """Apply the fast kinetics settings along with the current
+        exposure time and binning.
+
+        """
+        if self.fast_kinetics is None:
+            raise AndorError(
+                "Fast kinetics must be set up with configure_fast_kinetics.")
+        rows, offset = self.fast_kinetics
+        self.logger.info(
+            "Setting fast kinetics to %i images of %i rows at offset %i" % (
+                self.n_kinetics, rows, offset))
+        self._chk(self.clib.SetFastKineticsEx(
+            rows, self.n_kinetics, ctypes.c_float(self.t_ms/1000.), 4,
+            self.bins, self.bins, offset))
+
+    def get_series(self, metadata=False):
+        """Acquire (or, if armed with :meth:`start`, wait for) the
+        configured kinetic series and return it as one array of shape
+        (n_kinetics, height, width). See :meth:`get_images`.
+
+        """
+        return self.get_images(self.n_kinetics, metadata=metadata)
 
     # Triggering
     # -------------------------------------------------------------------------
@@ -301,10 +836,15 @@ class AndorCamera(camera.Camera):
         """Start accepting triggers."""
         self.logger.info('Calling StartAcquisition()')
         self._chk(self.clib.StartAcquisition())
+        self._armed = self.acq_mode in ('kinetics', 'fast kinetics')
+        # Series indices restart at 1 with every acquisition.
+        self._next_index = 1
+        self._series_offset = self._sequence - 1
 
     def stop(self):
         """Stop acquisition."""
         self.logger.info('Calling AbortAcquisition()')
+        self._armed = False
         status = self.clib.AbortAcquisition()
         if status != ANDOR_STATUS['DRV_IDLE']:
             self._chk(status)
@@ -329,6 +869,8 @@ class AndorCamera(camera.Camera):
         t_s = self.t_ms/1000.
         self.logger.info('Setting exposure time to %.03f s.' % t_s)
         self._chk(self.clib.SetExposureTime(ctypes.c_float(t_s)))
+        if self.acq_mode == 'fast kinetics' and self.fast_kinetics:
+            self._update_fast_kinetics()
 
         exposure = ctypes.c_float()
         accumulate = ctypes.c_float()
@@ -433,9 +975,7 @@ class AndorCamera(camera.Camera):
 
         """
         self.logger.info("Setting new crop to: " + ', '.join([str(x) for x in crop]))
-        self._chk(self.clib.SetImage(
-            self.bins, self.bins,
-            self.crop[0], self.crop[1], self.crop[2], self.crop[3]))
+        self._set_image()
         #self._chk(self.clib.SetIsolatedCropMode(
         #    1, self.crop[3], self.crop[1], self.crop[2], self.crop[0]))
             
@@ -444,9 +984,33 @@ class AndorCamera(camera.Camera):
         """Set binning to bins x bins."""
         self.bins = bins
         self.logger.info('Updating binning to ' + str(bins))
+        self._set_image()
+
+    def _set_image(self):
+        """Write the current bins and crop to the hardware."""
         self._chk(self.clib.SetImage(
             self.bins, self.bins,
             self.crop[0], self.crop[1], self.crop[2], self.crop[3]))
+        if self.acq_mode == 'fast kinetics' and self.fast_kinetics:
+            self._update_fast_kinetics()
+
+    def _apply_settings(self, settings):
+        """Apply changes of the crop and bins with a single call to
+        SetImage.
+
+        """
+        if self.real_camera and ('crop' in settings or 'bins' in settings):
+            settings = dict(settings)
+            if 'crop' in settings:
+                crop = settings.pop('crop')
+                self._check_crop(crop)
+                self.crop = crop
+                self.pool.clear()
+            self.bins = settings.pop('bins', self.bins)
+            self.logger.info(
+                "Setting crop to %s and binning to %i" % (repr(self.crop), self.bins))
+            self._set_image()
+        super(AndorCamera, self)._apply_settings(settings)
             
 if __name__ == "__main__":
     import logging
@@ -8,15 +8,21 @@ all subsequent cameras should be based on.
 from __future__ import print_function, division
 
 from abc import ABCMeta, abstractmethod
+from contextlib import contextmanager
 import logging
+import threading
 import time
 
 import numpy as np
 import numpy.random as npr
 
-from .ring_buffer import RingBuffer
+from .ring_buffer import RING_BUFFERS
+from .frame_pool import FramePool
+from .frame import Frame, FRAME_DTYPE, timestamp_ns
+from .simulation import SimulatedSensor
+from .stats import AcquisitionStats
 from .camprops import CameraProperties
-from .exceptions import CameraError
+from .exceptions import CameraError, AcquisitionCancelled
 
 class DummyDLL(object):
     """Fake library reference. This will return a default value for
@@ -31,6 +37,39 @@ class DummyDLL(object):
         setattr(self, name, lambda *args: self.success)
         return self.name
 
+class _Configuration(object):
+    """Settings collected by :meth:`Camera.configure` and applied
+    with :meth:`Camera.apply` at the end of the with block.
+
+    """
+    def __init__(self, cam):
+        object.__setattr__(self, '_cam', cam)
+        object.__setattr__(self, 'settings', {})
+        object.__setattr__(self, 'changed', None)
+
+    def __setattr__(self, name, value):
+        if not callable(getattr(self._cam, 'set_' + name, None)):
+            raise CameraError("Unknown setting: " + name)
+        self.settings[name] = value
+
+    def __getattr__(self, name):
+        try:
+            return self.settings[name]
+        except KeyError:
+            raise AttributeError(name)
+
+    def update(self, **settings):
+        """Set several settings at once."""
+        for name, value in settings.items():
+            setattr(self, name, value)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type_, value, traceback):
+        if type_ is None:
+            object.__setattr__(self, 'changed', self._cam.apply(**self.settings))
+
 class Camera:
     """Base class for all cameras.
 
@@ -68,8 +107,19 @@ class Camera:
     trigger_mode : int
         Camera triggering mode. These are obviously defined
         differently depending on the particular camera's SDK.
+    waiting_for_trigger : bool
+        True while the camera waits for an external trigger to
+        acquire the next image, for cameras which report it.
     rbuffer : RingBuffer
         The RingBuffer object for autosaving of images.
+    pool : FramePool
+        Pool of preallocated image buffers used by :meth:`get_image`.
+    native_dtype : np.dtype
+        Data type of the image data delivered by the camera.
+    sim : SimulatedSensor or None
+        Image generator used when the camera is simulated.
+    _stats : AcquisitionStats or None
+        Timing statistics of the acquisition, or None when disabled.
     real_camera : bool
         When set to False, the camera hardware can be simulated for working in
         offline mode.
@@ -96,7 +146,12 @@ class Camera:
     temperature_set_point = 0
     acq_mode = "single"
     trigger_mode = 0
+    waiting_for_trigger = False
     rbuffer = None
+    pool = None
+    native_dtype = np.dtype(np.uint16)
+    sim = None
+    _stats = None
     real_camera = True
     props = CameraProperties()
 
@@ -118,39 +173,81 @@ class Camera:
         buffer_dir : str
             Directory to store the ring buffer file to. Default:
             '.'.
+        buffer_backend : str
+            Where to keep the ring buffer: 'hdf5' writes every image
+            to disk, 'memory' keeps them in memory until saved with
+            :meth:`MemoryRingBuffer.snapshot`. Default: 'hdf5'.
+        buffer_options : dict
+            Additional keyword arguments for the
+            :class:`RingBuffer`, e.g., ``{'threaded': True}`` to
+            write images to disk from a background thread.
         logger : str
             Name of the logger to use. Defaults to 'Camera'.
         success_value : int
             Success value to give to the DummyDLL class.
+        sdk : object
+            Library to use instead of loading the vendor's shared
+            library when the camera is real, e.g., one of the
+            stand-ins from :mod:`qcamera.fake_sdk`.
+        simulation : dict
+            Keyword arguments for the :class:`SimulatedSensor` used
+            when the camera is not real, e.g., ``{'seed': 0, 'pacing':
+            'free'}``.
+        stats : bool
+            Collect timing statistics of the acquisition (see
+            :meth:`stats`). Default: False.
+        wait_timeout : float or None
+            Time in ms to wait for an image (e.g., for a trigger)
+            before raising :class:`AcquisitionTimeout`, for cameras
+            which support it. None waits indefinitely. Default: None.
 
         """
         # Get kwargs and set defaults
         bins = kwargs.get('bins', 1)
         real = kwargs.get('real', True)
         buffer_dir = kwargs.get('buffer_dir', '.')
+        buffer_backend = kwargs.get('buffer_backend', 'hdf5')
+        buffer_options = kwargs.get('buffer_options', {})
         recording = kwargs.get('recording', True)
         logger = kwargs.get('logger', 'Camera')
         success_value = kwargs.get('success_value', 0)
+        simulation = kwargs.get('simulation', {})
+        stats = kwargs.get('stats', False)
+        sdk = kwargs.get('sdk', None)
+        self.wait_timeout = kwargs.get('wait_timeout', None)
         
         # Check kwarg types are correct
         assert isinstance(bins, int)
         assert isinstance(real, (bool, int))
         assert isinstance(buffer_dir, str)
+        assert buffer_backend in RING_BUFFERS
+        assert isinstance(buffer_options, dict)
         assert isinstance(logger, str)
+        assert isinstance(simulation, dict)
 
         # Initialize
         self.logger = logging.getLogger(logger)
         self.logger.info(
             "Connecting to %s camera" % ("real" if real else "simulated"))
         self.real_camera = real
-        self.rbuffer = RingBuffer(directory=buffer_dir, recording=recording, roi=self.roi)
-        x0 = npr.randint(self.shape[0]/4, self.shape[0]/2)
-        y0 = npr.randint(self.shape[1]/4, self.shape[1]/2)
-        self.sim_img_center = (x0, y0)
+        self.pool = FramePool()
+        self._sequence = 0
+        self._cancel = threading.Event()
+        self._cancel_lock = threading.Lock()
+        self._acquisitions = 0
+        self.rbuffer = RING_BUFFERS[buffer_backend](
+            directory=buffer_dir, recording=recording, roi=self.roi,
+            pool=self.pool, **buffer_options)
         if self.real_camera:
+            self.clib = sdk
             self._initialize(**kwargs)
         else:
             self.clib = DummyDLL(success_value)
+            x0 = npr.randint(self.shape[0]/4, self.shape[0]/2)
+            y0 = npr.randint(self.shape[1]/4, self.shape[1]/2)
+            simulation.setdefault('center', (x0, y0))
+            self.sim = SimulatedSensor(self.shape, self.native_dtype, **simulation)
+        self.enable_stats(stats)
         self.get_camera_properties()
         self.logger.debug(self.props)
 
@@ -190,48 +287,482 @@ class Camera:
     def set_acquisition_mode(self, mode):
         """Set the image acquisition mode."""
 
-    def get_image(self):
+    def get_frame_format(self):
+        """Return the shape and dtype of the images returned by
+        :meth:`get_image` with the current settings.
+
+        """
+        if not self.real_camera:
+            return self.sim.get_frame_format(self.crop, self.bins)
+        return self._get_frame_format()
+
+    def _get_frame_format(self):
+        """Code for determining the shape and dtype of the image data
+        for the current camera settings should be placed here. This
+        must return a tuple of the form (shape, dtype).
+
+        """
+        raise NotImplementedError("You must define this method.")
+
+    def get_image(self, out=None, metadata=False):
         """Acquire the current image from the camera and write it to
         the ring buffer. This function should *not* be overwritten by
         child classes. Instead, everything necessary to acquire an
         image from the camera should be added to the
         :meth:`_acquire_image_data` method.
 
+        Unless out is given, the image is stored in a buffer taken
+        from the camera's :class:`FramePool`. Callers that are
+        finished with the image can hand it back with
+        :meth:`release` so that the buffer can be reused.
+
+        Parameters
+        ----------
+        out : np.ndarray or None
+            If given, an array to store the image in. It must match
+            the shape and dtype given by :meth:`get_frame_format`.
+        metadata : bool
+            If True, return a :class:`Frame` holding the image along
+            with its timestamp, sequence number and the camera
+            settings.
+
         """
-        if not self.real_camera:
-            x0, y0 = self.sim_img_center
-            img = self._get_simulated_image(x0, y0)
-        else:
-            img = self._acquire_image_data()
-        self.rbuffer.write(img)
-        return img
+        with self._acquisition():
+            stats = self._stats
+            if stats is not None:
+                t0 = t = timestamp_ns()
+            shape, dtype = self.get_frame_format()
+            out = self._get_output_array(tuple(shape), dtype, out)
+            if stats is not None:
+                t = stats.lap('setup', t)
+            if not self.real_camera:
+                self._get_simulated_image(out)
+            else:
+                self._acquire_image_data(out)
+            if stats is not None:
+                t = stats.lap('acquire', t)
+            meta = self._make_metadata(1)
+            self.rbuffer.write(out, meta)
+            if stats is not None:
+                stats.lap('get_image', t0)
+                stats.add_frames(1, out.nbytes)
+            if metadata:
+                return Frame.from_record(out, meta[0])
+            return out
+
+    def get_images(self, n, out=None, metadata=False):
+        """Acquire n images and write them to the ring buffer as one
+        batch. Like :meth:`get_image`, this should not be overwritten
+        by child classes. Cameras which can read out a series of
+        images at once should instead override
+        :meth:`_acquire_image_stack`.
+
+        Parameters
+        ----------
+        n : int
+            Number of images to acquire.
+        out : np.ndarray or None
+            If given, an array of shape (n, height, width) to store
+            the images in. Otherwise, a pooled buffer is used.
+        metadata : bool
+            If True, also return the metadata of the images.
+
+        Returns
+        -------
+        out : np.ndarray
+            The images stacked along the first axis.
+        meta : np.ndarray
+            Only if metadata is True: a structured array of dtype
+            :data:`FRAME_DTYPE` with one record per image. All images
+            of a batch share the timestamp of the batch readout.
+
+        """
+        with self._acquisition():
+            assert n > 0
+            stats = self._stats
+            if stats is not None:
+                t0 = t = timestamp_ns()
+            shape, dtype = self.get_frame_format()
+            out = self._get_output_array((n,) + tuple(shape), dtype, out)
+            if not self.real_camera:
+                self.sim.expose(out, self.t_ms, self.crop, self.bins)
+                if not self.sim.wait(self.t_ms, n, cancel=self._cancel):
+                    self._check_cancelled()
+            else:
+                self._acquire_image_stack(out)
+            if stats is not None:
+                t = stats.lap('acquire stack', t)
+            meta = self._make_metadata(n)
+            self.rbuffer.write_many(out, meta)
+            if stats is not None:
+                stats.lap('get_images', t0)
+                stats.add_frames(n, out.nbytes)
+            if metadata:
+                return out, meta
+            return out
+
+    def stream(self, max_frames=None, timeout=None, metadata=False):
+        """Continuously acquire images, yielding them one at a
+        time. The camera is started before the first image and
+        stopped when the stream ends, including when the consumer
+        stops iterating early.
+
+        Images are only acquired when the consumer asks for the next
+        one, so a slow consumer naturally slows down acquisition
+        rather than causing images to pile up in memory. Each image
+        is handed back to the frame pool when the consumer advances
+        to the next one; use :meth:`retain` (and later
+        :meth:`release`) to keep an image for longer, or copy it.
+
+        Parameters
+        ----------
+        max_frames : int or None
+            Stop after this many images. If None, continue
+            indefinitely.
+        timeout : float or None
+            Stop after this many seconds. If None, continue
+            indefinitely.
+        metadata : bool
+            If True, yield :class:`Frame` objects instead of bare
+            arrays.
+
+        Example
+        -------
+        ::
+
+            for img in cam.stream(max_frames=1000):
+                process(img)
+
+        """
+        if timeout is not None:
+            t_stop = time.time() + timeout
+        count = 0
+        self.start()
+        try:
+            while max_frames is None or count < max_frames:
+                if timeout is not None and time.time() >= t_stop:
+                    break
+                img = self.get_image(metadata=metadata)
+                count += 1
+                yield img
+                self.release(img.data if metadata else img)
+        finally:
+            self.stop()
+
+    def get_view(self, metadata=False):
+        """Acquire the next image like :meth:`get_image`, but return a
+        read-only view of the driver buffer holding it instead of a
+        copy, for cameras which support this.
+
+        The buffer is lent to the caller: the camera does not reuse
+        it, and the view remains valid, until it is handed back with
+        :meth:`release_view`. Views can be released in any order, but
+        every held view leaves the camera with one buffer less to
+        acquire images into, so they should be released promptly.
+        Changing settings which alter the image shape invalidates all
+        views.
+
+        Other cameras, and simulated ones, return a copy as
+        :meth:`get_image` does.
+
+        """
+        with self._acquisition():
+            view = None
+            if self.real_camera:
+                stats = self._stats
+                if stats is not None:
+                    t0 = t = timestamp_ns()
+                view = self._acquire_view()
+            if view is None:
+                return self.get_image(metadata=metadata)
+            if stats is not None:
+                t = stats.lap('acquire', t)
+            meta = self._make_metadata(1)
+            self.rbuffer.write(view, meta)
+            if stats is not None:
+                stats.lap('get_image', t0)
+                stats.add_frames(1, view.nbytes)
+            if metadata:
+                return Frame.from_record(view, meta[0])
+            return view
+
+    def release_view(self, img):
+        """Hand a view (or :class:`Frame`) returned by
+        :meth:`get_view` back to the camera so that its buffer can be
+        reused. Anything else is passed on to :meth:`release`.
+
+        """
+        if isinstance(img, Frame):
+            img = img.data
+        if not (self.real_camera and self._release_view(img)):
+            self.release(img)
+
+    def _acquire_view(self):
+        """Cameras which can lend their buffers to the caller of
+        :meth:`get_view` should wait for the next image here and
+        return a read-only view of the buffer holding it. Returning
+        None makes :meth:`get_view` return a copy instead.
+
+        """
+        return None
+
+    def _release_view(self, img):
+        """Take back a buffer lent by :meth:`_acquire_view`. Returns
+        False if img is not one of the camera's views.
+
+        """
+        return False
+
+    def _make_metadata(self, n):
+        """Return metadata for n images which have just been read out
+        and advance the sequence counter.
+
+        """
+        meta = np.zeros(n, dtype=FRAME_DTYPE)
+        meta['timestamp'] = timestamp_ns()
+        meta['sequence'] = self._sequence + np.arange(n)
+        meta['exposure'] = self.t_ms
+        try:
+            meta['gain'] = self.gain
+        except (TypeError, ValueError):
+            meta['gain'] = np.nan
+        meta['bins'] = self.bins
+        meta['crop'] = self.crop
+        meta['roi'] = self.roi
+        self._sequence += n
+        return meta
+
+    def _get_output_array(self, shape, dtype, out):
+        """Return out after checking that it has the right shape and
+        dtype, or a pooled array if out is None.
+
+        """
+        if out is None:
+            return self.pool.acquire(shape, dtype)
+        if out.shape != shape or out.dtype != dtype:
+            raise CameraError(
+                "out must have shape %s and dtype %s" % (str(shape), dtype))
+        return out
 
-    def _acquire_image_data(self):
+    def retain(self, img):
+        """Keep an image returned by :meth:`get_image` from being
+        reused until a matching call to :meth:`release`.
+
+        """
+        return self.pool.retain(img)
+
+    def release(self, img):
+        """Signal that an image returned by :meth:`get_image` is no
+        longer needed so that its buffer can be reused.
+
+        """
+        self.pool.release(img)
+
+    def enable_stats(self, enabled=True):
+        """Start collecting timing statistics of the acquisition,
+        discarding any previously collected ones, or stop collecting
+        them if enabled is False.
+
+        """
+        self._stats = AcquisitionStats() if enabled else None
+        self.rbuffer.stats = self._stats
+
+    def stats(self):
+        """Return the statistics collected since they were enabled,
+        or None if they are disabled.
+
+        The result is a dict with the keys
+
+        * ``frames``, ``bytes``: number of frames and bytes acquired
+        * ``elapsed``: time in s between the first and last frame
+        * ``fps``, ``bytes_per_second``: achieved rates
+        * ``dropped``: frames lost by the camera or driver
+        * ``buffer_dropped``: frames discarded by the ring buffer
+        * ``stages``: latency summary per stage (see
+          :meth:`LatencyHistogram.summary`)
+
+        The stages recorded by all cameras are ``setup`` (getting an
+        output array), ``acquire`` (everything done by the driver),
+        ``get_image`` (total) and the ring buffer stages starting
+        with ``rbuffer``. Drivers add their own stages, such as
+        ``wait`` and ``readout``.
+
+        """
+        if self._stats is None:
+            return None
+        report = self._stats.report()
+        report['buffer_dropped'] = self.rbuffer.dropped
+        return report
+
+    def cancel_wait(self):
+        """Cancel waiting for an image. This is meant to be called
+        from another thread than the one acquiring images, which then
+        raises :class:`AcquisitionCancelled` from :meth:`get_image`
+        (or :meth:`get_images`). A cancellation only applies to the
+        acquisition in progress: if none is, or if it already has its
+        image, nothing happens. The camera keeps running.
+
+        Returns
+        -------
+        cancelled : bool
+            False if no acquisition was in progress.
+
+        """
+        with self._cancel_lock:
+            if not self._acquisitions:
+                return False
+            self._cancel.set()
+            if self.real_camera:
+                self._cancel_wait()
+            return True
+
+    @contextmanager
+    def _acquisition(self):
+        """Context for acquiring images which :meth:`cancel_wait` can
+        cancel. Any cancellation which did not end the acquisition is
+        discarded at the end.
+
+        """
+        with self._cancel_lock:
+            self._acquisitions += 1
+        try:
+            yield
+        finally:
+            with self._cancel_lock:
+                self._acquisitions -= 1
+                if not self._acquisitions:
+                    self._cancel.clear()
+
+    def _cancel_wait(self):
+        """Camera-specific code for waking up a thread blocked in
+        the SDK waiting for an image should go here.
+
+        """
+
+    def _check_cancelled(self):
+        """Raise AcquisitionCancelled if :meth:`cancel_wait` was
+        called since the last check.
+
+        """
+        if self._cancel.is_set():
+            self._cancel.clear()
+            raise AcquisitionCancelled("Waiting for an image was cancelled.")
+
+    def _acquire_image_data(self, out):
         """Code for getting image data from the camera should be
-        placed here. This must return a numpy array.
+        placed here. The image must be written into the numpy array
+        out which has the shape and dtype given by
+        :meth:`_get_frame_format`.
 
         """
         raise NotImplementedError("You must define this method.")
 
-    def _get_simulated_image(self, x0, y0):
-        """Generate and return a simulated image centered at the point
-        (x0, y0). This is primarily useful when testing out a full
-        control program so that there is a simulated camera with an
-        image to actually use.
-
-        """
-        g = lambda x, y, x0, y0, sigma: \
-            np.exp(-((x - x0)**2 + (y - y0)**2)/(2*sigma**2))
-        x = np.arange(0, self.shape[0])
-        y = np.arange(0, self.shape[1])
-        X, Y = np.meshgrid(x, y)
-        img = g(X, Y, x0, y0, 20)
-        img = self.t_ms*img/np.max(img)
-        img += self.t_ms*0.25*npr.random(self.shape)
-        wait_time = max(self.t_ms/1000., 0.05)
-        time.sleep(wait_time)
-        return img
+    def _acquire_image_stack(self, out):
+        """Acquire len(out) images into the 3D array out. By default,
+        this calls :meth:`_acquire_image_data` for each image. Cameras
+        with a native way of reading out a series of images should
+        override this.
+
+        """
+        for img in out:
+            self._acquire_image_data(img)
+        return out
+
+    def _get_simulated_image(self, out):
+        """Generate a simulated image and store it in out. This is
+        primarily useful when testing out a full control program so
+        that there is a simulated camera with an image to actually
+        use.
+
+        """
+        stats = self._stats
+        if stats is not None:
+            t = timestamp_ns()
+        self.sim.expose(out, self.t_ms, self.crop, self.bins)
+        if stats is not None:
+            t = stats.lap('simulate', t)
+        if not self.sim.wait(self.t_ms, cancel=self._cancel):
+            self._check_cancelled()
+        if stats is not None:
+            stats.lap('wait', t)
+        return out
         
+    # Configuration
+    # -------------------------------------------------------------------------
+
+    # Settings compared by apply() before changing them, in the order
+    # they are applied, and the attributes holding their values.
+    _settings = (
+        ('trigger_mode', 'trigger_mode'),
+        ('crop', 'crop'),
+        ('bins', 'bins'),
+        ('exposure_time', 't_ms'),
+        ('gain', 'gain'))
+
+    def configure(self):
+        """Return a context manager for changing several settings at
+        once with :meth:`apply`::
+
+            with cam.configure() as cfg:
+                cfg.exposure_time = 20
+                cfg.bins = 2
+
+        The settings are applied when the with block ends, unless it
+        ends with an exception. Afterwards, the ``changed`` attribute
+        of cfg holds the settings which were actually changed.
+
+        """
+        return _Configuration(self)
+
+    def apply(self, **settings):
+        """Change several settings at once. Each keyword names a
+        setter, e.g., ``cam.apply(exposure_time=10, bins=2)`` has the
+        same effect as calling ``cam.set_exposure_time(10)`` and
+        ``cam.set_bins(2)``. Settings which already have the given
+        value are skipped, and cameras which need to reconfigure the
+        hardware for each setting do so only once.
+
+        Returns
+        -------
+        changed : dict
+            The settings which were changed.
+
+        """
+        for name in settings:
+            if not callable(getattr(self, 'set_' + name, None)):
+                raise CameraError("Unknown setting: " + name)
+        changed = dict(
+            (name, value) for name, value in settings.items()
+            if self._setting_changed(name, value))
+        if changed:
+            self.logger.debug("Applying settings: " + repr(changed))
+            self._apply_settings(changed)
+        return changed
+
+    def _setting_changed(self, name, value):
+        """Return False if the setting name already has the given
+        value.
+
+        """
+        attr = dict(self._settings).get(name)
+        if attr is None:
+            return True
+        if name == 'trigger_mode' and isinstance(value, str):
+            value = getattr(self, '_trigger_modes', {}).get(value, value)
+        return not np.array_equal(value, getattr(self, attr))
+
+    def _apply_settings(self, settings):
+        """Apply the dict of changed settings by calling the setters
+        one by one. Cameras which can apply several settings with a
+        single hardware update should override this, handle the
+        settings they can and pass the rest on to this method.
+
+        """
+        order = [name for name, attr in self._settings]
+        for name in sorted(
+                settings, key=lambda x: order.index(x) if x in order else len(order)):
+            getattr(self, 'set_' + name)(settings[name])
+
     # Triggering
     # -------------------------------------------------------------------------
 
@@ -383,13 +914,18 @@ class Camera:
         instead of overriding this one.
 
         """
+        self._check_crop(crop)
+        self.crop = crop
+        self.pool.clear()
+        if self.real_camera:
+            self._update_crop(self.crop)
+
+    def _check_crop(self, crop):
+        """Raise an error if crop is not a valid crop setting."""
         assert crop[1] > crop[0]
         assert crop[3] > crop[2]
         if len(crop) != 4:
             raise CameraError("crop must be a length 4 array.")
-        self.crop = crop
-        if self.real_camera:
-            self._update_crop(self.crop)
 
     def reset_crop(self):
         """Reset the crop to the maximum size."""
@@ -0,0 +1,385 @@
+"""Acquisition engine
+
+The :class:`AcquisitionEngine` continuously acquires images from a
+camera in a dedicated producer thread. Images are published to a
+fixed ring of slots, each tagged with a sequence number. Any number
+of consumers can follow the stream with a :class:`FrameReader` which
+keeps track of which images it has seen and how many it has missed
+because the producer lapped it.
+
+Commands such as pausing or changing camera settings are queued and
+executed by the producer thread between frames, so that the camera
+is never reconfigured in the middle of an acquisition. While paused,
+the producer thread blocks on the command queue and therefore reacts
+to commands immediately. While it waits for an image (e.g., for a
+trigger which may never come), a new command interrupts the wait
+with :meth:`Camera.cancel_wait`, and :attr:`waiting_for_trigger` tells
+consumers that the camera is idle rather than stalled.
+
+"""
+
+from __future__ import print_function
+import logging
+import threading
+import time
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+from .camera import Camera
+from .exceptions import CameraError, AcquisitionCancelled
+
+class _Command(object):
+    """A command to be executed by the producer thread."""
+    def __init__(self, name, func=None, args=(), kwargs={}):
+        self.name = name
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+    def wait(self, timeout=None):
+        """Wait for the command to be executed and return its result
+        or raise the exception it raised.
+
+        """
+        if not self.done.wait(timeout):
+            raise CameraError("Timed out waiting for command " + self.name)
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+class AcquisitionEngine(object):
+    """Acquire images from a camera in a background thread.
+
+    Images are handed to consumers through a ring of n_slots slots.
+    An image stays valid at least until the producer has acquired
+    another n_slots images; consumers that need it for longer must
+    keep the reference they got from :meth:`FrameReader.get` (which
+    retains the image in the camera's frame pool) and release it when
+    done.
+
+    Attributes
+    ----------
+    cam : Camera
+        The camera to acquire images from.
+    n_slots : int
+        Number of slots in the ring.
+    paused : bool
+        True when the producer is not acquiring images.
+    errors : int
+        Number of failed acquisitions.
+    last_error : Exception or None
+        The most recent exception raised while acquiring.
+
+    """
+
+    def __init__(self, camera, n_slots=8, logger='AcquisitionEngine'):
+        assert isinstance(camera, Camera)
+        assert n_slots > 0
+        self.cam = camera
+        self.n_slots = n_slots
+        self.logger = logging.getLogger(logger)
+        self.paused = True
+        self.errors = 0
+        self.last_error = None
+        self._slots = [None]*n_slots
+        self._seq = 0
+        self._cond = threading.Condition()
+        self._commands = queue.Queue()
+        self._thread = None
+
+        # Set by the producer thread, under the lock, while it is
+        # acquiring an image.
+        self._acquiring = False
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, type_, value, tb):
+        self.stop()
+
+    # Thread control
+    # -------------------------------------------------------------------------
+
+    def start(self, paused=False):
+        """Start the producer thread. Unless paused is True, the
+        camera is started and acquisition begins immediately.
+
+        """
+        if self._thread is not None and self._thread.is_alive():
+            raise CameraError("The acquisition engine is already running.")
+        self._thread = threading.Thread(target=self._run, name='AcquisitionEngine')
+        self._thread.daemon = True
+        self._thread.start()
+        if not paused:
+            self.resume()
+
+    def stop(self):
+        """Stop acquiring, end the producer thread and release all
+        images still held in the ring.
+
+        """
+        if self._thread is None:
+            return
+        if self._thread.is_alive():
+            self._submit('stop').wait()
+            self._thread.join()
+        self._thread = None
+        for i, slot in enumerate(self._slots):
+            if slot is not None:
+                self.cam.release(slot[1])
+                self._slots[i] = None
+
+        # Wake up readers waiting for the next image.
+        with self._cond:
+            self._cond.notify_all()
+
+    def is_running(self):
+        """Return True if the producer thread is alive."""
+        return self._thread is not None and self._thread.is_alive()
+
+    @property
+    def waiting_for_trigger(self):
+        """True while the producer waits for the camera to be
+        triggered, for cameras which report it (see
+        :attr:`Camera.waiting_for_trigger`).
+
+        """
+        with self._lock:
+            return self._acquiring and self.cam.waiting_for_trigger
+
+    # Commands
+    # -------------------------------------------------------------------------
+
+    def _submit(self, name, func=None, *args, **kwargs):
+        """Queue a command for the producer thread."""
+        cmd = _Command(name, func, args, kwargs)
+        self._commands.put(cmd)
+
+        # Don't wait for the current image to arrive. The camera only
+        # accepts the cancellation once get_image is under way, so
+        # retry if the producer is just about to call it.
+        while True:
+            with self._lock:
+                if not self._acquiring or self.cam.cancel_wait():
+                    break
+            time.sleep(0.0001)
+        return cmd
+
+    def pause(self, wait=True):
+        """Stop the camera and stop acquiring images."""
+        cmd = self._submit('pause')
+        return cmd.wait() if wait else cmd
+
+    def resume(self, wait=True):
+        """Start the camera and resume acquiring images."""
+        cmd = self._submit('resume')
+        return cmd.wait() if wait else cmd
+
+    def call(self, func, *args, **kwargs):
+        """Execute func(*args, **kwargs) in the producer thread
+        between two frames and return the result.
+
+        """
+        return self._submit('call', func, *args, **kwargs).wait()
+
+    def reconfigure(self, **settings):
+        """Change camera settings between two frames with
+        :meth:`Camera.apply` and return the settings which were
+        changed. Each keyword names a setter of the camera, e.g.,
+        ``exposure_time=10`` results in a call to
+        ``cam.set_exposure_time(10)``.
+
+        """
+        return self.call(self.cam.apply, **settings)
+
+    def _execute(self, cmd):
+        """Execute a command in the producer thread. Returns False if
+        the thread should exit.
+
+        """
+        try:
+            if cmd.name == 'pause':
+                if not self.paused:
+                    self.cam.stop()
+                    self.paused = True
+            elif cmd.name == 'resume':
+                if self.paused:
+                    self.cam.start()
+                    self.paused = False
+            elif cmd.name == 'stop':
+                if not self.paused:
+                    self.cam.stop()
+                    self.paused = True
+            else:
+                cmd.result = cmd.func(*cmd.args, **cmd.kwargs)
+        except Exception as e:
+            cmd.error = e
+        cmd.done.set()
+        return cmd.name != 'stop'
+
+    # Producer
+    # -------------------------------------------------------------------------
+
+    def _run(self):
+        """Main loop of the producer thread."""
+        while True:
+            # Block while paused, otherwise only check for pending
+            # commands between frames.
+            try:
+                cmd = self._commands.get(block=self.paused)
+            except queue.Empty:
+                cmd = None
+            if cmd is not None:
+                if not self._execute(cmd):
+                    break
+                continue
+
+            # Acquire and publish the next image, unless a command
+            # arrived in the meantime.
+            with self._lock:
+                if not self._commands.empty():
+                    continue
+                self._acquiring = True
+            img = None
+            try:
+                img = self.cam.get_image()
+            except AcquisitionCancelled:
+                # A command is waiting.
+                pass
+            except Exception as e:
+                self.errors += 1
+                self.last_error = e
+                self.logger.exception("Error acquiring image")
+                with self._lock:
+                    self._acquiring = False
+                try:
+                    cmd = self._commands.get(timeout=0.01)
+                except queue.Empty:
+                    continue
+                if not self._execute(cmd):
+                    break
+                continue
+            with self._lock:
+                self._acquiring = False
+            if img is not None:
+                self._publish(img)
+
+    def _publish(self, img):
+        """Place an image in the next slot and wake up waiting
+        consumers.
+
+        """
+        seq = self._seq
+        index = seq % self.n_slots
+        old = self._slots[index]
+        self._slots[index] = (seq, img)
+        with self._cond:
+            self._seq = seq + 1
+            self._cond.notify_all()
+        if old is not None:
+            self.cam.release(old[1])
+
+    # Consumers
+    # -------------------------------------------------------------------------
+
+    def get_sequence_number(self):
+        """Return the sequence number the next image will have, i.e.,
+        the total number of images acquired so far.
+
+        """
+        return self._seq
+
+    def reader(self):
+        """Return a :class:`FrameReader` starting with the next image
+        to be acquired.
+
+        """
+        return FrameReader(self)
+
+    def _read_slot(self, seq):
+        """Return the image with sequence number seq, retained in the
+        frame pool, or None if it is no longer available.
+
+        """
+        slot = self._slots[seq % self.n_slots]
+        if slot is None or slot[0] != seq:
+            return None
+        img = slot[1]
+        if not self.cam.retain(img):
+            return None
+        if self._slots[seq % self.n_slots] is not slot:
+            # Overwritten while retaining
+            self.cam.release(img)
+            return None
+        return img
+
+    def _wait(self, seq, timeout):
+        """Wait until the image with sequence number seq has been
+        published. Returns False on timeout or if the engine is not
+        running.
+
+        """
+        with self._cond:
+            if self._seq <= seq and self.is_running():
+                self._cond.wait(timeout)
+            return self._seq > seq
+
+class FrameReader(object):
+    """Consumer side of an :class:`AcquisitionEngine`. Images are
+    returned in order. If the reader falls more than n_slots images
+    behind, it skips ahead to the oldest image still available and
+    counts the skipped images as dropped.
+
+    Attributes
+    ----------
+    next_seq : int
+        Sequence number of the next image to be returned.
+    dropped : int
+        Number of images skipped because they were overwritten before
+        being read.
+
+    """
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.next_seq = engine.get_sequence_number()
+        self.dropped = 0
+
+    def get(self, timeout=None):
+        """Return a tuple (seq, img) of the next image and its
+        sequence number, or None if no image arrives within timeout
+        seconds or the engine is stopped. The image is retained in the
+        camera's frame pool and must be handed back with
+        :meth:`release`.
+
+        """
+        engine = self.engine
+        while True:
+            latest = engine.get_sequence_number()
+            if self.next_seq >= latest:
+                if not engine._wait(self.next_seq, timeout):
+                    return None
+                continue
+            oldest = latest - engine.n_slots
+            if self.next_seq < oldest:
+                self.dropped += oldest - self.next_seq
+                self.next_seq = oldest
+            seq = self.next_seq
+            img = engine._read_slot(seq)
+            if img is None:
+                if not engine.is_running():
+                    return None
+                continue
+            self.next_seq = seq + 1
+            return seq, img
+
+    def release(self, img):
+        """Hand back an image obtained from :meth:`get`."""
+        self.engine.cam.release(img)
@@ -15,6 +15,17 @@ class CameraError(Exception):
     """Generic camera errors."""
     pass
 
+class AcquisitionTimeout(CameraError):
+    """No image arrived within the wait timeout."""
+    pass
+
+class AcquisitionCancelled(CameraError):
+    """Waiting for an image was cancelled with
+    :meth:`Camera.cancel_wait`.
+
+    """
+    pass
+
 class AndorError(CameraError):
     """Andor-specific errors."""
     pass
@@ -38,6 +49,10 @@ class CameraPropertiesError(Exception):
     """
     pass
 
+class RingBufferError(IndexError):
+    """Reading an image which is not in the ring buffer."""
+    pass
+
 # Warnings
 # ========
 
@@ -0,0 +1,1259 @@
+"""Stand-in SDK libraries
+
+:class:`DummyDLL` returns the same value for every call, so simulated
+cameras skip all of the driver code that talks to the SDK. The
+classes in this module instead mimic the contracts of the vendor
+libraries closely enough for the drivers to run their real code paths
+without any hardware::
+
+    from qcamera import AndorCamera
+    from qcamera.fake_sdk import FakeAndorSDK
+
+    cam = AndorCamera(sdk=FakeAndorSDK(), wait_for_temp=False)
+
+The functions take the same arguments as the C functions do when
+called through ctypes (plain integers, ctypes scalars, pointers and
+``byref`` references) and write their results and image data to the
+memory those point to. They return the status codes of the respective
+SDK. Images are generated by a :class:`SimulatedSensor` at the crop
+and binning configured through the SDK. Exposure and readout take real
+time, scaled by the ``time_scale`` argument (0 makes every frame
+available immediately), and cooled cameras report a temperature which
+relaxes towards the set point.
+
+Only the parts of each SDK used by qCamera are implemented. Calling
+any other function raises AttributeError, just like a missing symbol
+of a shared library.
+
+"""
+
+from __future__ import division
+import math
+import time
+import ctypes
+import threading
+import numbers
+
+import numpy as np
+
+from .simulation import SimulatedSensor
+from .andor_status_codes import ANDOR_STATUS
+from .sensicam_status_codes import (
+    SENSICAM_CODES, PCO_BUFFER_ALLOCATED, PCO_BUFFER_EVENT,
+    PCO_BUFFER_QUEUED, PCO_BUFFER_DONE)
+
+_timer = getattr(time, 'perf_counter', time.time)
+
+# Argument handling
+# =============================================================================
+
+def _value(arg):
+    """Return the Python value of a scalar argument."""
+    return getattr(arg, 'value', arg)
+
+def _deref(ptr):
+    """Return the ctypes object a pointer or byref argument refers
+    to.
+
+    """
+    obj = getattr(ptr, '_obj', None)
+    if obj is not None:
+        return obj
+    return ptr.contents
+
+def _store(ptr, value):
+    """Store value in the variable ptr points to."""
+    _deref(ptr).value = value
+
+def _address(ptr):
+    """Return the memory address a pointer argument points to."""
+    if isinstance(ptr, numbers.Integral):
+        return int(ptr)
+    return ctypes.cast(ptr, ctypes.c_void_p).value
+
+def _store_address(ptr, address):
+    """Store an address in the pointer variable (e.g., a c_void_p or
+    c_char_p) ptr refers to.
+
+    """
+    obj = _deref(ptr)
+    ctypes.c_void_p.from_address(ctypes.addressof(obj)).value = address
+
+def _copy_to(ptr, data):
+    """Copy the contents of the array data to the memory ptr points
+    to.
+
+    """
+    ctypes.memmove(_address(ptr), data.ctypes.data, data.nbytes)
+
+def _to_signed(code):
+    """Convert an unsigned 32 bit return code to the C int value a
+    function would return.
+
+    """
+    return code - 2**32 if code >= 2**31 else code
+
+# Timing models
+# =============================================================================
+
+class _FrameClock(object):
+    """Keeps track of when frames become available.
+
+    When free running, the first frame is ready one frame time after
+    :meth:`start` and further frames follow every period. Otherwise,
+    each call to :meth:`trigger` makes a frame ready one frame time
+    later, but not before the previous frame. At most limit frames
+    are delivered if limit is not None.
+
+    """
+
+    def __init__(self):
+        # Until started, the clock behaves as if waiting for triggers
+        # which never come.
+        self.running = False
+        self.free_running = False
+        self.frame_time = 0.
+        self.period = 0.
+        self.limit = None
+        self._t0 = 0.
+        self._ready = []
+
+    def start(self, free_running, frame_time, period, limit=None):
+        self.running = True
+        self.free_running = free_running
+        self.frame_time = frame_time
+        self.period = max(period, frame_time, 1e-6)
+        self.limit = limit
+        self._t0 = _timer()
+        self._ready = []
+
+    def stop(self):
+        self.running = False
+
+    def trigger(self):
+        """Start an exposure. Returns False if no frame will result
+        from the trigger.
+
+        """
+        if not self.running or self.free_running:
+            return False
+        if self.limit is not None and len(self._ready) >= self.limit:
+            return False
+        previous = self._ready[-1] if self._ready else 0.
+        self._ready.append(max(_timer(), previous) + self.frame_time)
+        return True
+
+    def count(self, now=None):
+        """Return the number of frames that have been completed."""
+        if now is None:
+            now = _timer()
+        if self.free_running:
+            dt = now - self._t0 - self.frame_time
+            n = int(dt//self.period) + 1 if dt >= 0 else 0
+        else:
+            n = 0
+            for t in self._ready:
+                if t > now:
+                    break
+                n += 1
+        if self.limit is not None:
+            n = min(n, self.limit)
+        return n
+
+    def finished(self, now=None):
+        """Return True if no more frames will be delivered."""
+        return (not self.running or
+                (self.limit is not None and self.count(now) >= self.limit))
+
+    def ready_time(self, k):
+        """Return the time at which frame k (counting from 0) is
+        completed, or None if this is not known yet.
+
+        """
+        if self.limit is not None and k >= self.limit:
+            return None
+        if self.free_running:
+            return self._t0 + self.frame_time + k*self.period
+        return self._ready[k] if k < len(self._ready) else None
+
+    def wait(self, cond, seen, timeout=None, cancelled=None):
+        """Wait with the condition cond held until more than seen
+        frames are completed. Returns 'ready', 'timeout', 'stopped'
+        or, if the function cancelled returns True, 'cancelled'.
+
+        """
+        deadline = None if timeout is None else _timer() + timeout
+        while True:
+            now = _timer()
+            if self.count(now) > seen:
+                return 'ready'
+            if cancelled is not None and cancelled():
+                return 'cancelled'
+            if self.finished(now) and self.ready_time(seen) is None:
+                return 'stopped'
+            if deadline is not None and now >= deadline:
+                return 'timeout'
+            t = self.ready_time(seen)
+            delay = None if t is None else t - now
+            if deadline is not None:
+                delay = deadline - now if delay is None else min(delay, deadline - now)
+            cond.wait(delay)
+
+class _Cooler(object):
+    """Thermoelectric cooler model. The temperature relaxes
+    exponentially towards the set point when the cooler is on and
+    towards the ambient temperature otherwise.
+
+    """
+
+    def __init__(self, ambient, set_point, tau):
+        self.ambient = float(ambient)
+        self.set_point = float(set_point)
+        self.tau = float(tau)
+        self.on = False
+        self._t0 = _timer()
+        self._T0 = self.ambient
+
+    def temperature(self, now=None):
+        if now is None:
+            now = _timer()
+        target = self.set_point if self.on else self.ambient
+        if self.tau <= 0:
+            return target
+        return target + (self._T0 - target)*math.exp(-(now - self._t0)/self.tau)
+
+    def _restart(self):
+        now = _timer()
+        self._T0 = self.temperature(now)
+        self._t0 = now
+
+    def set(self, on=None, set_point=None):
+        self._restart()
+        if on is not None:
+            self.on = on
+        if set_point is not None:
+            self.set_point = float(set_point)
+
+# Fake SDKs
+# =============================================================================
+
+class _FakeSDK(object):
+    """Common parts of the fake SDKs.
+
+    Keyword arguments
+    -----------------
+    shape : tuple
+        Size (x, y) of the sensor in pixels.
+    time_scale : float
+        Factor by which all exposure, readout and cooling times are
+        multiplied. 0 makes everything instantaneous. Default: 1.
+    readout_rate : float
+        Pixel readout rate in Hz.
+    simulation : dict
+        Keyword arguments for the :class:`SimulatedSensor`.
+
+    """
+
+    shape = (512, 512)
+    dtype = np.dtype(np.uint16)
+    readout_rate = 10e6
+
+    def __init__(self, **kwargs):
+        self.shape = tuple(kwargs.get('shape', self.shape))
+        self.time_scale = float(kwargs.get('time_scale', 1.))
+        self.readout_rate = float(kwargs.get('readout_rate', self.readout_rate))
+        simulation = dict(kwargs.get('simulation', {}))
+        simulation.setdefault('pacing', 'free')
+        self.sensor = SimulatedSensor(self.shape, self.dtype, **simulation)
+        self.clock = _FrameClock()
+        self._cond = threading.Condition()
+        self._images = {}
+
+    def _frame_time(self, t_ms, n_pixels):
+        """Return the time in s for exposing and reading out a frame."""
+        return self.time_scale*(t_ms/1000. + n_pixels/self.readout_rate)
+
+    def _image(self, shape, t_ms, crop, bins, dtype=None):
+        """Generate an image of the given shape with the current
+        settings, reusing a buffer per shape and dtype.
+
+        """
+        if dtype is None:
+            dtype = self.dtype
+        key = (shape, np.dtype(dtype))
+        img = self._images.get(key)
+        if img is None:
+            img = self._images[key] = np.empty(shape, dtype)
+        self.sensor.expose(img, t_ms, crop, bins)
+        return img
+
+    def fire_trigger(self):
+        """Simulate an external trigger pulse. Returns False if the
+        camera is not waiting for a trigger.
+
+        """
+        with self._cond:
+            result = self.clock.trigger()
+            self._cond.notify_all()
+        return result
+
+class FakeAndorSDK(_FakeSDK):
+    """Stand-in for the Andor SDK (atmcd32d/libandor).
+
+    Additional keyword arguments
+    ----------------------------
+    cooling_time : float
+        Time constant of the cooler in s. Default: 20.
+    buffer_size : int
+        Number of images the circular buffer holds. Default: 32.
+
+    """
+
+    shape = (512, 512)
+    dtype = np.dtype(np.int32)
+    readout_rate = 10e6
+
+    def __init__(self, **kwargs):
+        super(FakeAndorSDK, self).__init__(**kwargs)
+        self.cooler = _Cooler(
+            20, 0, self.time_scale*kwargs.get('cooling_time', 20.))
+        self.initialized = False
+        self.acq_mode = 1
+        self.trigger_mode = 0
+        self.t_exp = 0.01
+        self.cycle_time = 0.
+        self.n_kinetics = 1
+        self.image = (1, 1, 1, self.shape[0], 1, self.shape[1])
+        self.fast_kinetics = None
+        self.em_gain = 0
+        self.buffer_size = kwargs.get('buffer_size', 32)
+        self._seen = 0
+        self._retrieved = 0
+        self._cancelled = False
+        self._waiting = 0
+
+    def _ok(self):
+        return ANDOR_STATUS['DRV_SUCCESS']
+
+    def _readout_area(self):
+        """Return the binning and (hstart, hend, vstart, vend) of the
+        area read out in the current acquisition mode.
+
+        """
+        if self.acq_mode == 4 and self.fast_kinetics is not None:
+            rows, hbin, vbin, offset = self.fast_kinetics
+            return hbin, vbin, (1, self.shape[0], offset + 1, offset + rows)
+        hbin, vbin, hstart, hend, vstart, vend = self.image
+        return hbin, vbin, (hstart, hend, vstart, vend)
+
+    def _frame_format(self):
+        hbin, vbin, (hstart, hend, vstart, vend) = self._readout_area()
+        return ((vend - vstart + 1)//vbin, (hend - hstart + 1)//hbin)
+
+    def _expose(self, shape, dtype=None):
+        hbin, vbin, crop = self._readout_area()
+        return self._image(shape, 1000*self.t_exp, crop, hbin, dtype)
+
+    # Setup and shutdown
+
+    def Initialize(self, directory):
+        self.initialized = True
+        return self._ok()
+
+    def ShutDown(self):
+        self.initialized = False
+        return self._ok()
+
+    def GetDetector(self, xpx, ypx):
+        _store(xpx, self.shape[0])
+        _store(ypx, self.shape[1])
+        return self._ok()
+
+    def GetCapabilities(self, caps):
+        return self._ok()
+
+    def SetReadMode(self, mode):
+        return self._ok()
+
+    def SetShutter(self, typ, mode, closing_time, opening_time):
+        return self._ok()
+
+    # Acquisition settings
+
+    def SetAcquisitionMode(self, mode):
+        mode = _value(mode)
+        if mode not in (1, 2, 3, 4, 5):
+            return ANDOR_STATUS['DRV_P1INVALID']
+        self.acq_mode = mode
+        return self._ok()
+
+    def SetTriggerMode(self, mode):
+        mode = _value(mode)
+        if mode not in (0, 1, 6, 7, 9, 10, 12):
+            return ANDOR_STATUS['DRV_P1INVALID']
+        self.trigger_mode = mode
+        return self._ok()
+
+    def SetExposureTime(self, t):
+        self.t_exp = max(float(_value(t)), 0.)
+        return self._ok()
+
+    def SetKineticCycleTime(self, t):
+        self.cycle_time = max(float(_value(t)), 0.)
+        return self._ok()
+
+    def SetNumberKinetics(self, n):
+        n = _value(n)
+        if n < 1:
+            return ANDOR_STATUS['DRV_P1INVALID']
+        self.n_kinetics = n
+        return self._ok()
+
+    def SetFastKineticsEx(self, rows, n, t, mode, hbin, vbin, offset):
+        rows, n, mode, hbin, vbin, offset = (
+            int(_value(x)) for x in (rows, n, mode, hbin, vbin, offset))
+        if not 1 <= rows <= self.shape[1]:
+            return ANDOR_STATUS['DRV_P1INVALID']
+        if n < 1 or n*rows > self.shape[1]:
+            return ANDOR_STATUS['DRV_P2INVALID']
+        if mode not in (0, 4):
+            return ANDOR_STATUS['DRV_P4INVALID']
+        if hbin < 1:
+            return ANDOR_STATUS['DRV_P5INVALID']
+        if vbin < 1:
+            return ANDOR_STATUS['DRV_P6INVALID']
+        if not 0 <= offset <= self.shape[1] - rows:
+            return ANDOR_STATUS['DRV_P7INVALID']
+        self.fast_kinetics = (rows, hbin, vbin, offset)
+        self.n_kinetics = n
+        self.t_exp = max(float(_value(t)), 0.)
+        return self._ok()
+
+    def GetAcquisitionTimings(self, exposure, accumulate, kinetic):
+        rows, cols = self._frame_format()
+        frame = self.t_exp + rows*cols/self.readout_rate
+        _store(exposure, self.t_exp)
+        _store(accumulate, frame)
+        _store(kinetic, max(frame, self.cycle_time))
+        return self._ok()
+
+    def SetImage(self, hbin, vbin, hstart, hend, vstart, vend):
+        image = tuple(int(_value(x)) for x in (hbin, vbin, hstart, hend, vstart, vend))
+        if image[0] < 1:
+            return ANDOR_STATUS['DRV_P1INVALID']
+        if image[1] < 1:
+            return ANDOR_STATUS['DRV_P2INVALID']
+        if not 1 <= image[2] < image[3] <= self.shape[0]:
+            return ANDOR_STATUS['DRV_P3INVALID']
+        if not 1 <= image[4] < image[5] <= self.shape[1]:
+            return ANDOR_STATUS['DRV_P5INVALID']
+        self.image = image
+        return self._ok()
+
+    # Gain
+
+    def GetNumberPreAmpGains(self, n):
+        _store(n, 3)
+        return self._ok()
+
+    def SetPreAmpGain(self, index):
+        if not 0 <= _value(index) < 3:
+            return ANDOR_STATUS['DRV_P1INVALID']
+        return self._ok()
+
+    def SetEMGainMode(self, mode):
+        return self._ok()
+
+    def GetEMGainRange(self, low, high):
+        _store(low, 0)
+        _store(high, 255)
+        return self._ok()
+
+    def GetEMCCDGain(self, gain):
+        _store(gain, self.em_gain)
+        return self._ok()
+
+    def SetEMCCDGain(self, gain):
+        gain = _value(gain)
+        if not 0 <= gain <= 255:
+            return ANDOR_STATUS['DRV_P1INVALID']
+        self.em_gain = gain
+        self.sensor.em_gain = max(gain, 1)
+        return self._ok()
+
+    # Cooling
+
+    def GetTemperatureRange(self, low, high):
+        _store(low, -80)
+        _store(high, 30)
+        return self._ok()
+
+    def SetTemperature(self, temp):
+        self.cooler.set(set_point=_value(temp))
+        return self._ok()
+
+    def CoolerON(self):
+        self.cooler.set(on=True)
+        return self._ok()
+
+    def CoolerOFF(self):
+        self.cooler.set(on=False)
+        return self._ok()
+
+    def GetTemperature(self, temp):
+        T = self.cooler.temperature()
+        _store(temp, int(round(T)))
+        if not self.cooler.on:
+            return ANDOR_STATUS['DRV_TEMPERATURE_OFF']
+        deviation = abs(T - self.cooler.set_point)
+        if deviation > 2:
+            return ANDOR_STATUS['DRV_TEMPERATURE_NOT_REACHED']
+        elif deviation > 0.5:
+            return ANDOR_STATUS['DRV_TEMP_NOT_STABILIZED']
+        return ANDOR_STATUS['DRV_TEMPERATURE_STABILIZED']
+
+    # Acquisition
+
+    def StartAcquisition(self):
+        with self._cond:
+            if self.clock.running and not self.clock.finished():
+                return ANDOR_STATUS['DRV_ACQUIRING']
+            rows, cols = self._frame_format()
+            frame_time = self._frame_time(1000*self.t_exp, rows*cols)
+            limit = {1: 1, 2: 1, 3: self.n_kinetics, 4: self.n_kinetics}.get(
+                self.acq_mode)
+            self.clock.start(
+                self.trigger_mode == 0, frame_time,
+                self.time_scale*self.cycle_time, limit)
+            self._seen = 0
+            self._retrieved = 0
+            self._cond.notify_all()
+        return self._ok()
+
+    def AbortAcquisition(self):
+        with self._cond:
+            if not self.clock.running:
+                return ANDOR_STATUS['DRV_IDLE']
+            self.clock.stop()
+            self._cond.notify_all()
+        return self._ok()
+
+    def SendSoftwareTrigger(self):
+        if self.trigger_mode != 10:
+            return ANDOR_STATUS['DRV_NOT_AVAILABLE']
+        with self._cond:
+            if not self.clock.trigger():
+                return ANDOR_STATUS['DRV_ERROR_ACK']
+            self._cond.notify_all()
+        return self._ok()
+
+    def GetStatus(self, status):
+        if self.clock.finished():
+            _store(status, ANDOR_STATUS['DRV_IDLE'])
+        else:
+            _store(status, ANDOR_STATUS['DRV_ACQUIRING'])
+        return self._ok()
+
+    def GetTotalNumberImagesAcquired(self, index):
+        _store(index, self.clock.count())
+        return self._ok()
+
+    def WaitForAcquisition(self):
+        return self.WaitForAcquisitionTimeOut(None)
+
+    def WaitForAcquisitionTimeOut(self, timeout_ms):
+        timeout_ms = _value(timeout_ms)
+        timeout = None if timeout_ms is None else timeout_ms/1000.
+        with self._cond:
+            self._waiting += 1
+            try:
+                result = self.clock.wait(
+                    self._cond, self._seen, timeout, lambda: self._cancelled)
+            finally:
+                self._waiting -= 1
+            self._cancelled = False
+            if result != 'ready':
+                return ANDOR_STATUS['DRV_NO_NEW_DATA']
+            self._seen = self.clock.count()
+        return self._ok()
+
+    def CancelWait(self):
+        # Only affects a wait in progress.
+        with self._cond:
+            self._cancelled = self._waiting > 0
+            self._cond.notify_all()
+        return self._ok()
+
+    def GetMostRecentImage(self, arr, size, dtype=None):
+        shape = self._frame_format()
+        if _value(size) != shape[0]*shape[1]:
+            return ANDOR_STATUS['DRV_P2INVALID']
+        if self.clock.count() == 0:
+            return ANDOR_STATUS['DRV_NO_NEW_DATA']
+        _copy_to(arr, self._expose(shape, dtype))
+        return self._ok()
+
+    def GetMostRecentImage16(self, arr, size):
+        return self.GetMostRecentImage(arr, size, np.uint16)
+
+    def GetAcquiredData(self, arr, size, dtype=None):
+        rows, cols = self._frame_format()
+        n = self.clock.count()
+        if not self.clock.finished():
+            return ANDOR_STATUS['DRV_ACQUIRING']
+        if n == 0:
+            return ANDOR_STATUS['DRV_NO_NEW_DATA']
+        if _value(size) != n*rows*cols:
+            return ANDOR_STATUS['DRV_P2INVALID']
+        _copy_to(arr, self._expose((n, rows, cols), dtype))
+        return self._ok()
+
+    def GetAcquiredData16(self, arr, size):
+        return self.GetAcquiredData(arr, size, np.uint16)
+
+    def GetSizeOfCircularBuffer(self, index):
+        _store(index, self.buffer_size)
+        return self._ok()
+
+    def _available(self):
+        """Return the series indices (from 1) of the oldest and newest
+        image in the circular buffer.
+
+        """
+        count = self.clock.count()
+        return max(1, count - self.buffer_size + 1), count
+
+    def GetNumberNewImages(self, first, last):
+        oldest, newest = self._available()
+        oldest = max(oldest, self._retrieved + 1)
+        if newest < oldest:
+            return ANDOR_STATUS['DRV_NO_NEW_DATA']
+        _store(first, oldest)
+        _store(last, newest)
+        return self._ok()
+
+    def GetImages(self, first, last, arr, size, validfirst, validlast,
+                  dtype=None):
+        first, last = _value(first), _value(last)
+        oldest, newest = self._available()
+        if not oldest <= first <= newest:
+            return ANDOR_STATUS['DRV_P1INVALID']
+        if not first <= last <= newest:
+            return ANDOR_STATUS['DRV_P2INVALID']
+        rows, cols = self._frame_format()
+        n = last - first + 1
+        if _value(size) != n*rows*cols:
+            return ANDOR_STATUS['DRV_P4INVALID']
+        _copy_to(arr, self._expose((n, rows, cols), dtype))
+        _store(validfirst, first)
+        _store(validlast, last)
+        self._retrieved = max(self._retrieved, last)
+        return self._ok()
+
+    def GetImages16(self, first, last, arr, size, validfirst, validlast):
+        return self.GetImages(
+            first, last, arr, size, validfirst, validlast, np.uint16)
+
+    def PostProcessNoiseFilter(self, input_image, output_image, size,
+                               baseline, mode, threshold, width, height):
+        """Copy the image unchanged; the filter itself is not
+        modeled.
+
+        """
+        n = _value(width)*_value(height)
+        ctypes.memmove(_address(output_image), _address(input_image),
+                       n*self.dtype.itemsize)
+        return self._ok()
+
+class FakeSensicamSDK(_FakeSDK):
+    """Stand-in for the PCO Sensicam SDK (sen_cam)."""
+
+    shape = (640, 480)
+    dtype = np.dtype(np.uint16)
+    readout_rate = 12.5e6
+
+    # Bits per pixel of the ADC.
+    bit_pix = 12
+
+    def __init__(self, **kwargs):
+        super(FakeSensicamSDK, self).__init__(**kwargs)
+        self.trigger = 0
+        self.roi = (1, self.shape[0]//32, 1, self.shape[1]//32)
+        self.bins = (1, 1)
+        self.timing = (0, 10)
+        self.handle = None
+        self._read = 0
+        self._buffers = {}
+        self._next_buffer = 0
+        self._status = {}
+        self._queue = []
+        self._delivered = 0
+
+        # Number of images lost because no buffer was queued.
+        self.lost = 0
+
+    def _error(self, name):
+        return _to_signed(SENSICAM_CODES[name])
+
+    def _actual_size(self):
+        """Return the size (x, y) of images for the current COC."""
+        x = (self.roi[1] - self.roi[0] + 1)*32//self.bins[0]
+        y = (self.roi[3] - self.roi[2] + 1)*32//self.bins[1]
+        return x, y
+
+    def _parse_timing(self, timing):
+        if isinstance(timing, ctypes.c_char_p):
+            timing = timing.value
+        if isinstance(timing, bytes) and not isinstance(timing, str):
+            timing = timing.decode()
+        values = [int(x) for x in timing.split(',')]
+        return values[0], values[1]
+
+    def _valid_coc(self, trigger, roi, bins, timing):
+        """Return the nearest valid COC settings."""
+        trigger = trigger if trigger in (0, 1, 2) else 0
+        nx, ny = self.shape[0]//32, self.shape[1]//32
+        x1 = min(max(roi[0], 1), nx)
+        x2 = min(max(roi[1], x1), nx)
+        y1 = min(max(roi[2], 1), ny)
+        y2 = min(max(roi[3], y1), ny)
+        hbin = bins[0] if bins[0] in (1, 2, 4, 8) else 1
+        vbin = bins[1] if bins[1] in (1, 2, 4, 8, 16, 32) else 1
+        delay = min(max(timing[0], 0), 1000000)
+        t_exp = min(max(timing[1], 1), 1000000)
+        return trigger, (x1, x2, y1, y2), (hbin, vbin), (delay, t_exp)
+
+    def _frame(self):
+        """Generate an image for the current COC."""
+        x, y = self._actual_size()
+        crop = (32*(self.roi[0] - 1) + 1, 32*self.roi[1],
+                32*(self.roi[2] - 1) + 1, 32*self.roi[3])
+        img = self._image((y, x), self.timing[1], crop, self.bins[0])
+        np.minimum(img, 2**self.bit_pix - 1, out=img)
+        return img
+
+    def _deliver(self):
+        """Transfer the images completed since the last call to the
+        queued buffers in order. Images for which no buffer is queued
+        are lost, as on the real board. Must be called with the
+        condition held.
+
+        """
+        if not self.clock.running:
+            return
+        n = self.clock.count()
+        while self._delivered < n and self._queue:
+            self._delivered += 1
+            nr = self._queue.pop(0)
+            img = self._frame()
+            buf = self._buffers[nr]
+            if buf.nbytes >= img.nbytes:
+                _copy_to(buf.ctypes.data, img)
+            self._status[nr] = \
+                (self._status[nr] & ~PCO_BUFFER_QUEUED) | PCO_BUFFER_DONE
+        self.lost += n - self._delivered
+        self._delivered = n
+
+    # Setup and shutdown
+
+    def INITBOARD(self, board, handle):
+        self.handle = 1
+        _store(handle, self.handle)
+        return 0
+
+    def CLOSEBOARD(self, handle):
+        self.handle = None
+        return 0
+
+    def SETUP_CAMERA(self, handle):
+        return 0
+
+    def GETSIZES(self, handle, ccdx, ccdy, actualx, actualy, bit_pix):
+        x, y = self._actual_size()
+        _store(ccdx, self.shape[0])
+        _store(ccdy, self.shape[1])
+        _store(actualx, x)
+        _store(actualy, y)
+        _store(bit_pix, self.bit_pix)
+        return 0
+
+    # Camera operation code
+
+    def TEST_COC(self, handle, mode, trigger, roix1, roix2, roiy1, roiy2,
+                 hbin, vbin, timing, length):
+        roi_ptrs = (roix1, roix2, roiy1, roiy2)
+        trig, roi, bins, times = self._valid_coc(
+            _deref(trigger).value, [_deref(x).value for x in roi_ptrs],
+            (_deref(hbin).value, _deref(vbin).value),
+            self._parse_timing(timing))
+        _store(trigger, trig)
+        for ptr, x in zip(roi_ptrs, roi):
+            _store(ptr, x)
+        _store(hbin, bins[0])
+        _store(vbin, bins[1])
+        return 0
+
+    def SET_COC(self, handle, mode, trigger, roix1, roix2, roiy1, roiy2,
+                hbin, vbin, timing):
+        roi = tuple(int(_value(x)) for x in (roix1, roix2, roiy1, roiy2))
+        bins = (int(_value(hbin)), int(_value(vbin)))
+        trigger = int(_value(trigger))
+        try:
+            times = self._parse_timing(timing)
+        except (ValueError, IndexError, AttributeError):
+            return self._error('PCO_ERROR_WRONGVALUE')
+        if self._valid_coc(trigger, roi, bins, times) != \
+           (trigger, roi, bins, times):
+            return self._error('PCO_ERROR_WRONGVALUE')
+        with self._cond:
+            self.trigger = trigger
+            self.roi = roi
+            self.bins = bins
+            self.timing = times
+        return 0
+
+    def RUN_COC(self, handle, mode):
+        with self._cond:
+            x, y = self._actual_size()
+            frame_time = self._frame_time(sum(self.timing), x*y)
+            self.clock.start(self.trigger == 0, frame_time, frame_time)
+            self._read = 0
+            self._delivered = 0
+            self._cond.notify_all()
+        return 0
+
+    def STOP_COC(self, handle, mode):
+        with self._cond:
+            self._deliver()
+            self.clock.stop()
+            self._cond.notify_all()
+        return 0
+
+    # Images
+
+    def WAIT_FOR_IMAGE(self, handle, timeout):
+        with self._cond:
+            result = self.clock.wait(
+                self._cond, self._read, _value(timeout)/1000.)
+        if result == 'ready':
+            return 0
+        return self._error('PCO_ERROR_TIMEOUT')
+
+    def READ_IMAGE_12BIT(self, handle, mode, width, height, data):
+        x, y = self._actual_size()
+        if (_value(width), _value(height)) != (x, y):
+            return self._error('PCO_ERROR_WRONGVALUE')
+        n = self.clock.count()
+        if n == 0:
+            return self._error('PCO_ERROR_TIMEOUT')
+        self._read = n
+        _copy_to(data, self._frame())
+        return 0
+
+    # Buffers
+
+    def ALLOCATE_BUFFER(self, handle, number, size):
+        nr = _deref(number).value
+        if nr == -1:
+            nr = self._next_buffer
+            self._next_buffer += 1
+        elif not 0 <= nr < self._next_buffer:
+            # Only numbers handed out before can be reallocated.
+            return self._error('PCO_ERROR_SDKDLL_WRONGBUFFERNR')
+        self._buffers[nr] = np.zeros(_deref(size).value, dtype=np.uint8)
+        self._status[nr] = PCO_BUFFER_ALLOCATED
+        _store(number, nr)
+        return 0
+
+    def MAP_BUFFER(self, handle, number, size, offset, address):
+        buf = self._buffers.get(_value(number))
+        if buf is None:
+            return self._error('PCO_ERROR_SDKDLL_WRONGBUFFERNR')
+        _store_address(address, buf.ctypes.data)
+        return 0
+
+    def SETBUFFER_EVENT(self, handle, number, event):
+        nr = _value(number)
+        if nr not in self._buffers:
+            return self._error('PCO_ERROR_SDKDLL_WRONGBUFFERNR')
+        self._status[nr] |= PCO_BUFFER_EVENT
+        return 0
+
+    def ADD_BUFFER_TO_LIST(self, handle, number, size, offset, data):
+        nr = _value(number)
+        buf = self._buffers.get(nr)
+        if buf is None:
+            return self._error('PCO_ERROR_SDKDLL_WRONGBUFFERNR')
+        if _value(size) + _value(offset) > buf.nbytes:
+            return self._error('PCO_ERROR_SDKDLL_BUFFERSIZE')
+        with self._cond:
+            self._deliver()
+            if nr in self._queue:
+                return self._error('PCO_ERROR_SDKDLL_BUFALREADYASSIGNED')
+            self._queue.append(nr)
+            self._status[nr] = \
+                (self._status[nr] & ~PCO_BUFFER_DONE) | PCO_BUFFER_QUEUED
+        return 0
+
+    def REMOVE_ALL_BUFFERS_FROM_LIST(self, handle):
+        with self._cond:
+            self._deliver()
+            for nr in self._queue:
+                self._status[nr] &= ~PCO_BUFFER_QUEUED
+            self._queue = []
+        return 0
+
+    def GETBUFFER_STATUS(self, handle, number, mode, status, length):
+        nr = _value(number)
+        if nr not in self._buffers:
+            return self._error('PCO_ERROR_SDKDLL_WRONGBUFFERNR')
+        with self._cond:
+            self._deliver()
+            words = (ctypes.c_int*(_value(length)//4)).from_address(
+                _address(status))
+            words[0] = self._status[nr]
+            if len(words) > 1:
+                words[1] = 0
+        return 0
+
+    def FREE_BUFFER(self, handle, number):
+        nr = _value(number)
+        if self._buffers.pop(nr, None) is None:
+            return self._error('PCO_ERROR_SDKDLL_WRONGBUFFERNR')
+        with self._cond:
+            if nr in self._queue:
+                self._queue.remove(nr)
+            del self._status[nr]
+        return 0
+
+class FakeUEyeSDK(_FakeSDK):
+    """Stand-in for the Thorlabs/IDS uEye SDK (uc480/libueye_api)."""
+
+    shape = (1280, 1024)
+    dtype = np.dtype(np.uint8)
+    readout_rate = 30e6
+
+    # Pixel size in 1/100 um.
+    pixel_size = 520
+
+    # Increments of the AOI position and size in pixels.
+    pos_inc = (4, 2)
+    size_inc = (8, 2)
+
+    # Binning modes by bin size.
+    binning_modes = {0x0: 1, 0x3: 2, 0xc: 4}
+
+    # Return codes
+    IS_SUCCESS = 0
+    IS_NO_SUCCESS = -1
+    IS_INVALID_CAMERA_HANDLE = 1
+    IS_TIMED_OUT = 122
+    IS_INVALID_PARAMETER = 125
+
+    def __init__(self, **kwargs):
+        super(FakeUEyeSDK, self).__init__(**kwargs)
+        self.handle = None
+        self.t_ms = 10.
+        self.active = None
+        self.capturing = False
+        self._memories = {}
+        self._next_id = 1
+        self._sequence = []
+        self._locked = set()
+        self._events = set()
+        self._last = None
+        self._captured = 0
+        self._signalled = 0
+        self.bins = 1
+        self.aoi = (0, 0) + self.shape
+
+        # Number of images lost because all memories were locked.
+        self.lost = 0
+
+    def _check_handle(self, handle):
+        return self.handle is not None and _value(handle) == self.handle
+
+    def _memory_id(self, num, mem):
+        """Return the ID of a sequence memory given by its position
+        in the sequence (counting from 1) or, if num is
+        IS_IGNORE_PARAMETER, its address.
+
+        """
+        num = _value(num)
+        if num == -1:
+            address = _address(mem)
+            for mid in self._sequence:
+                if self._memories[mid].ctypes.data == address:
+                    return mid
+            return None
+        if 1 <= num <= len(self._sequence):
+            return self._sequence[num - 1]
+        return None
+
+    def _expose(self, buf):
+        """Simulate an exposure of the current AOI into the memory
+        buf. Returns False if the memory is too small for the AOI.
+
+        """
+        x, y, w, h = self.aoi
+        if buf.shape[0] < h or buf.shape[1] < w:
+            return False
+        b = self.bins
+        crop = (x*b + 1, (x + w)*b, y*b + 1, (y + h)*b)
+        self.sensor.expose(buf[:h, :w], self.t_ms, crop, b)
+        return True
+
+    def _deliver(self):
+        """Write the newest image captured since the last call to the
+        next unlocked memory of the sequence. Older images would have
+        been overwritten anyway. This is only done when the sequence
+        is queried, since generating images is slow. Must be called
+        with the condition held.
+
+        """
+        if not self.capturing:
+            return
+        n = self.clock.count()
+        if n <= self._captured:
+            return
+        self._captured = n
+        start = 0 if self._last is None else self._last + 1
+        for k in range(len(self._sequence)):
+            i = (start + k) % len(self._sequence)
+            mid = self._sequence[i]
+            if mid not in self._locked:
+                self._expose(self._memories[mid])
+                self._last = i
+                return
+        self.lost += 1
+
+    # Setup and shutdown
+
+    def is_GetNumberOfCameras(self, number):
+        _store(number, 1)
+        return self.IS_SUCCESS
+
+    def is_InitCamera(self, handle, window=None):
+        self.handle = 1
+        _store(handle, self.handle)
+        return self.IS_SUCCESS
+
+    def is_ExitCamera(self, handle):
+        if not self._check_handle(handle):
+            return self.IS_INVALID_CAMERA_HANDLE
+        self.handle = None
+        self._memories.clear()
+        return self.IS_SUCCESS
+
+    def is_EnableAutoExit(self, handle, mode):
+        return self.IS_SUCCESS
+
+    def is_GetSensorInfo(self, handle, info):
+        info = _deref(info)
+        info.strSensorName = b'FAKE1280M'
+        info.nColorMode = b'\x01' # IS_COLORMODE_MONOCHROME
+        info.nMaxWidth, info.nMaxHeight = self.shape
+        info.bGlobShutter = 1
+        info.wPixelSize = self.pixel_size
+        return self.IS_SUCCESS
+
+    # Image geometry
+
+    def is_SetBinning(self, handle, mode):
+        mode = _value(mode)
+        if mode == 0x8001: # IS_GET_SUPPORTED_BINNING
+            modes = 0
+            for m in self.binning_modes:
+                modes |= m
+            return modes
+        if mode not in self.binning_modes:
+            return self.IS_INVALID_PARAMETER
+        if self.capturing:
+            return self.IS_NO_SUCCESS
+        self.bins = self.binning_modes[mode]
+        self.aoi = (0, 0, self.shape[0]//self.bins, self.shape[1]//self.bins)
+        return self.IS_SUCCESS
+
+    def is_AOI(self, handle, command, param, size):
+        command, param = _value(command), _deref(param)
+        if command == 0x0001: # IS_AOI_IMAGE_SET_AOI
+            x, y, w, h = param.s32X, param.s32Y, param.s32Width, param.s32Height
+            max_w, max_h = self.shape[0]//self.bins, self.shape[1]//self.bins
+            if x % self.pos_inc[0] or y % self.pos_inc[1] or \
+               w % self.size_inc[0] or h % self.size_inc[1] or \
+               w <= 0 or h <= 0 or x < 0 or y < 0 or \
+               x + w > max_w or y + h > max_h:
+                return self.IS_INVALID_PARAMETER
+            if self.capturing:
+                return self.IS_NO_SUCCESS
+            self.aoi = (x, y, w, h)
+        elif command == 0x0002: # IS_AOI_IMAGE_GET_AOI
+            param.s32X, param.s32Y, param.s32Width, param.s32Height = self.aoi
+        elif command == 0x0011: # IS_AOI_IMAGE_GET_POS_INC
+            param.s32X, param.s32Y = self.pos_inc
+        elif command == 0x0012: # IS_AOI_IMAGE_GET_SIZE_INC
+            param.s32Width, param.s32Height = self.size_inc
+        else:
+            return self.IS_INVALID_PARAMETER
+        return self.IS_SUCCESS
+
+    # Image memory
+
+    def is_AllocImageMem(self, handle, width, height, bits, mem, mem_id):
+        width, height, bits = _value(width), _value(height), _value(bits)
+        if bits != 8:
+            return self.IS_INVALID_PARAMETER
+        buf = np.zeros((height, width), dtype=np.uint8)
+        mid = self._next_id
+        self._next_id += 1
+        self._memories[mid] = buf
+        _store_address(mem, buf.ctypes.data)
+        _store(mem_id, mid)
+        return self.IS_SUCCESS
+
+    def is_SetImageMem(self, handle, mem, mem_id):
+        if _value(mem_id) not in self._memories:
+            return self.IS_INVALID_PARAMETER
+        self.active = _value(mem_id)
+        return self.IS_SUCCESS
+
+    def is_FreeImageMem(self, handle, mem, mem_id):
+        mid = _value(mem_id)
+        with self._cond:
+            if self._memories.pop(mid, None) is None:
+                return self.IS_INVALID_PARAMETER
+            if mid in self._sequence:
+                self._sequence.remove(mid)
+            self._locked.discard(mid)
+            if self.active == mid:
+                self.active = None
+        return self.IS_SUCCESS
+
+    def is_GetImageMemPitch(self, handle, pitch):
+        mid = self.active if self.active is not None else \
+            (self._sequence[0] if self._sequence else None)
+        if mid is None:
+            return self.IS_NO_SUCCESS
+        _store(pitch, self._memories[mid].shape[1])
+        return self.IS_SUCCESS
+
+    def is_AddToSequence(self, handle, mem, mem_id):
+        mid = _value(mem_id)
+        if mid not in self._memories or mid in self._sequence:
+            return self.IS_INVALID_PARAMETER
+        with self._cond:
+            self._sequence.append(mid)
+        return self.IS_SUCCESS
+
+    def is_ClearSequence(self, handle):
+        with self._cond:
+            self._sequence = []
+            self._locked.clear()
+            self._last = None
+        return self.IS_SUCCESS
+
+    def is_CopyImageMem(self, handle, mem, mem_id, dest):
+        buf = self._memories.get(_value(mem_id))
+        if buf is None:
+            return self.IS_INVALID_PARAMETER
+        _copy_to(dest, buf)
+        return self.IS_SUCCESS
+
+    # Acquisition
+
+    def is_FreezeVideo(self, handle, wait):
+        if not self._check_handle(handle):
+            return self.IS_INVALID_CAMERA_HANDLE
+        if self.active is None:
+            return self.IS_NO_SUCCESS
+        frame_time = self._frame_time(self.t_ms, self.aoi[2]*self.aoi[3])
+        wait = _value(wait)
+        if wait > 1 and frame_time > wait/100.:
+            time.sleep(wait/100.)
+            return self.IS_TIMED_OUT
+        if frame_time > 0:
+            time.sleep(frame_time)
+        if not self._expose(self._memories[self.active]):
+            return self.IS_NO_SUCCESS
+        return self.IS_SUCCESS
+
+    def is_CaptureVideo(self, handle, wait):
+        if not self._check_handle(handle):
+            return self.IS_INVALID_CAMERA_HANDLE
+        if not self._sequence:
+            return self.IS_NO_SUCCESS
+        with self._cond:
+            frame_time = self._frame_time(self.t_ms, self.aoi[2]*self.aoi[3])
+            self.clock.start(True, frame_time, frame_time)
+            self.capturing = True
+            self._last = None
+            self._captured = 0
+            self._signalled = 0
+            self._cond.notify_all()
+        return self.IS_SUCCESS
+
+    def is_StopLiveVideo(self, handle, wait):
+        with self._cond:
+            self._deliver()
+            self.clock.stop()
+            self.capturing = False
+            self._cond.notify_all()
+        return self.IS_SUCCESS
+
+    def is_EnableEvent(self, handle, which):
+        self._events.add(_value(which))
+        return self.IS_SUCCESS
+
+    def is_DisableEvent(self, handle, which):
+        self._events.discard(_value(which))
+        return self.IS_SUCCESS
+
+    def is_WaitEvent(self, handle, which, timeout):
+        if _value(which) not in self._events:
+            return self.IS_NO_SUCCESS
+        with self._cond:
+            result = self.clock.wait(
+                self._cond, self._signalled, _value(timeout)/1000.)
+            if result != 'ready':
+                return self.IS_TIMED_OUT
+            self._signalled = self.clock.count()
+        return self.IS_SUCCESS
+
+    def is_GetActSeqBuf(self, handle, num, mem, last):
+        with self._cond:
+            self._deliver()
+            if self._last is None:
+                return self.IS_NO_SUCCESS
+            current = (self._last + 1) % len(self._sequence)
+            _store(num, current + 1)
+            _store_address(
+                mem, self._memories[self._sequence[current]].ctypes.data)
+            _store_address(
+                last, self._memories[self._sequence[self._last]].ctypes.data)
+        return self.IS_SUCCESS
+
+    def is_LockSeqBuf(self, handle, num, mem):
+        with self._cond:
+            mid = self._memory_id(num, mem)
+            if mid is None:
+                return self.IS_INVALID_PARAMETER
+            self._locked.add(mid)
+        return self.IS_SUCCESS
+
+    def is_UnlockSeqBuf(self, handle, num, mem):
+        with self._cond:
+            mid = self._memory_id(num, mem)
+            if mid is None:
+                return self.IS_INVALID_PARAMETER
+            self._locked.discard(mid)
+        return self.IS_SUCCESS
+
+    def is_Exposure(self, handle, command, param, size):
+        command = _value(command)
+        if command == 12: # IS_EXPOSURE_CMD_SET_EXPOSURE
+            self.t_ms = _deref(param).value
+        elif command == 7: # IS_EXPOSURE_CMD_GET_EXPOSURE
+            _store(param, self.t_ms)
+        else:
+            return self.IS_INVALID_PARAMETER
+        return self.IS_SUCCESS
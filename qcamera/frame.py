@@ -0,0 +1,116 @@
+"""Per-frame metadata
+
+Every image acquired by a :class:`Camera` is tagged with a monotonic
+timestamp, a sequence number and the settings it was taken with. For
+single images, this is bundled with the image data in a
+:class:`Frame`. For batches and in the ring buffer, the same fields
+are kept in NumPy structured arrays of dtype :data:`FRAME_DTYPE` so
+that questions like "how much does the frame interval jitter?" or
+"were any frames lost?" become vectorized operations::
+
+    meta = cam.rbuffer.get_metadata()
+    intervals = np.diff(np.sort(meta['timestamp']))*1e-6  # ms
+    lost = np.diff(np.sort(meta['sequence'])) - 1
+
+Timestamps are in nanoseconds from ``time.perf_counter_ns`` (or the
+closest equivalent on older Pythons). They are only meaningful
+relative to each other, not as wall clock times.
+
+"""
+
+import time
+import numpy as np
+
+try:
+    timestamp_ns = time.perf_counter_ns
+except AttributeError:
+    _timer = getattr(time, 'perf_counter', time.time)
+    def timestamp_ns():
+        """Return the value of a monotonic clock in nanoseconds."""
+        return int(_timer()*1e9)
+
+# Description of the metadata of a single frame.
+FRAME_DTYPE = np.dtype([
+    ('timestamp', np.int64),
+    ('sequence', np.int64),
+    ('exposure', np.float64),
+    ('gain', np.float64),
+    ('bins', np.int32),
+    ('crop', np.int32, (4,)),
+    ('roi', np.int32, (4,))])
+
+class Frame(object):
+    """An image together with its metadata.
+
+    A Frame can be used wherever an array is expected, e.g.,
+    ``np.mean(frame)``, in which case it behaves like its data.
+
+    Attributes
+    ----------
+    data : np.ndarray
+        The image.
+    timestamp : int
+        Time in ns at which the image was read out.
+    sequence : int
+        Running number of the image since the camera was created.
+    exposure : float
+        Exposure time in ms.
+    gain : float
+        Gain setting (NaN if unknown).
+    bins : int
+        Bin size.
+    crop : tuple
+        Crop settings of the form (horiz start, horiz end, vert
+        start, vert end).
+    roi : tuple
+        Region of interest of the form (x1, y1, x2, y2).
+
+    """
+    __slots__ = ('data', 'timestamp', 'sequence', 'exposure', 'gain',
+                 'bins', 'crop', 'roi')
+
+    def __init__(self, data, timestamp, sequence, exposure=np.nan,
+                 gain=np.nan, bins=1, crop=(0, 0, 0, 0), roi=(0, 0, 0, 0)):
+        self.data = data
+        self.timestamp = timestamp
+        self.sequence = sequence
+        self.exposure = exposure
+        self.gain = gain
+        self.bins = bins
+        self.crop = tuple(crop)
+        self.roi = tuple(roi)
+
+    @classmethod
+    def from_record(cls, data, record):
+        """Create a Frame from an image and a record of dtype
+        :data:`FRAME_DTYPE`.
+
+        """
+        return cls(data, int(record['timestamp']), int(record['sequence']),
+                   float(record['exposure']), float(record['gain']),
+                   int(record['bins']), [int(x) for x in record['crop']],
+                   [int(x) for x in record['roi']])
+
+    def to_record(self):
+        """Return the metadata as an array of length 1 with dtype
+        :data:`FRAME_DTYPE`.
+
+        """
+        record = np.zeros(1, dtype=FRAME_DTYPE)
+        record['timestamp'] = self.timestamp
+        record['sequence'] = self.sequence
+        record['exposure'] = self.exposure
+        record['gain'] = self.gain
+        record['bins'] = self.bins
+        record['crop'] = self.crop
+        record['roi'] = self.roi
+        return record
+
+    def __array__(self, dtype=None, copy=None):
+        if dtype is None:
+            return self.data
+        return self.data.astype(dtype)
+
+    def __repr__(self):
+        return "<Frame %i: %s %s at %i ns>" % (
+            self.sequence, self.data.shape, self.data.dtype, self.timestamp)
@@ -0,0 +1,114 @@
+"""Frame pool for reusing image buffers
+
+Allocating a new array for every acquired frame puts a lot of
+pressure on the memory allocator at high frame rates. The
+:class:`FramePool` keeps a small number of preallocated NumPy arrays
+around and hands them out to be filled by the camera drivers.
+
+Frames are reference counted. A frame obtained from :meth:`acquire`
+starts with a single reference owned by the caller. Every additional
+consumer that needs to hold on to the frame (the ring buffer, a GUI,
+an analysis thread, ...) should call :meth:`retain` and later
+:meth:`release`. Only when the last reference is released does the
+frame go back to the pool to be overwritten. Frames which are never
+released are simply garbage collected as usual, so it is always safe
+to ignore the pool entirely.
+
+"""
+
+import threading
+import weakref
+import numpy as np
+
+class FramePool(object):
+    """Pool of reusable, reference counted image buffers.
+
+    Attributes
+    ----------
+    max_free : int
+        Maximum number of unused buffers to keep around per frame
+        format.
+    allocated : int
+        Total number of buffers allocated by the pool.
+    reused : int
+        Number of times a buffer was handed out again instead of
+        allocating a new one.
+
+    """
+
+    def __init__(self, max_free=8):
+        assert isinstance(max_free, int)
+        self.max_free = max_free
+        self.allocated = 0
+        self.reused = 0
+        self._lock = threading.Lock()
+        self._free = {}
+        self._refs = {}
+
+    def __len__(self):
+        """Return the number of frames currently handed out."""
+        return len(self._refs)
+
+    def _forget(self, key):
+        """Weak reference callback for frames that were never
+        released.
+
+        """
+        self._refs.pop(key, None)
+
+    def acquire(self, shape, dtype):
+        """Return a buffer with the given shape and dtype. The
+        contents of the buffer are undefined.
+
+        """
+        fmt = (tuple(int(x) for x in shape), np.dtype(dtype))
+        with self._lock:
+            free = self._free.get(fmt)
+            if free:
+                arr = free.pop()
+                self.reused += 1
+            else:
+                arr = np.empty(fmt[0], dtype=fmt[1])
+                self.allocated += 1
+            key = id(arr)
+            self._refs[key] = [weakref.ref(arr, lambda r: self._forget(key)), 1]
+        return arr
+
+    def retain(self, arr):
+        """Add a reference to a frame. Returns False if the frame is
+        not currently handed out by this pool.
+
+        """
+        with self._lock:
+            entry = self._refs.get(id(arr))
+            if entry is None or entry[0]() is not arr:
+                return False
+            entry[1] += 1
+        return True
+
+    def release(self, arr):
+        """Drop a reference to a frame. When no references remain, the
+        frame is returned to the pool. Arrays not belonging to the
+        pool are ignored.
+
+        """
+        with self._lock:
+            key = id(arr)
+            entry = self._refs.get(key)
+            if entry is None or entry[0]() is not arr:
+                return
+            entry[1] -= 1
+            if entry[1] > 0:
+                return
+            del self._refs[key]
+            free = self._free.setdefault((arr.shape, arr.dtype), [])
+            if len(free) < self.max_free:
+                free.append(arr)
+
+    def clear(self):
+        """Discard all unused buffers, e.g., after the frame format
+        has changed.
+
+        """
+        with self._lock:
+            self._free = {}
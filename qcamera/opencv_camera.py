@@ -2,8 +2,8 @@
 
 from __future__ import division
 import numpy as np
-import cv2
 from . import camera
+from .frame import timestamp_ns
 from .exceptions import CameraError
 
 # Constants from OpenCV
@@ -22,6 +22,20 @@ CV_CAP_PROP_HUE = 13
 CV_CAP_PROP_GAIN = 14
 CV_CAP_PROP_EXPOSURE = 15
 
+# OpenCV is only imported when a real camera is opened, so that
+# simulated cameras (and importing qcamera) work without it.
+cv2 = None
+
+def _import_cv2():
+    """Import the cv2 module on first use."""
+    global cv2
+    if cv2 is None:
+        try:
+            import cv2
+        except ImportError:
+            raise CameraError("OpenCV (the cv2 module) is not installed!")
+    return cv2
+
 # OpenCV camera class
 # =============================================================================
 
@@ -32,6 +46,9 @@ class OpenCVCamera(camera.Camera):
 
     """
 
+    # Only the 8 bit grayscale channel is used.
+    native_dtype = np.dtype(np.uint8)
+
     # Setup and shutdown
     # -------------------------------------------------------------------------
     
@@ -53,7 +70,7 @@ class OpenCVCamera(camera.Camera):
         # Try to open the camera
         if not self.real_camera:
             return
-        self.cam = cv2.VideoCapture(port)
+        self.cam = _import_cv2().VideoCapture(port)
         if not self.cam.isOpened():
             raise CameraError("Opening the camera failed!")
 
@@ -72,14 +89,31 @@ class OpenCVCamera(camera.Camera):
     def set_acquisition_mode(self, mode):
         """Set the image acquisition mode."""
 
-    def _acquire_image_data(self):
+    def _get_frame_format(self):
+        """Return the shape and dtype of images as reported by
+        OpenCV.
+
+        """
+        height = int(self.cam.get(CV_CAP_PROP_FRAME_HEIGHT))
+        width = int(self.cam.get(CV_CAP_PROP_FRAME_WIDTH))
+        return (height, width), self.native_dtype
+
+    def _acquire_image_data(self, out):
         """Read the image data from the camera."""
+        stats = self._stats
+        if stats is not None:
+            t = timestamp_ns()
         retval, img = self.cam.read(cv2.CV_LOAD_IMAGE_GRAYSCALE)
+        if stats is not None:
+            t = stats.lap('read', t)
         if not retval:
-            print retval
+            print(retval)
             raise CameraError(
                 "Reading the image failed! Was the camera disconnected?")
-        return np.array(img[:,:,2])
+        out[...] = img[:,:,2]
+        if stats is not None:
+            stats.lap('convert', t)
+        return out
 
     # Triggering
     # -------------------------------------------------------------------------
@@ -2,14 +2,63 @@
 
 import os.path
 import logging
-from datetime import datetime
+import threading
+try:
+    import queue
+except ImportError:
+    import Queue as queue
 import numpy as np
-from scipy.misc import imsave
-import tables
+
+from .frame import FRAME_DTYPE, timestamp_ns
+from .exceptions import RingBufferError
+
+try:
+    string_types = (str, unicode)
+except NameError:
+    string_types = (str,)
+
+# PyTables is only needed by the HDF5 backend and for snapshots, so it
+# is imported on first use rather than with the module.
+tables = None
+
+def _import_tables():
+    """Import PyTables on first use."""
+    global tables
+    if tables is None:
+        import tables
+    return tables
 
 class RingBuffer(object):
     """Ring buffer class.
 
+    Images are stored in a single preallocated, chunked array of shape
+    (N, height, width) so that writing a frame amounts to overwriting
+    one slab in place. Metadata for each slot is kept in a parallel
+    table with the columns of :data:`FRAME_DTYPE`:
+
+    * ``timestamp``: monotonic time of the readout in ns
+    * ``sequence``: sequence number of the frame (-1 if unused)
+    * ``exposure``, ``gain``, ``bins``, ``crop``: camera settings
+    * ``roi``: the ROI at the time of the write
+
+    Metadata is normally supplied by the camera. Images written
+    without metadata are stamped with the time of the write and a
+    running count of written frames.
+
+    The arrays are (re)created whenever the format of the incoming
+    images changes.
+
+    When created with ``threaded=True``, :meth:`write` only places the
+    image in a bounded queue and a background thread does the actual
+    disk access. Since PyTables is not thread-safe, the file is only
+    accessed with a lock held, so the buffer can be read while images
+    are being written. What happens when the queue is full is determined by
+    the overflow policy:
+
+    * ``'block'``: wait until there is room in the queue
+    * ``'drop oldest'``: discard the oldest queued image
+    * ``'drop newest'``: discard the image being written
+
     Attributes
     ----------
     directory : str
@@ -18,8 +67,32 @@ class RingBuffer(object):
         True when data is being saved to the ring buffer.
     N : int
         Number of images to store in the ring buffer.
+    flush_interval : int
+        Number of writes between flushes of the HDF5 file.
+    threaded : bool
+        True when writes are handled by a background thread.
+    overflow : str
+        Overflow policy for the write queue in threaded mode.
+    dropped : int
+        Number of images discarded due to a full write queue.
+    pool : FramePool or None
+        Frame pool that written images may belong to. In threaded
+        mode, pooled images are retained until written rather than
+        copied.
+    stats : AcquisitionStats or None
+        If set, the time spent writing is recorded in the stages
+        ``rbuffer write`` (synchronous writes), ``rbuffer enqueue``
+        and ``rbuffer store`` (threaded mode).
     
     """
+
+    # Valid overflow policies for threaded writing.
+    _overflow_policies = ('block', 'drop oldest', 'drop newest')
+
+    # Description of the per-slot metadata.
+    meta_dtype = FRAME_DTYPE
+
+    stats = None
     
     def __init__(self, **kwargs):
         """Initialize the ring buffer.
@@ -38,6 +111,20 @@ class RingBuffer(object):
             The name of the logger to use. Defaults to 'RingBuffer'.
         roi : list
             The currently selected region of interest.
+        flush_interval : int
+            Flush the HDF5 file after this many writes. Defaults to
+            N.
+        threaded : bool
+            Write to disk from a background thread. Defaults to
+            False.
+        queue_size : int
+            Maximum number of images waiting to be written in
+            threaded mode. Defaults to 16.
+        overflow : str
+            What to do when the write queue is full. One of 'block',
+            'drop oldest' or 'drop newest'. Defaults to 'block'.
+        pool : FramePool
+            Frame pool that written images come from.
 
         """
         directory = kwargs.get('directory', '.')
@@ -46,22 +133,57 @@ class RingBuffer(object):
         N = int(kwargs.get('N', 100))
         logger = kwargs.get('logger', 'RingBuffer')
         roi = kwargs.get('roi', [10, 100, 10, 100])
-        assert isinstance(directory, (str, unicode))
-        assert isinstance(filename, (str, unicode))
+        flush_interval = int(kwargs.get('flush_interval', N))
+        threaded = kwargs.get('threaded', False)
+        queue_size = int(kwargs.get('queue_size', 16))
+        overflow = kwargs.get('overflow', 'block')
+        pool = kwargs.get('pool', None)
+        assert isinstance(directory, string_types)
+        assert isinstance(filename, string_types)
         assert isinstance(recording, (int, bool))
-        assert isinstance(logger, (str, unicode))
+        assert isinstance(logger, string_types)
         assert isinstance(roi, (list, tuple, np.ndarray))
+        assert flush_interval > 0
+        assert queue_size > 0
+        if overflow not in self._overflow_policies:
+            raise ValueError(
+                "overflow must be one of " + repr(self._overflow_policies))
         
         self.recording = recording
         self.N = N
+        self.flush_interval = flush_interval
         self.logger = logging.getLogger(logger)
         self.roi = roi
         self._index = 0
+        self._sequence = 0
+        self._format = None
+        self._unflushed = 0
+        self.threaded = threaded
+        self.overflow = overflow
+        self.dropped = 0
+        self.pool = pool
+
+        # Guards the storage against concurrent access by the writer
+        # thread and readers.
+        self._lock = threading.RLock()
+
+        # Guards the count of written images, which is advanced by
+        # the writing thread rather than the writer thread.
+        self._sequence_lock = threading.Lock()
 
-        # Initialize HDF5 database.
+        # Initialize storage.
         self.filename = os.path.join(directory, filename)
-        self._db = tables.open_file(self.filename, 'w', title="Ring Buffer")
-        self._db.create_group('/', 'images', 'Buffered Images')
+        self._images = None
+        self._frames = None
+        self._open()
+
+        # Start the writer thread.
+        if self.threaded:
+            self._queue = queue.Queue(queue_size)
+            self._writer = threading.Thread(
+                target=self._write_loop, name='RingBufferWriter')
+            self._writer.daemon = True
+            self._writer.start()
 
     def __enter__(self):
         return self
@@ -70,8 +192,97 @@ class RingBuffer(object):
         self.close()
 
     def close(self):
+        """Write any pending images and close the file."""
+        if self.threaded and self._writer.is_alive():
+            self.drain()
+            self._queue.put(None)
+            self._writer.join()
+        with self._lock:
+            self._close()
+
+    def drain(self):
+        """Block until all queued images have been written and flush
+        the file.
+
+        """
+        if self.threaded:
+            self._queue.join()
+        with self._lock:
+            self._flush()
+
+    def get_pending(self):
+        """Return the number of images waiting to be written."""
+        return self._queue.qsize() if self.threaded else 0
+
+    # Storage
+    # -------------------------------------------------------------------------
+
+    # Backends other than HDF5 should override the following methods.
+
+    def _open(self):
+        """Open the HDF5 file."""
+        self._db = _import_tables().open_file(
+            self.filename, 'w', title="Ring Buffer")
+
+    def _close(self):
+        """Close the HDF5 file."""
         self._db.close()
 
+    def _flush(self):
+        """Flush the HDF5 file."""
+        self._db.flush()
+        self._unflushed = 0
+
+    def _allocate(self, shape, dtype):
+        """Create the image array and metadata table for images of the
+        given shape and dtype, replacing any existing ones.
+
+        """
+        if self._images is not None:
+            self._images.remove()
+            self._frames.remove()
+        self.logger.debug(
+            "Allocating ring buffer for %i images of shape %s" % (self.N, str(shape)))
+        self._images = self._db.create_carray(
+            '/', 'images', tables.Atom.from_dtype(dtype),
+            shape=(self.N,) + shape, chunkshape=(1,) + shape,
+            title='Buffered Images')
+        self._frames = self._db.create_table(
+            '/', 'frames', self.meta_dtype, 'Image metadata',
+            expectedrows=self.N)
+        blank = np.zeros(self.N, dtype=self.meta_dtype)
+        blank['sequence'] = -1
+        self._frames.append(blank)
+        self._db.flush()
+        self._format = (shape, dtype)
+        self._index = 0
+
+    def _write_slot(self, index, data, meta):
+        """Write an image and its metadata (an array of length 1) to
+        the slot at index.
+
+        """
+        self._images[index] = data
+        self._frames.modify_rows(index, index + 1, rows=meta)
+        self._unflushed += 1
+        if self._unflushed >= self.flush_interval:
+            self._flush()
+
+    def _write_slots(self, start, data, meta):
+        """Write a stack of images and their metadata to consecutive
+        slots beginning at start.
+
+        """
+        stop = start + len(data)
+        self._images[start:stop] = data
+        self._frames.modify_rows(start, stop, rows=meta)
+        self._unflushed += len(data)
+        if self._unflushed >= self.flush_interval:
+            self._flush()
+
+    # Reading and writing
+    # -------------------------------------------------------------------------
+
     def get_current_index(self):
         """Return the current index. This is in a function to
         hopefully prevent the user from accessing _index directly
@@ -89,33 +300,211 @@ class RingBuffer(object):
         """Toggle the recording state."""
         self.recording = not self.recording
 
-    def write(self, data):
-        """Write data to the ring buffer file."""
+    def write(self, data, meta=None):
+        """Write data to the ring buffer file. In threaded mode, this
+        only queues the data for writing.
+
+        Parameters
+        ----------
+        data : np.ndarray
+            The image.
+        meta : np.ndarray or None
+            Metadata of the image as an array of length 1 with dtype
+            :data:`FRAME_DTYPE`. If None, the image is stamped with
+            the current time and the number of images written so
+            far.
+
+        """
         if not self.recording:
             return
-        name = 'img{:04d}'.format(self._index)
-        try:
-            self._db.get_node('/images/' + name).remove()
-        except tables.NoSuchNodeError:
-            pass
-        finally:
-            # TODO: Adapt to CArray for compression
-            #filters = tables.Filters(complevel=5, complib='zlib')
-            arr = self._db.create_array('/images', name, data)
-            arr.attrs.timestamp = datetime.strftime(datetime.now(), '%Y-%m-%d %H:%M:%S.%f')
-            arr.attrs.roi = self.roi
-            arr.flush()
-        self._db.flush()
-        self._index = self._index + 1 if self._index < self.N - 1 else 0
+        stats = self.stats
+        if stats is not None:
+            t = timestamp_ns()
+        sequence = self._next_sequence(1)
+        if meta is None:
+            meta = self._default_metadata(1, sequence)
+        if not self.threaded:
+            self._store(data, meta)
+            if stats is not None:
+                stats.lap('rbuffer write', t)
+        else:
+            self._enqueue(data, meta, False)
+            if stats is not None:
+                stats.lap('rbuffer enqueue', t)
+
+    def write_many(self, data, meta=None):
+        """Write a stack of images of shape (n, height, width) to the
+        ring buffer in one go. If given, meta is an array of length n
+        with dtype :data:`FRAME_DTYPE`.
+
+        """
+        if not self.recording or len(data) == 0:
+            return
+        stats = self.stats
+        if stats is not None:
+            t = timestamp_ns()
+        sequence = self._next_sequence(len(data))
+        if meta is None:
+            meta = self._default_metadata(len(data), sequence)
+        if not self.threaded:
+            self._store_many(data, meta)
+            if stats is not None:
+                stats.lap('rbuffer write', t)
+        else:
+            self._enqueue(data, meta, True)
+            if stats is not None:
+                stats.lap('rbuffer enqueue', t)
+
+    def _next_sequence(self, n):
+        """Count n written images and return the number of images
+        written before them.
+
+        """
+        with self._sequence_lock:
+            sequence = self._sequence
+            self._sequence += n
+        return sequence
+
+    def _default_metadata(self, n, sequence):
+        """Return metadata for n images written without any, the
+        first of which is number sequence.
+
+        """
+        meta = np.zeros(n, dtype=self.meta_dtype)
+        meta['timestamp'] = timestamp_ns()
+        meta['sequence'] = sequence + np.arange(n)
+        meta['exposure'] = np.nan
+        meta['gain'] = np.nan
+        meta['roi'] = self.roi
+        return meta
+
+    def _enqueue(self, data, meta, many):
+        """Queue data for writing by the writer thread."""
+        # Hold on to pooled images until written, copy anything else
+        # since the caller may reuse it.
+        if self.pool is None or not self.pool.retain(data):
+            data = np.array(data)
+        item = (data, meta, many)
+        if self.overflow == 'block':
+            self._queue.put(item)
+            return
+        while True:
+            try:
+                self._queue.put_nowait(item)
+                return
+            except queue.Full:
+                pass
+            if self.overflow == 'drop newest':
+                self._discard(item)
+                return
+            try:
+                self._discard(self._queue.get_nowait())
+                self._queue.task_done()
+            except queue.Empty:
+                pass
+
+    def _discard(self, item):
+        """Drop a queued image."""
+        self.dropped += len(item[0]) if item[2] else 1
+        if self.pool is not None:
+            self.pool.release(item[0])
+
+    def _write_loop(self):
+        """Write queued images to disk until receiving None."""
+        while True:
+            item = self._queue.get()
+            if item is None:
+                self._queue.task_done()
+                break
+            data, meta, many = item
+            stats = self.stats
+            if stats is not None:
+                t = timestamp_ns()
+            try:
+                if many:
+                    self._store_many(data, meta)
+                else:
+                    self._store(data, meta)
+                if stats is not None:
+                    stats.lap('rbuffer store', t)
+            except Exception:
+                self.logger.exception("Error writing to the ring buffer")
+            finally:
+                if self.pool is not None:
+                    self.pool.release(item[0])
+                self._queue.task_done()
+
+    def _store(self, data, meta):
+        """Write an image and its metadata to the current slot."""
+        with self._lock:
+            fmt = (data.shape, data.dtype)
+            if fmt != self._format:
+                self._allocate(*fmt)
+            index = self._index
+            self._write_slot(index, data, meta)
+            self._index = index + 1 if index < self.N - 1 else 0
+
+    def _store_many(self, data, meta):
+        """Write a stack of images to consecutive slots, wrapping
+        around at the end of the buffer.
+
+        """
+        n = len(data)
+        if n > self.N:
+            # Only the last N images would survive anyway.
+            data = data[n - self.N:]
+            meta = meta[n - self.N:]
+            n = self.N
+        with self._lock:
+            fmt = (data.shape[1:], data.dtype)
+            if fmt != self._format:
+                self._allocate(*fmt)
+            start = self._index
+            split = min(n, self.N - start)
+            self._write_slots(start, data[:split], meta[:split])
+            if split < n:
+                self._write_slots(0, data[split:], meta[split:])
+            self._index = (start + n) % self.N
+
+    def _check_allocated(self):
+        """Raise RingBufferError if nothing has been written yet."""
+        if self._images is None:
+            raise RingBufferError("No images have been written to the ring buffer.")
 
     def read(self, index):
         """Return data from the ring buffer file."""
-        img = self._db.get_node('/images/img{:04d}'.format(index))
-        return np.array(img)
+        with self._lock:
+            self._check_allocated()
+            return self._images[index]
 
     def get_roi(self, index):
         """Return the recorded ROI for the given index."""
-        return self._db.get_node('/images/img{:04d}'.format(index)).attrs.roi
+        with self._lock:
+            self._check_allocated()
+            return list(self._frames[index]['roi'])
+
+    def get_timestamp(self, index):
+        """Return the time in ns at which the image at the given
+        index was read out.
+
+        """
+        with self._lock:
+            self._check_allocated()
+            return self._frames[index]['timestamp']
+
+    def get_metadata(self, index=None):
+        """Return the metadata of the image at the given index, or
+        of all slots if index is None, as a structured array of dtype
+        :data:`FRAME_DTYPE`. Unused slots have a sequence number of
+        -1.
+
+        """
+        with self._lock:
+            if self._frames is None:
+                return np.zeros(0, dtype=self.meta_dtype)
+            if index is None:
+                return self._frames[:]
+            return self._frames[index]
 
     def save_as(self, filename):
         """Save the ring buffer to file filename. The output format
@@ -126,10 +515,107 @@ class RingBuffer(object):
 
         # Save as PNG files in a zip archive.
         if filename[-3:] == 'zip':
-            for node in self._db.list_nodes('/images'):
-                data = node.read()
+            from scipy.misc import imsave
+            sequence = self.get_metadata()['sequence']
+            for index in np.flatnonzero(sequence >= 0):
+                data = self.read(index)
                 imsave('./img.png', data)
 
+class MemoryRingBuffer(RingBuffer):
+    """Ring buffer which keeps the last N images in memory rather
+    than writing every image to disk. The images are stored in a
+    preallocated NumPy array of shape (N, height, width) with the
+    metadata in a parallel structured array. Use :meth:`snapshot` to
+    save the current contents to an HDF5 file with the same layout as
+    that of :class:`RingBuffer`.
+
+    The keyword arguments are the same as for :class:`RingBuffer`;
+    filename is used as the default file name for snapshots.
+
+    """
+
+    def _open(self):
+        pass
+
+    def _close(self):
+        pass
+
+    def _flush(self):
+        pass
+
+    def _allocate(self, shape, dtype):
+        """Allocate memory for N images of the given shape and
+        dtype.
+
+        """
+        self.logger.debug(
+            "Allocating ring buffer for %i images of shape %s" % (self.N, str(shape)))
+        self._images = np.zeros((self.N,) + shape, dtype=dtype)
+        self._frames = np.zeros(self.N, dtype=self.meta_dtype)
+        self._frames['sequence'] = -1
+        self._format = (shape, dtype)
+        self._index = 0
+
+    def _write_slot(self, index, data, meta):
+        self._images[index] = data
+        self._frames[index] = meta[0]
+
+    def _write_slots(self, start, data, meta):
+        stop = start + len(data)
+        self._images[start:stop] = data
+        self._frames[start:stop] = meta
+
+    def get_metadata(self, index=None):
+        with self._lock:
+            meta = super(MemoryRingBuffer, self).get_metadata(index)
+            return meta.copy()
+
+    def read(self, index):
+        """Return a copy of the image at the given index."""
+        with self._lock:
+            self._check_allocated()
+            return self._images[index].copy()
+
+    def snapshot(self, filename=None):
+        """Save the images currently in the ring buffer to an HDF5
+        file in chronological order. Acquisition is only held up for
+        as long as it takes to copy the buffer in memory.
+
+        Parameters
+        ----------
+        filename : str or None
+            File to write to. If None, use the filename attribute.
+
+        Returns
+        -------
+        count : int
+            The number of images saved.
+
+        """
+        if filename is None:
+            filename = self.filename
+        with self._lock:
+            if self._images is None:
+                images = np.zeros((0, 0, 0))
+                frames = np.zeros(0, dtype=self.meta_dtype)
+            else:
+                order = np.argsort(self._frames['sequence'])
+                order = order[self._frames['sequence'][order] >= 0]
+                images = self._images[order]
+                frames = self._frames[order]
+        self.logger.info("Saving %i images to %s" % (len(images), filename))
+        with _import_tables().open_file(
+                filename, 'w', title="Ring Buffer") as db:
+            db.create_array('/', 'images', images, 'Buffered Images')
+            db.create_table('/', 'frames', frames, 'Image metadata')
+        return len(images)
+
+# Available ring buffer backends.
+RING_BUFFERS = {
+    'hdf5': RingBuffer,
+    'memory': MemoryRingBuffer
+}
+
 if __name__ == "__main__":
     from numpy import random
 
@@ -12,13 +12,20 @@ import logging
 import traceback as tb
 import math
 import sys
+import os
+import json
+import time
 import ctypes
+from collections import deque
 import numpy as np
 
 from . import camera
-from .exceptions import SensicamError
+from .frame import timestamp_ns
+from .exceptions import SensicamError, AcquisitionTimeout
 from .sensicam_status_codes import *
 
+_timer = getattr(time, 'perf_counter', time.time)
+
 class MODE(ctypes.Structure):
     _pack_ = 0
     _fields_ = [
@@ -28,10 +35,39 @@ class MODE(ctypes.Structure):
 class Sensicam(camera.Camera):
     """Class for controlling PCO Sensicam cameras."""
 
-    # This will later become a ctypes int and points to the board's
-    # image buffer. To begin, it's set to None so that we don't try to
-    # remove a non-existant buffer!
-    buffer_number = None
+    # Board buffers which images are transferred to, as a list of
+    # (buffer number, address) tuples. They are queued with
+    # ADD_BUFFER_TO_LIST in this order, so the camera fills them in
+    # turn while images are read from the ones already completed.
+    buffers = []
+    n_buffers = 4
+    buffer_size = 0
+
+    # Shape of images for the current COC, cached whenever it changes,
+    # and read-only views of the buffers as images of that shape.
+    image_shape = None
+    _views = []
+
+    # Indices into buffers of the queued buffers in the order they
+    # are filled, and of buffers held by callers of get_view.
+    _queued = deque()
+    _held = []
+
+    # Bounds in s of the interval for polling the status of a buffer.
+    # The interval starts short and doubles while no image arrives,
+    # so that waiting a long time for a trigger barely uses the CPU,
+    # but an image is still noticed within about a millisecond.
+    _poll_min = 0.0001
+    _poll_max = 0.001
+
+    # Results of TEST_COC keyed by the requested COC parameters, and
+    # the JSON file they are kept in (if any).
+    _coc_cache = {}
+    coc_cache_file = None
+
+    # True between start() and stop(), and while waiting for an image.
+    _running = False
+    _waiting = False
 
     # COC gain modes. See p. 24 of the API documentation.
     _coc_gain_modes = {
@@ -84,7 +120,7 @@ class Sensicam(camera.Camera):
             is_warning = code & SENSICAM_CODES['PCO_ERROR_IS_WARNING']
             if code & SENSICAM_CODES['PCO_ERROR_IS_COMMON']:
                 error_text = PCO_ERROR_COMMON_TXT[index]
-            if layer == SENSICAM_CODES['PCO_ERROR_FIRMWARE']:
+            elif layer == SENSICAM_CODES['PCO_ERROR_FIRMWARE']:
                 error_text = PCO_ERROR_FIRMWARE_TXT[index]
             elif layer == SENSICAM_CODES['PCO_ERROR_DRIVER']:
                 error_text = PCO_ERROR_DRIVER_TXT[index]
@@ -165,32 +201,134 @@ class Sensicam(camera.Camera):
         return shape, bit_pix
 
     def _allocate_buffers(self):
-        """Allocate image buffers. This will also get rid of any
-        previously allocated buffers if necessary.
+        """Allocate and map n_buffers image buffers. This will also
+        get rid of any previously allocated buffers if their size no
+        longer matches the image size.
 
         """
         # Get any updated sizes (e.g., if the cropping has changed).
         self._get_sizes()
-        
-        # Free the buffer that already exists if one exists.
-        if self.buffer_number is not None:
+        shape = (self.y_actual, self.x_actual)
+        size = self.x_actual*self.y_actual*((self.bit_pix + 7)//8)
+        if size != self.buffer_size or len(self.buffers) != self.n_buffers:
+            self._free_buffers()
+
+            # Allocate new buffers.
+            self.buffer_size = size
+            for i in range(self.n_buffers):
+                number = ctypes.c_int(-1)
+                address = ctypes.c_void_p()
+                self._chk(self.clib.ALLOCATE_BUFFER(
+                    self.filehandle, ctypes.pointer(number),
+                    ctypes.pointer(ctypes.c_int(size))))
+                self.buffers.append((number, address))
+                self._chk(self.clib.MAP_BUFFER(
+                    self.filehandle, number, size, 0, ctypes.pointer(address)))
+        elif shape == self.image_shape:
+            return
+
+        # Views of the buffers only need to be made when the image
+        # shape changes, not for every image.
+        self.image_shape = shape
+        self._views = [self._buffer_view(address)
+                       for number, address in self.buffers]
+        self._held = []
+
+    def _free_buffers(self):
+        """Remove all buffers from the queue and free them."""
+        if self.buffers:
             self._chk(self.clib.REMOVE_ALL_BUFFERS_FROM_LIST(self.filehandle))
-            self._chk(self.clib.FREE_BUFFER(self.filehandle, self.buffer_number))
-        else:
-            self.buffer_number = ctypes.c_int(-1)
-
-        # Allocate a new bufer.
-        self.address = ctypes.c_void_p()
-        self.buffer_size = ctypes.c_int(int(self.x_actual*self.y_actual*((self.bit_pix + 7)/8)))
-        self._chk(self.clib.ALLOCATE_BUFFER(
-            self.filehandle, ctypes.pointer(self.buffer_number),
-            ctypes.pointer(self.buffer_size)))
-        self._chk(self.clib.MAP_BUFFER(
-            self.filehandle, self.buffer_number, self.buffer_size, 0,
-            ctypes.pointer(self.address)))
-        self._chk(self.clib.SETBUFFER_EVENT(
-            self.filehandle, self.buffer_number,
-            ctypes.pointer(ctypes.c_int(-1))))
+            for number, address in self.buffers:
+                self._chk(self.clib.FREE_BUFFER(self.filehandle, number))
+        self.buffers = []
+        self.buffer_size = 0
+        self.image_shape = None
+        self._views = []
+        self._held = []
+        self._queued.clear()
+
+    def _queue_buffers(self):
+        """Queue all buffers not held by callers of :meth:`get_view`
+        for receiving the next images, in order.
+
+        """
+        self._chk(self.clib.REMOVE_ALL_BUFFERS_FROM_LIST(self.filehandle))
+        self._queued.clear()
+        for i in range(len(self.buffers)):
+            if i not in self._held:
+                self._queue_buffer(i)
+
+    def _queue_buffer(self, i):
+        """Add buffer i to the end of the queue."""
+        self._chk(self.clib.ADD_BUFFER_TO_LIST(
+            self.filehandle, self.buffers[i][0], self.buffer_size, 0, 0))
+        self._queued.append(i)
+
+    def _buffer_view(self, address):
+        """Return a read-only NumPy array of shape image_shape using
+        the memory of a mapped buffer.
+
+        """
+        n = self.x_actual*self.y_actual
+        data = (ctypes.c_uint16*n).from_address(address.value)
+        view = np.ctypeslib.as_array(data).reshape(self.image_shape)
+        view.flags.writeable = False
+        return view
+
+    def _wait_for_buffer(self, number):
+        """Wait until the board has finished transferring an image
+        into the buffer with the given number. The buffer status is
+        polled at intervals growing from _poll_min to _poll_max while
+        no image arrives.
+
+        Raises
+        ------
+        AcquisitionTimeout
+            If no image arrives within :attr:`wait_timeout` ms or, if
+            that is None, within ten exposure times with software
+            triggering. With external triggering, the default is to
+            wait indefinitely.
+        AcquisitionCancelled
+            If :meth:`cancel_wait` or :meth:`stop` is called while
+            waiting.
+
+        """
+        timeout = self.wait_timeout
+        if timeout is None and self.trigger_mode == 0:
+            timeout = 10*self.t_ms
+        if timeout is not None:
+            deadline = _timer() + timeout/1000.
+        status = (ctypes.c_int*2)()
+        interval = self._poll_min
+        self._waiting = True
+        self.waiting_for_trigger = self.trigger_mode != 0
+        try:
+            while True:
+                self._check_cancelled()
+                self._chk(self.clib.GETBUFFER_STATUS(
+                    self.filehandle, number, 0, status, ctypes.sizeof(status)))
+                if status[0] & PCO_BUFFER_DONE:
+                    self._chk(status[1])
+                    return
+                if not self._running:
+                    # Stopping from another thread cancels the wait.
+                    self._check_cancelled()
+                    raise SensicamError("Acquisition is not running.")
+                delay = interval
+                if timeout is not None:
+                    remaining = deadline - _timer()
+                    if remaining <= 0:
+                        raise AcquisitionTimeout(
+                            "No image within %g ms." % timeout)
+                    delay = min(delay, remaining)
+
+                # Sleep on the cancel event so that cancel_wait wakes
+                # this up right away.
+                self._cancel.wait(delay)
+                interval = min(2*interval, self._poll_max)
+        finally:
+            self._waiting = False
+            self.waiting_for_trigger = False
                 
     def _to_sensi_crop(self, crop):
         """Convert a crop tuple/list in actual pixels into PCO's units
@@ -216,11 +354,51 @@ class Sensicam(camera.Camera):
         crop = [1 if x == 32 else x for x in crop]
         return crop
 
+    def _load_coc_cache(self):
+        """Load the results of previous calls to TEST_COC from
+        coc_cache_file.
+
+        """
+        self._coc_cache = {}
+        if self.coc_cache_file is None or not os.path.exists(self.coc_cache_file):
+            return
+        try:
+            with open(self.coc_cache_file) as f:
+                self._coc_cache = json.load(f)
+        except (IOError, OSError, ValueError) as e:
+            self.logger.warning(
+                "Could not read the COC cache %s: %s" % (self.coc_cache_file, e))
+            return
+        self.logger.debug(
+            "Loaded %i validated COC settings from %s" % (
+                len(self._coc_cache), self.coc_cache_file))
+
+    def _save_coc_cache(self):
+        """Write the results of TEST_COC to coc_cache_file."""
+        if self.coc_cache_file is None:
+            return
+        try:
+            directory = os.path.dirname(self.coc_cache_file)
+            if directory and not os.path.isdir(directory):
+                os.makedirs(directory)
+            with open(self.coc_cache_file, 'w') as f:
+                json.dump(self._coc_cache, f, indent=1, sort_keys=True)
+        except (IOError, OSError) as e:
+            self.logger.warning(
+                "Could not write the COC cache %s: %s" % (self.coc_cache_file, e))
+
     def _test_coc(self, mode, trigger, crop, bins, delay, t_exp):
         """Test the parameters to give to the SDK SET_COC
         function. This will modify the values using the SDK TEST_COC
         function to the nearest acceptable values.
 
+        The results are cached, so that TEST_COC is only called the
+        first time a combination of mode, trigger, crop and bins is
+        requested (also across sessions if coc_cache_file is set).
+        The timing is range checked by :meth:`_update_coc` and never
+        adjusted, so changing only the exposure time does not need
+        TEST_COC.
+
         The arguments are the same as the kwargs given to
         :func:`_update_coc.`.
 
@@ -230,7 +408,25 @@ class Sensicam(camera.Camera):
         # can fake something if it's not a real camera?
         if not self.real_camera:
             return
-            
+
+        # JSON object keys have to be strings.
+        key = json.dumps(
+            [int(x) for x in list(mode) + [trigger] + list(crop) + [bins]])
+        cached = self._coc_cache.get(key)
+        if cached is None:
+            result = self._negotiate_coc(
+                mode, trigger, list(crop), bins, delay, t_exp)
+            cached = [int(result[1]), [int(x) for x in result[2]], int(result[3])]
+            self._coc_cache[key] = cached
+            self._save_coc_cache()
+        trigger, crop, bins = cached
+        return mode, trigger, list(crop), bins, delay, t_exp
+
+    def _negotiate_coc(self, mode, trigger, crop, bins, delay, t_exp):
+        """Call TEST_COC for :meth:`_test_coc` and return the adjusted
+        parameters.
+
+        """
         # Prepare C data
         _ptr = lambda x: ctypes.pointer(x)
         self.logger.debug(
@@ -247,7 +443,7 @@ class Sensicam(camera.Camera):
         c_crop_y1 = ctypes.c_int(crop[2])
         c_crop_y2 = ctypes.c_int(crop[3])
         xbins, ybins = ctypes.c_int(bins), ctypes.c_int(bins)
-        timing = "%i,%i" % (delay, t_exp)
+        timing = ("%i,%i" % (delay, t_exp)).encode()
         c_timing = ctypes.c_char_p(timing)
         self._chk(self.clib.TEST_COC(
             self.filehandle, _ptr(c_mode), _ptr(c_trigger),
@@ -354,7 +550,7 @@ class Sensicam(camera.Camera):
         t_exp = kwargs.get('t_exp', self.t_ms)
         if not 1 <= t_exp <= 1000000:
             raise SensicamError("t_exp must be between 1 and 1E6 ms.")
-        timing = ctypes.c_char_p("%i,%i" % (delay, t_exp))
+        timing = ctypes.c_char_p(("%i,%i" % (delay, t_exp)).encode())
 
         # Test new values and update class attributes.
         mode, trigger, crop, bins, delay, t_exp = \
@@ -385,6 +581,33 @@ class Sensicam(camera.Camera):
         if kwargs.get('start', True):
             self.start()
 
+    def _apply_settings(self, settings):
+        """Apply changes of the trigger mode, crop, bins and exposure
+        time with a single COC update.
+
+        """
+        if not self.real_camera:
+            return super(Sensicam, self)._apply_settings(settings)
+        settings = dict(settings)
+        coc = {}
+        if 'trigger_mode' in settings:
+            mode = settings.pop('trigger_mode')
+            if type(mode) == str:
+                mode = self._trigger_modes[mode]
+            self.trigger_mode = coc['trigger'] = mode
+        if 'crop' in settings:
+            crop = settings.pop('crop')
+            self._check_crop(crop)
+            self.pool.clear()
+            coc['crop'] = crop
+        if 'bins' in settings:
+            coc['bins'] = settings.pop('bins')
+        if 'exposure_time' in settings:
+            self.t_ms = coc['t_exp'] = settings.pop('exposure_time')
+        if coc:
+            self._update_coc(**coc)
+        super(Sensicam, self)._apply_settings(settings)
+
     def _get_actual(self):
         """Return the 'actual' sizes. Whatever that means."""
         dummy = ctypes.c_int()
@@ -411,26 +634,50 @@ class Sensicam(camera.Camera):
             A tuple of the form [x1, y1, x2, y2] specifying the
             cropped portion of the sensor to use. If None, use the
             full sensor. Defaults to [1, 1, 640, 480].
+        n_buffers : int
+            Number of board buffers to queue. While an image is read
+            from one buffer, the camera can transfer the following
+            ones into the others. Defaults to 4.
+        serial : str or None
+            Serial number of the camera, used in the default name of
+            the COC cache. The SDK does not report it, so unless it is
+            given, the COC cache is only kept in memory.
+        coc_cache : str or None
+            JSON file to keep the COC settings validated by the
+            camera in, so that they need not be validated again in
+            later sessions. None only keeps them in memory. Defaults
+            to ``~/.qcamera/sensicam-<serial>.json`` if serial is
+            given and no stand-in library is given with the sdk
+            argument, otherwise None.
 
         """
 
         # Get kwargs.
         bins = kwargs.get('bins', 1)
         crop = kwargs.get('crop', [1, 1, 640, 480])
+        self.n_buffers = kwargs.get('n_buffers', 4)
+        self.serial = kwargs.get('serial', None)
+        coc_cache = kwargs.get('coc_cache', '')
+        self._queued = deque()
 
         # Check kwargs.
         assert isinstance(bins, int)
         assert isinstance(crop, (list, tuple, np.ndarray))
+        assert isinstance(self.n_buffers, int) and self.n_buffers >= 1
         
-        # Load the DLL.
+        # Load the DLL unless a library was given.
         if not self.real_camera:
             return
-        if 'win' in sys.platform:
+        stand_in = self.clib is not None
+        if stand_in:
+            pass
+        elif 'win' in sys.platform:
             self.clib = ctypes.windll.sen_cam
         else:
             self.clib = ctypes.cdll.sen_cam
 
         # Initalize the camera.
+        self.buffers = []
         self.filehandle = ctypes.c_int()
         self._chk(self.clib.INITBOARD(0, ctypes.pointer(self.filehandle)))
         self._chk(self.clib.SETUP_CAMERA(self.filehandle))
@@ -441,12 +688,22 @@ class Sensicam(camera.Camera):
         self.shape, self.bit_pix = self._get_sizes()
         self.crop = [1, self.shape[0], 1, self.shape[1]]
 
-        # Write camera settings to the hardware
+        # Load the COC settings validated in previous sessions. They
+        # are only valid for the same camera, so without its serial
+        # number they are not kept. Neither should a stand-in SDK's
+        # results be mistaken for those of a real camera.
+        if coc_cache == '' and (stand_in or self.serial is None):
+            coc_cache = None
+        elif coc_cache == '':
+            coc_cache = os.path.join(
+                os.path.expanduser('~'), '.qcamera',
+                'sensicam-%s.json' % self.serial)
+        self.coc_cache_file = coc_cache
+        self._load_coc_cache()
+
+        # Write camera settings to the hardware and run the COC.
         self._update_coc()
 
-        # Run COC
-        self.start()
-
     def close(self):
         """Close the camera safely. Anything necessary for doing so
         should be defined here.
@@ -455,8 +712,7 @@ class Sensicam(camera.Camera):
         if not self.real_camera:
             return
         self.stop()
-        self._chk(self.clib.REMOVE_ALL_BUFFERS_FROM_LIST(self.filehandle))
-        self._chk(self.clib.FREE_BUFFER(self.filehandle, self.buffer_number))
+        self._free_buffers()
         self._chk(self.clib.CLOSEBOARD(ctypes.pointer(self.filehandle)))
 
     def get_camera_properties(self):
@@ -481,38 +737,70 @@ class Sensicam(camera.Camera):
         self.logger.warn("No action: set_acquisition_mode not yet implemented.")
         #self._update_coc()
 
-    def _acquire_image_data(self):
-        """Acquire the current image from the camera."""
-        # Times 2 because the camera returns 16 bit data... despite
-        # the function having 12 bit in the name...
-        bytes_to_read = self.x_actual*self.y_actual*2
-        if self.trigger_mode != 0:
-            while True:
-                result = self.clib.WAIT_FOR_IMAGE(self.filehandle, 1)
-                if result == 0:
-                    break
-        else:
-            self._chk(self.clib.WAIT_FOR_IMAGE(self.filehandle, int(self.t_ms*10)))
-        self._chk(self.clib.READ_IMAGE_12BIT(
-            self.filehandle, 0, self.x_actual, self.y_actual, self.address))
-        img = np.fromstring(
-            ctypes.string_at(self.address, bytes_to_read), dtype=np.uint16)
-        crop = self._to_sensi_crop(self.crop)
-        shape = np.array([crop[1] - crop[0] + 1, crop[3] - crop[2] + 1])[::-1]*(32/self.bins)
-        #shape = (self.crop[1]/self.bins, self.crop[3]/self.bins)[::-1]
-        try:
-            img.shape = shape
-        except:
-            # e = sys.exc_info()
-            # print(e)
-            self.logger.debug('bytes_to_read = %i' % bytes_to_read)
-            self.logger.debug('self.crop = ' + ', '.join([str(i) for i in self.crop]))
-            self.logger.debug('sensi_crop = ' + ', '.join([str(i) for i in crop]))
-            self.logger.debug("img.shape = %i" % (img.shape[0]))
-            self.logger.debug("shape = (%i, %i)" % (shape[0], shape[1]))
-            tb.print_stack()
-            #img = self._acquire_image_data() # Try again
-        return img
+    def _get_frame_format(self):
+        """Return the shape and dtype of images. The camera returns
+        16 bit data despite the SDK function having 12 bit in the
+        name.
+
+        """
+        return self.image_shape, self.native_dtype
+
+    def _next_image(self):
+        """Wait for the image in the buffer at the front of the queue
+        and return the buffer's index.
+
+        """
+        if not self._queued:
+            raise SensicamError(
+                "No buffers queued. Release views with release_view.")
+        i = self._queued[0]
+        self._wait_for_buffer(self.buffers[i][0])
+        self._queued.popleft()
+        return i
+
+    def _acquire_image_data(self, out):
+        """Acquire the next image from the queue of board buffers."""
+        stats = self._stats
+        if stats is not None:
+            t = timestamp_ns()
+        i = self._next_image()
+        if stats is not None:
+            t = stats.lap('wait', t)
+
+        # Copy the image out of the mapped buffer and queue the buffer
+        # again right away, so that the camera always has buffers to
+        # transfer the following images to.
+        np.copyto(out, self._views[i])
+        self._queue_buffer(i)
+        if stats is not None:
+            stats.lap('readout', t)
+        return out
+
+    def _acquire_view(self):
+        """Wait for the next image and lend the buffer holding it to
+        the caller of :meth:`get_view`.
+
+        """
+        stats = self._stats
+        if stats is not None:
+            t = timestamp_ns()
+        i = self._next_image()
+        self._held.append(i)
+        if stats is not None:
+            stats.lap('wait', t)
+        return self._views[i]
+
+    def _release_view(self, img):
+        """Queue the buffer of a view returned by :meth:`get_view`
+        again.
+
+        """
+        for i in self._held:
+            if self._views[i] is img:
+                self._held.remove(i)
+                self._queue_buffer(i)
+                return True
+        return False
         
     # Triggering
     # -------------------------------------------------------------------------
@@ -533,11 +821,25 @@ class Sensicam(camera.Camera):
         self._update_coc()
 
     def start(self):
-        """Begin accepting triggers."""
+        """Begin accepting triggers. Images left in the board buffers
+        from before are discarded.
+
+        """
+        if self.buffers:
+            # The queue can only be reset while the COC is stopped.
+            self._chk(self.clib.STOP_COC(self.filehandle, 0))
+            self._queue_buffers()
         self._chk(self.clib.RUN_COC(self.filehandle, 0))
+        self._running = True
 
     def stop(self):
-        """Stop image acquisition."""
+        """Stop image acquisition. A wait for an image in another
+        thread raises :class:`AcquisitionCancelled`.
+
+        """
+        if self._waiting:
+            self._cancel.set()
+        self._running = False
         self._chk(self.clib.STOP_COC(self.filehandle, 0))
 
     # Gain and exposure time
@@ -217,6 +217,17 @@ SENSICAM_CODES = {
 _inverse = {v:k for k, v in SENSICAM_CODES.items()}
 SENSICAM_CODES.update(_inverse)
 
+# Buffer status
+# =============
+
+# Flags in the first word of the status returned by
+# GETBUFFER_STATUS. The second word holds the error code of the last
+# transfer into the buffer.
+PCO_BUFFER_ALLOCATED = 0x0001
+PCO_BUFFER_EVENT = 0x0002
+PCO_BUFFER_QUEUED = 0x0010
+PCO_BUFFER_DONE = 0x0020
+
 # Error texts
 # ===========
 
@@ -0,0 +1,190 @@
+"""Simulated image sensor
+
+This is used for generating images when a camera is not real (i.e.,
+when it is created with ``real=False``). The simulated scene is a
+Gaussian spot on a constant background. Everything that does not
+change from frame to frame is computed once and cached per crop and
+binning setting, so that generating a frame only costs the noise
+generation and a conversion to the output dtype.
+
+The noise model consists of
+
+* Poisson shot noise on the expected number of photoelectrons
+* electron multiplication for EMCCD-like sensors, modeled by a gamma
+  distribution with the number of input electrons as shape parameter
+* Gaussian read noise
+* conversion to ADC counts with an offset, clipped to the range of
+  the output dtype
+
+"""
+
+from __future__ import division
+import time
+import numpy as np
+
+# Timer used for pacing frames.
+_timer = getattr(time, 'perf_counter', time.time)
+
+class SimulatedSensor(object):
+    """Simulated image sensor.
+
+    Attributes
+    ----------
+    shape : tuple
+        Number of pixels (x, y) of the full sensor.
+    dtype : np.dtype
+        Data type of the generated images.
+    center : tuple
+        Position (x0, y0) of the simulated spot in unbinned pixels.
+    sigma : float
+        Width of the spot in unbinned pixels.
+    peak_rate : float
+        Photoelectrons per ms at the center of the spot.
+    background_rate : float
+        Background photoelectrons per ms and unbinned pixel.
+    shot_noise : bool
+        Add Poisson shot noise when True.
+    read_noise : float
+        RMS read noise in electrons. 0 disables read noise.
+    em_gain : float
+        Electron multiplying gain. Values <= 1 disable electron
+        multiplication.
+    sensitivity : float
+        Electrons per ADC count.
+    offset : float
+        ADC offset in counts.
+    pacing : str or float
+        Controls how quickly frames are produced. 'exposure' delivers
+        a frame once per exposure time, 'free' delivers frames as fast
+        as they can be generated, and a number gives a fixed frame
+        rate in Hz.
+
+    """
+
+    def __init__(self, shape, dtype=np.uint16, **kwargs):
+        """Create a simulated sensor. All attributes except shape and
+        dtype may be given as keyword arguments. Additionally, the
+        keyword argument seed can be used to seed the random number
+        generator.
+
+        """
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        self.center = kwargs.get('center', (self.shape[0]/2., self.shape[1]/2.))
+        self.sigma = float(kwargs.get('sigma', 20.))
+        if self.dtype.kind in 'iu':
+            full_scale = min(np.iinfo(self.dtype).max, 2**16 - 1)
+        else:
+            full_scale = 1000.
+        self.peak_rate = float(kwargs.get('peak_rate', full_scale/400.))
+        self.background_rate = float(
+            kwargs.get('background_rate', self.peak_rate/20.))
+        self.shot_noise = kwargs.get('shot_noise', True)
+        self.read_noise = float(kwargs.get('read_noise', 0.))
+        self.em_gain = float(kwargs.get('em_gain', 1.))
+        self.sensitivity = float(kwargs.get('sensitivity', 1.))
+        self.offset = float(kwargs.get('offset', 0.))
+        self.pacing = kwargs.get('pacing', 'exposure')
+        assert self.pacing in ('exposure', 'free') or float(self.pacing) > 0
+        self.seed(kwargs.get('seed', None))
+        self._templates = {}
+        self._deadline = None
+
+    def seed(self, seed=None):
+        """(Re)seed the random number generator."""
+        self.rng = np.random.RandomState(seed)
+
+    # Frame geometry
+    # -------------------------------------------------------------------------
+
+    def get_frame_format(self, crop, bins):
+        """Return the shape and dtype of images generated with the
+        given crop and binning. crop has the same form as
+        :attr:`Camera.crop`.
+
+        """
+        cols = (crop[1] - crop[0] + 1)//bins
+        rows = (crop[3] - crop[2] + 1)//bins
+        return (rows, cols), self.dtype
+
+    def _get_template(self, crop, bins):
+        """Return the normalized spot profile for the given crop and
+        binning. The profile is separable, so it is computed as an
+        outer product of two 1D profiles evaluated at the centers of
+        the binned pixels.
+
+        """
+        key = (self.shape, bins, tuple(crop))
+        template = self._templates.get(key)
+        if template is None:
+            (rows, cols), _ = self.get_frame_format(crop, bins)
+            offset = (bins - 1)/2.
+            x = crop[0] - 1 + bins*np.arange(cols) + offset
+            y = crop[2] - 1 + bins*np.arange(rows) + offset
+            x0, y0 = self.center
+            gx = np.exp(-(x - x0)**2/(2*self.sigma**2))
+            gy = np.exp(-(y - y0)**2/(2*self.sigma**2))
+            template = bins**2*np.outer(gy, gx)
+            if len(self._templates) > 16:
+                self._templates.clear()
+            self._templates[key] = template
+        return template
+
+    # Image generation
+    # -------------------------------------------------------------------------
+
+    def expose(self, out, t_ms, crop, bins):
+        """Simulate an exposure and store the result in out. If out
+        is 3 dimensional, it is filled with a stack of independent
+        exposures.
+
+        """
+        template = self._get_template(crop, bins)
+        signal = template*(self.peak_rate*t_ms)
+        signal += self.background_rate*t_ms*bins**2
+        if out.ndim == 3:
+            signal = np.broadcast_to(signal, out.shape)
+        if self.shot_noise:
+            electrons = self.rng.poisson(signal).astype(np.float64)
+        else:
+            electrons = np.array(signal, dtype=np.float64)
+        if self.em_gain > 1:
+            hit = electrons > 0
+            electrons[hit] = self.rng.gamma(electrons[hit], self.em_gain)
+        if self.read_noise > 0:
+            electrons += self.rng.normal(0, self.read_noise, electrons.shape)
+        counts = electrons
+        if self.sensitivity != 1:
+            counts /= self.sensitivity
+        if self.offset:
+            counts += self.offset
+        if out.dtype.kind in 'iu':
+            info = np.iinfo(out.dtype)
+            np.clip(counts, info.min, info.max, out=counts)
+        out[...] = counts
+        return out
+
+    def wait(self, t_ms, n=1, cancel=None):
+        """Wait until n more frames would have been delivered
+        according to the pacing setting. If cancel is a
+        threading.Event, the wait ends early when it is set, in which
+        case False is returned.
+
+        """
+        if self.pacing == 'free':
+            return True
+        if self.pacing == 'exposure':
+            period = t_ms/1000.
+        else:
+            period = 1./float(self.pacing)
+        now = _timer()
+        if self._deadline is None or self._deadline < now - period:
+            # Don't try to catch up after a long pause.
+            self._deadline = now
+        self._deadline += n*period
+        delay = self._deadline - now
+        if delay > 0:
+            if cancel is not None:
+                return not cancel.wait(delay)
+            time.sleep(delay)
+        return True
@@ -0,0 +1,198 @@
+"""Acquisition statistics
+
+Optional instrumentation of the acquisition hot path. When enabled
+(see :meth:`Camera.enable_stats`), the time spent in each stage of
+acquiring an image (waiting for a trigger or the exposure, reading out
+the SDK buffer, converting the data, writing to the ring buffer, ...)
+is recorded in a :class:`LatencyHistogram` per stage.
+
+The histograms use a fixed set of logarithmic buckets, so recording a
+sample is a handful of integer operations and memory use does not grow
+with the number of frames. Percentiles are therefore only accurate to
+within a factor of two, which is plenty for finding out which stage is
+to blame for a drop in frame rate.
+
+When statistics are disabled, the instrumented code only pays for a
+check of ``stats is not None``.
+
+"""
+
+from __future__ import division
+import threading
+
+import numpy as np
+
+from .frame import timestamp_ns
+
+class LatencyHistogram(object):
+    """Histogram of durations with logarithmic buckets.
+
+    Bucket 0 counts durations below 1 us and bucket i counts durations
+    of at least 2**(i - 1) us and less than 2**i us. The last bucket
+    also counts anything longer.
+
+    Attributes
+    ----------
+    count : int
+        Number of recorded samples.
+    total : int
+        Sum of all samples in ns.
+    min, max : int
+        Shortest and longest sample in ns.
+    buckets : list
+        Sample counts per bucket.
+
+    """
+    __slots__ = ('count', 'total', 'min', 'max', 'buckets')
+
+    # Number of buckets; the last one starts at 2**(n_buckets - 2) us,
+    # i.e., about 4 minutes.
+    n_buckets = 30
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0
+        self.min = 0
+        self.max = 0
+        self.buckets = [0]*self.n_buckets
+
+    def record(self, ns):
+        """Add a sample of ns nanoseconds."""
+        ns = int(ns)
+        if self.count == 0 or ns < self.min:
+            self.min = ns
+        if ns > self.max:
+            self.max = ns
+        self.count += 1
+        self.total += ns
+        bucket = (ns//1000).bit_length()
+        if bucket >= self.n_buckets:
+            bucket = self.n_buckets - 1
+        self.buckets[bucket] += 1
+
+    def percentile(self, q):
+        """Return an upper bound for the q-th percentile in ns, i.e.,
+        the upper edge of the bucket the percentile falls into.
+
+        """
+        if self.count == 0:
+            return np.nan
+        threshold = q/100.*self.count
+        cumulative = 0
+        for i, n in enumerate(self.buckets):
+            cumulative += n
+            if cumulative >= threshold and n > 0:
+                return min(2**i*1000, self.max)
+        return self.max
+
+    def summary(self):
+        """Return a dict summarizing the histogram with all times in
+        microseconds.
+
+        """
+        if self.count == 0:
+            return {'count': 0}
+        return {
+            'count': self.count,
+            'mean_us': self.total/self.count/1e3,
+            'min_us': self.min/1e3,
+            'max_us': self.max/1e3,
+            'p50_us': self.percentile(50)/1e3,
+            'p99_us': self.percentile(99)/1e3,
+            'buckets': list(self.buckets)
+        }
+
+class AcquisitionStats(object):
+    """Per-stage latency histograms and throughput counters of a
+    camera.
+
+    Stages are identified by name and created on first use. Each
+    stage should only be recorded from a single thread; different
+    stages may be recorded from different threads (e.g., the ring
+    buffer's writer thread).
+
+    Attributes
+    ----------
+    stages : dict
+        :class:`LatencyHistogram` per stage name.
+    frames : int
+        Number of frames acquired.
+    bytes : int
+        Number of bytes of image data acquired.
+    dropped : int
+        Number of frames the camera delivered but were lost before
+        being read out.
+
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """Clear all statistics."""
+        with self._lock:
+            self.stages = {}
+            self.frames = 0
+            self.bytes = 0
+            self.dropped = 0
+            self._first = None
+            self._last = None
+
+    def record(self, stage, ns):
+        """Record a duration of ns nanoseconds for the given stage."""
+        hist = self.stages.get(stage)
+        if hist is None:
+            with self._lock:
+                hist = self.stages.setdefault(stage, LatencyHistogram())
+        hist.record(ns)
+
+    def lap(self, stage, t0):
+        """Record the time elapsed since t0 (in ns, as returned by
+        :func:`timestamp_ns`) for the given stage and return the
+        current time, so that consecutive stages can be timed as::
+
+            t = timestamp_ns()
+            do_this()
+            t = stats.lap('this', t)
+            do_that()
+            t = stats.lap('that', t)
+
+        """
+        now = timestamp_ns()
+        self.record(stage, now - t0)
+        return now
+
+    def add_frames(self, n, nbytes):
+        """Count n acquired frames totalling nbytes bytes."""
+        now = timestamp_ns()
+        if self._first is None:
+            self._first = now
+        self._last = now
+        self.frames += n
+        self.bytes += nbytes
+
+    def report(self):
+        """Return a dict with the achieved frame rate, throughput,
+        number of dropped frames and a summary of each stage.
+
+        """
+        if self._first is not None and self._last > self._first:
+            elapsed = (self._last - self._first)/1e9
+            # The first frame marks the start of the measurement.
+            fps = (self.frames - 1)/elapsed if self.frames > 1 else 0.
+            throughput = self.bytes*(self.frames - 1)/self.frames/elapsed
+        else:
+            elapsed = 0.
+            fps = 0.
+            throughput = 0.
+        return {
+            'frames': self.frames,
+            'elapsed': elapsed,
+            'fps': fps,
+            'bytes': self.bytes,
+            'bytes_per_second': throughput,
+            'dropped': self.dropped,
+            'stages': dict(
+                (name, hist.summary()) for name, hist in self.stages.items())
+        }
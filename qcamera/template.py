@@ -36,9 +36,20 @@ class Template(camera.Camera):
     def set_acquisition_mode(self, mode):
         """Set the image acquisition mode."""
 
-    def _acquire_image_data(self):
+    def _get_frame_format(self):
+        """Return the shape and dtype of the image data as a tuple of
+        the form (shape, dtype).
+
+        """
+
+    def _acquire_image_data(self, out):
         """Code for getting image data from the camera should be
-        placed here. This must return a numpy array.
+        placed here. The data must be written into the numpy array
+        out.
+
+        If self._stats is not None, the time spent in each step
+        should be recorded with self._stats.lap (see
+        :class:`qcamera.stats.AcquisitionStats`).
 
         """
 
@@ -10,11 +10,35 @@ Python implementation of ueye interface: https://github.com/bernardokyotoku/pydc
 
 from __future__ import print_function
 import sys
+import time
 import ctypes
-from ctypes import byref, c_double, c_int
+from ctypes import byref, c_double, c_int, c_void_p
 import numpy as np
 from .camera import Camera
-from .exceptions import ThorlabsDCxError
+from .frame import timestamp_ns
+from .exceptions import ThorlabsDCxError, AcquisitionTimeout
+
+_timer = getattr(time, 'perf_counter', time.time)
+
+# Constants from uEye.h
+IS_SUCCESS = 0
+IS_TIMED_OUT = 122
+IS_IGNORE_PARAMETER = -1
+IS_DONT_WAIT = 0
+IS_FORCE_VIDEO_STOP = 0x4000
+IS_SET_EVENT_FRAME = 2
+IS_AOI_IMAGE_SET_AOI = 0x0001
+IS_AOI_IMAGE_GET_AOI = 0x0002
+IS_AOI_IMAGE_GET_POS_INC = 0x0011
+IS_AOI_IMAGE_GET_SIZE_INC = 0x0012
+IS_GET_SUPPORTED_BINNING = 0x8001
+
+# Binning modes (horizontal and vertical) by bin size.
+_BINNING_MODES = {
+    1: 0x0000, # IS_BINNING_DISABLE
+    2: 0x0003, # IS_BINNING_2X_VERTICAL | IS_BINNING_2X_HORIZONTAL
+    4: 0x000c  # IS_BINNING_4X_VERTICAL | IS_BINNING_4X_HORIZONTAL
+}
 
 class CamInfo(ctypes.Structure):
     _fields_ = [
@@ -26,10 +50,77 @@ class CamInfo(ctypes.Structure):
         ("Type", ctypes.c_byte),
         ("Reserved", ctypes.c_char)
     ]
+
+class SensorInfo(ctypes.Structure):
+    _fields_ = [
+        ("SensorID", ctypes.c_uint16),
+        ("strSensorName", ctypes.c_char*32),
+        ("nColorMode", ctypes.c_char),
+        ("nMaxWidth", ctypes.c_uint32),
+        ("nMaxHeight", ctypes.c_uint32),
+        ("bMasterGain", ctypes.c_int32),
+        ("bRGain", ctypes.c_int32),
+        ("bGGain", ctypes.c_int32),
+        ("bBGain", ctypes.c_int32),
+        ("bGlobShutter", ctypes.c_int32),
+        ("wPixelSize", ctypes.c_uint16), # in 1/100 um
+        ("nUpperLeftBayerPixel", ctypes.c_char),
+        ("Reserved", ctypes.c_char*13)
+    ]
+
+class Rect(ctypes.Structure):
+    _fields_ = [
+        ("s32X", ctypes.c_int32),
+        ("s32Y", ctypes.c_int32),
+        ("s32Width", ctypes.c_int32),
+        ("s32Height", ctypes.c_int32)
+    ]
+
+class Point2D(ctypes.Structure):
+    _fields_ = [
+        ("s32X", ctypes.c_int32),
+        ("s32Y", ctypes.c_int32)
+    ]
+
+class Size2D(ctypes.Structure):
+    _fields_ = [
+        ("s32Width", ctypes.c_int32),
+        ("s32Height", ctypes.c_int32)
+    ]
     
 class ThorlabsDCx(Camera):
     """Class for Thorlabs DCx series cameras."""
 
+    # The camera delivers 8 bit images.
+    native_dtype = np.dtype(np.uint8)
+
+    # Image memories of the capture sequence as a list of (address,
+    # memory ID) tuples, read-only views of them, and the indices of
+    # memories locked for callers of get_view.
+    memories = []
+    n_buffers = 4
+    _views = []
+    _held = []
+
+    # Shape (rows, columns) of images with the current AOI and
+    # binning, and the increments in which the AOI position and size
+    # can be changed (in binned pixels).
+    image_shape = None
+    _pos_inc = (1, 1)
+    _size_inc = (1, 1)
+
+    # Properties of the sensor as returned by is_GetSensorInfo and
+    # the bin sizes it supports.
+    sensor_info = None
+    supported_bins = [1]
+
+    # True while capturing continuously with is_CaptureVideo.
+    capturing = False
+
+    # Time slice in ms for waiting for frame events, so that the wait
+    # can be cancelled.
+    _wait_slice = 100
+
     # Setup and shutdown
     # -------------------------------------------------------------------------
 
@@ -47,9 +138,22 @@ class ThorlabsDCx(Camera):
             print("msg:", msg)
 
     def _initialize(self, **kwargs):
-        """Initialize the camera."""
-        # Load the library.
-        if 'win' in sys.platform:
+        """Initialize the camera.
+
+        Keyword arguments
+        -----------------
+        n_buffers : int
+            Number of image memories in the sequence which images are
+            captured into while capturing continuously. Defaults to 4.
+
+        """
+        self.n_buffers = kwargs.get('n_buffers', 4)
+        assert isinstance(self.n_buffers, int) and self.n_buffers >= 2
+
+        # Load the library unless one was given.
+        if self.clib is not None:
+            pass
+        elif 'win' in sys.platform:
             try:
                 self.clib = ctypes.cdll.uc480_64
             except:
@@ -70,22 +174,35 @@ class ThorlabsDCx(Camera):
         self._chk(self.clib.is_InitCamera(
             ctypes.pointer(self.filehandle)))
 
-        # Resolution of camera. (height, width)    
-        self.shape = (1024, 1280)
-
-        # Allocate memory. Declare variables for storing memory ID and
-        # memory start location:
-        self.pid = ctypes.c_int()          
-        self.ppcImgMem = ctypes.c_char_p()
-        
-        # Allocate the right amount of memory:
-        bitdepth = 8 # Camera is 8 bit.
-        self._chk(self.clib.is_AllocImageMem(
-            self.filehandle, self.shape[1], self.shape[0],
-            bitdepth, byref(self.ppcImgMem),  byref(self.pid)))
-        
-        # Tell the driver to use the newly allocated memory:        
-        self._chk(self.clib.is_SetImageMem(self.filehandle, self.ppcImgMem , self.pid)) 
+        # Resolution of camera. (x, y)
+        self.sensor_info = SensorInfo()
+        self._chk(self.clib.is_GetSensorInfo(
+            self.filehandle, byref(self.sensor_info)))
+        self.shape = (self.sensor_info.nMaxWidth, self.sensor_info.nMaxHeight)
+
+        # Find out which binning modes are supported and how the AOI
+        # can be placed.
+        supported = self.clib.is_SetBinning(
+            self.filehandle, IS_GET_SUPPORTED_BINNING)
+        self.supported_bins = [
+            bins for bins, mode in sorted(_BINNING_MODES.items())
+            if supported & mode == mode]
+        pos_inc, size_inc = Point2D(), Size2D()
+        self._chk(self.clib.is_AOI(
+            self.filehandle, IS_AOI_IMAGE_GET_POS_INC,
+            byref(pos_inc), ctypes.sizeof(pos_inc)))
+        self._chk(self.clib.is_AOI(
+            self.filehandle, IS_AOI_IMAGE_GET_SIZE_INC,
+            byref(size_inc), ctypes.sizeof(size_inc)))
+        self._pos_inc = (max(pos_inc.s32X, 1), max(pos_inc.s32Y, 1))
+        self._size_inc = (max(size_inc.s32Width, 1), max(size_inc.s32Height, 1))
+
+        # Start with the full sensor and allocate the image memories
+        # for it. Single images are captured into the first one.
+        self.bins = 1
+        self.crop = [1, self.shape[0], 1, self.shape[1]]
+        self.memories = []
+        self._update_aoi()
         
         # Enable autoclosing. This allows for safely closing the
         # camera if it is disconnected.
@@ -95,10 +212,65 @@ class ThorlabsDCx(Camera):
         filename = 'thorlabs_dcx.json'
         self.logger.warning("Warning: Warnings do not work!")
         self.props.load(filename)
+        if self.real_camera:
+            self.props.update({
+                'pixels': self.shape,
+                'pixel_um': self.sensor_info.wPixelSize/100.,
+                'bins': self.supported_bins
+            })
 
     def close(self):
         """Close the camera safely."""
+        if not self.real_camera:
+            return
+        self.stop()
+        self._free_memories()
         self._chk(self.clib.is_ExitCamera(self.filehandle))
+
+    # Image memory
+    # -------------------------------------------------------------------------
+
+    def _allocate_memories(self):
+        """Allocate n_buffers image memories of the current image
+        size and add them to the capture sequence. This also frees
+        any previously allocated memories.
+
+        """
+        self._free_memories()
+        height, width = self.image_shape
+        bitdepth = 8 # Camera is 8 bit.
+        for i in range(self.n_buffers):
+            address, mem_id = c_void_p(), c_int()
+            self._chk(self.clib.is_AllocImageMem(
+                self.filehandle, width, height, bitdepth,
+                byref(address), byref(mem_id)))
+            self.memories.append((address, mem_id))
+            self._chk(self.clib.is_AddToSequence(
+                self.filehandle, address, mem_id))
+        self.ppcImgMem, self.pid = self.memories[0]
+        self._chk(self.clib.is_SetImageMem(self.filehandle, self.ppcImgMem, self.pid))
+
+        # Lines may be padded, so make views with the driver's pitch.
+        pitch = c_int()
+        self._chk(self.clib.is_GetImageMemPitch(self.filehandle, byref(pitch)))
+        self._views = []
+        for address, mem_id in self.memories:
+            data = (ctypes.c_uint8*(pitch.value*height)).from_address(address.value)
+            view = np.ctypeslib.as_array(data).reshape(height, pitch.value)[:, :width]
+            view.flags.writeable = False
+            self._views.append(view)
+        self._held = []
+
+    def _free_memories(self):
+        """Clear the capture sequence and free its memories."""
+        if self.memories:
+            self._chk(self.clib.is_ClearSequence(self.filehandle))
+            for address, mem_id in self.memories:
+                self._chk(self.clib.is_FreeImageMem(
+                    self.filehandle, address, mem_id))
+        self.memories = []
+        self._views = []
+        self._held = []
         
     # Image acquisition
     # -------------------------------------------------------------------------
@@ -106,28 +278,121 @@ class ThorlabsDCx(Camera):
     def set_acquisition_mode(self, mode):
         """Set the image acquisition mode."""
 
-    def _acquire_image_data(self):
-        """Code for getting image data from the camera should be
-        placed here.
+    def _get_frame_format(self):
+        """Return the shape and dtype of images."""
+        return self.image_shape, self.native_dtype
+
+    def _wait_for_frame(self):
+        """Wait for the frame event signalling a new image in the
+        capture sequence.
+
+        Raises
+        ------
+        AcquisitionTimeout
+            If no image arrives within :attr:`wait_timeout` ms.
+        AcquisitionCancelled
+            If :meth:`cancel_wait` is called while waiting.
+
+        """
+        if self.wait_timeout is not None:
+            deadline = _timer() + self.wait_timeout/1000.
+        while True:
+            self._check_cancelled()
+            if not self.capturing:
+                raise ThorlabsDCxError("The camera is not capturing.")
+            timeout = self._wait_slice
+            if self.wait_timeout is not None:
+                remaining = int(1000*(deadline - _timer()))
+                if remaining <= 0:
+                    raise AcquisitionTimeout(
+                        "No image within %g ms." % self.wait_timeout)
+                timeout = min(timeout, remaining)
+            status = self.clib.is_WaitEvent(
+                self.filehandle, IS_SET_EVENT_FRAME, timeout)
+            if status == IS_SUCCESS:
+                return
+            if status != IS_TIMED_OUT:
+                raise ThorlabsDCxError("is_WaitEvent failed with %i" % status)
+
+    def _lock_newest(self):
+        """Wait for a new image and lock the memory holding the newest
+        one so that the driver skips it until it is unlocked. Returns
+        the index of the memory.
+
+        """
+        self._wait_for_frame()
+        num, current, last = c_int(), c_void_p(), c_void_p()
+        self._chk(self.clib.is_GetActSeqBuf(
+            self.filehandle, byref(num), byref(current), byref(last)))
+        for i, (address, mem_id) in enumerate(self.memories):
+            if address.value == last.value:
+                break
+        else:
+            raise ThorlabsDCxError("Unknown image memory.")
+        self._chk(self.clib.is_LockSeqBuf(
+            self.filehandle, IS_IGNORE_PARAMETER, self.memories[i][0]))
+        return i
+
+    def _unlock(self, i):
+        """Hand memory i back to the driver."""
+        self._chk(self.clib.is_UnlockSeqBuf(
+            self.filehandle, IS_IGNORE_PARAMETER, self.memories[i][0]))
+
+    def _acquire_image_data(self, out):
+        """Copy the newest image into out while capturing
+        continuously, otherwise capture a single image.
 
         """
-        # Allocate memory for image:
-        img_size = self.shape[0]*self.shape[1]/self.bins**2
-        c_array = ctypes.c_char*img_size
-        c_img = c_array()       
+        stats = self._stats
+        if stats is not None:
+            t = timestamp_ns()
+        if self.capturing:
+            i = self._lock_newest()
+            if stats is not None:
+                t = stats.lap('wait', t)
+            np.copyto(out, self._views[i])
+            self._unlock(i)
+            if stats is not None:
+                stats.lap('copy', t)
+            return out
 
         # Take one picture: wait time is waittime * 10 ms:
         waittime = c_int(20)
         self._chk(self.clib.is_FreezeVideo(self.filehandle, waittime))
+        if stats is not None:
+            t = stats.lap('capture', t)
         
-        # Copy image data from the driver allocated memory to the
-        # memory that we allocated.
-        self._chk(self.clib.is_CopyImageMem(self.filehandle, self.ppcImgMem, self.pid, c_img))            
-
-        # Pythonize and return
-        img_array = np.frombuffer(c_img, dtype=ctypes.c_ubyte)
-        img_array.shape = np.array(self.shape)
-        return img_array
+        # Copy image data from the driver allocated memory into the
+        # output array, skipping any padding at the end of lines.
+        np.copyto(out, self._views[0])
+        if stats is not None:
+            stats.lap('copy', t)
+        return out
+
+    def _acquire_view(self):
+        """Lock the memory holding the newest image for the caller of
+        :meth:`get_view`. Views are only lent while capturing.
+
+        """
+        if not self.capturing:
+            return None
+        stats = self._stats
+        if stats is not None:
+            t = timestamp_ns()
+        i = self._lock_newest()
+        self._held.append(i)
+        if stats is not None:
+            stats.lap('wait', t)
+        return self._views[i]
+
+    def _release_view(self, img):
+        """Unlock the memory of a view returned by :meth:`get_view`."""
+        for i in self._held:
+            if self._views[i] is img:
+                self._held.remove(i)
+                self._unlock(i)
+                return True
+        return False
         
     # Triggering
     # -------------------------------------------------------------------------
@@ -142,12 +407,95 @@ class ThorlabsDCx(Camera):
         """Send a software trigger to take an image immediately."""
 
     def start(self):
-        """Do nothing for this camera."""
-        pass
+        """Start capturing continuously into the memory sequence.
+        Until then, every image is captured with a single
+        is_FreezeVideo.
+
+        """
+        if not self.real_camera or self.capturing:
+            return
+        self._chk(self.clib.is_EnableEvent(self.filehandle, IS_SET_EVENT_FRAME))
+        self._chk(self.clib.is_CaptureVideo(self.filehandle, IS_DONT_WAIT))
+        self.capturing = True
 
     def stop(self):
-        """Do nothing for this camera."""
-        pass
+        """Stop capturing continuously."""
+        if not self.real_camera or not self.capturing:
+            return
+        self.capturing = False
+        self._chk(self.clib.is_StopLiveVideo(self.filehandle, IS_FORCE_VIDEO_STOP))
+        self._chk(self.clib.is_DisableEvent(self.filehandle, IS_SET_EVENT_FRAME))
+
+    # Cropping and binning
+    # -------------------------------------------------------------------------
+
+    def _update_aoi(self):
+        """Set the binning mode and AOI of the sensor to the current
+        bins and crop, then reallocate the image memories to the size
+        of the AOI the sensor actually uses. The crop is updated to
+        match it, since the AOI can only be placed in certain
+        increments.
+
+        """
+        capturing = self.capturing
+        self.stop()
+        bins = self.bins
+        self._chk(self.clib.is_SetBinning(self.filehandle, _BINNING_MODES[bins]))
+
+        # The AOI is given in binned pixels.
+        (x_inc, y_inc), (w_inc, h_inc) = self._pos_inc, self._size_inc
+        max_w, max_h = self.shape[0]//bins, self.shape[1]//bins
+        w = max((self.crop[1] - self.crop[0] + 1)//bins//w_inc*w_inc, w_inc)
+        h = max((self.crop[3] - self.crop[2] + 1)//bins//h_inc*h_inc, h_inc)
+        x = min((self.crop[0] - 1)//bins//x_inc*x_inc, (max_w - w)//x_inc*x_inc)
+        y = min((self.crop[2] - 1)//bins//y_inc*y_inc, (max_h - h)//y_inc*y_inc)
+        aoi = Rect(x, y, w, h)
+        self._chk(self.clib.is_AOI(
+            self.filehandle, IS_AOI_IMAGE_SET_AOI, byref(aoi), ctypes.sizeof(aoi)))
+        self._chk(self.clib.is_AOI(
+            self.filehandle, IS_AOI_IMAGE_GET_AOI, byref(aoi), ctypes.sizeof(aoi)))
+        self.crop = [aoi.s32X*bins + 1, (aoi.s32X + aoi.s32Width)*bins,
+                     aoi.s32Y*bins + 1, (aoi.s32Y + aoi.s32Height)*bins]
+        self.image_shape = (aoi.s32Height, aoi.s32Width)
+        self.logger.info(
+            "AOI: %s with binning %i" % (repr(self.crop), self.bins))
+
+        self.pool.clear()
+        self._allocate_memories()
+        if capturing:
+            self.start()
+
+    def _update_crop(self, crop):
+        """Set the AOI of the sensor to the crop."""
+        self._update_aoi()
+
+    def set_bins(self, bins):
+        """Set binning to bins x bins. The crop is kept."""
+        self._check_bins(bins)
+        self.bins = bins
+        if self.real_camera:
+            self._update_aoi()
+
+    def _check_bins(self, bins):
+        """Raise an error if the sensor does not support bins."""
+        if bins not in self.props['bins']:
+            raise ThorlabsDCxError(
+                "bins must be one of " + repr(self.props['bins']))
+
+    def _apply_settings(self, settings):
+        """Apply changes of the crop and bins with a single AOI
+        update.
+
+        """
+        if self.real_camera and ('crop' in settings or 'bins' in settings):
+            settings = dict(settings)
+            crop = settings.pop('crop', self.crop)
+            bins = settings.pop('bins', self.bins)
+            self._check_crop(crop)
+            self._check_bins(bins)
+            self.crop, self.bins = crop, bins
+            self._update_aoi()
+        super(ThorlabsDCx, self)._apply_settings(settings)
 
     # Gain and exposure time
     # -------------------------------------------------------------------------
@@ -1,11 +1,11 @@
 """ROI setup dialog"""
 
-import numpy as np
 from qcamera import Camera
 
 from PyQt4 import QtGui
 from guiqwt.builder import make
 from ui_roi_dialog import Ui_ROIDialog
+from transforms import get_roi_data, roi_statistics
 
 class ROIDialog(QtGui.QDialog, Ui_ROIDialog):
     """Class controlling the ROI setup dialog."""
@@ -23,23 +23,22 @@ class ROIDialog(QtGui.QDialog, Ui_ROIDialog):
 
     def update(self, img_data):
         # Calculate and update ROI statistics.
-        roi = img_data[self.cam.roi[1]:self.cam.roi[3],
-                       self.cam.roi[0]:self.cam.roi[2]]
-        #np.save('roi.npy', roi) # for debugging
+        stats = None
         try:
-            self.roiTotalLbl.setText('%.0f' % np.sum(roi))
-            self.roiMeanLbl.setText('%.2f' % np.mean(roi))
-            self.roiMaxLbl.setText('%.0f' % np.max(roi))
-            self.roiMinLbl.setText('%.0f' % np.min(roi))
+            stats = roi_statistics(img_data, self.cam.roi)
+            self.roiTotalLbl.setText('%.0f' % stats['total'])
+            self.roiMeanLbl.setText('%.2f' % stats['mean'])
+            self.roiMaxLbl.setText('%.0f' % stats['max'])
+            self.roiMinLbl.setText('%.0f' % stats['min'])
         except:
             print("self.cam.roi:", self.cam.roi)
-            print("roi:", roi)
+            print("stats:", stats)
             print("img_data:", img_data)
 
         # ROI histogram plot
         h_plot = self.roiHistWidget.get_plot()
         h_plot.del_all_items(except_grid=True)
-        hist = make.histogram(roi.flatten(), 50)
+        hist = make.histogram(get_roi_data(img_data, self.cam.roi).flatten(), 50)
         h_plot.add_item(hist)
         #print(hist.get_data())
         h_plot.set_plot_limits(0, self.xHistLimBox.value(), 0, self.yHistLimBox.value())
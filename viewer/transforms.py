@@ -0,0 +1,56 @@
+"""Image transformations and statistics used by the viewer.
+
+These do not depend on any GUI toolkit so that they can be used (and
+benchmarked) without a display.
+
+"""
+
+import numpy as np
+
+def transform_image(img, rotation=0, mirror=(False, False)):
+    """Rotate an image clockwise by rotation*90 degrees, then flip it
+    vertically and/or horizontally. The result is a view of img.
+
+    Parameters
+    ----------
+    img : np.ndarray
+        The image to transform.
+    rotation : int
+        Number of clockwise 90 degree rotations.
+    mirror : tuple
+        Flags (vertical, horizontal) for flipping the image.
+
+    """
+    img = np.rot90(img, -rotation)
+    if mirror[0]:
+        img = np.flipud(img)
+    if mirror[1]:
+        img = np.fliplr(img)
+    return img
+
+def get_scale(img):
+    """Return the minimum and maximum values of an image as ints, for
+    setting the LUT range.
+
+    """
+    return int(np.min(img)), int(np.max(img))
+
+def get_roi_data(img, roi):
+    """Return the part of an image inside roi, given in the form [x1,
+    y1, x2, y2].
+
+    """
+    return img[roi[1]:roi[3], roi[0]:roi[2]]
+
+def roi_statistics(img, roi):
+    """Return a dict with the total, mean, max and min of the pixel
+    values inside roi.
+
+    """
+    data = get_roi_data(img, roi)
+    return {
+        'total': np.sum(data, dtype=np.float64),
+        'mean': np.mean(data),
+        'max': np.max(data),
+        'min': np.min(data)
+    }
@@ -24,6 +24,7 @@ from roi_dialog import ROIDialog
 from camera_select_dialog import CameraSelectDialog
 from config import CAM_TYPES, CONFIG_FILE
 from util import *
+from transforms import transform_image, get_scale
 
 from ui_viewer import Ui_MainWindow
 from ring_buffer_viewer import RingBufferViewer
@@ -48,6 +49,10 @@ class Viewer(QtGui.QMainWindow, Ui_MainWindow):
         self.rotation = 0
         self.mirror = [False, False]
 
+        # Most recently displayed image. This is handed back to the
+        # camera's frame pool once a newer image has replaced it.
+        self.shown_img = None
+
         # Run the camera select dialog if necessary
         if kwargs.get('cam_select', False):
             self.launch_camera_select_dialog()
@@ -156,6 +161,7 @@ class Viewer(QtGui.QMainWindow, Ui_MainWindow):
 
     def closeEvent(self, event):
         self.cam_thread.stop()
+        self.cam.rbuffer.close()
         self.cam.close()
         super(Viewer, self).closeEvent(event)
 
@@ -165,12 +171,13 @@ class Viewer(QtGui.QMainWindow, Ui_MainWindow):
 
     def update(self, img_data):
         """Update the image plot and other information."""
+        # Release the previous image now that a new one replaces it.
+        if self.shown_img is not None:
+            self.cam.release(self.shown_img)
+        self.shown_img = img_data
+
         # Apply image transformations if necessary.
-        img_data = np.rot90(img_data, -self.rotation)
-        if self.mirror[0]:
-            img_data = np.flipud(img_data)
-        if self.mirror[1]:
-            img_data = np.fliplr(img_data)
+        img_data = transform_image(img_data, self.rotation, self.mirror)
 
         # Configure plot
         plot = self.imageWidget.get_plot()
@@ -226,10 +233,7 @@ class Viewer(QtGui.QMainWindow, Ui_MainWindow):
 
         """
         img = get_image_item(self.imageWidget)
-        minimum = int(np.min(img.data))
-        maximum = int(np.max(img.data))
-        assert type(minimum) is int
-        assert type(maximum) is int
+        minimum, maximum = get_scale(img.data)
         self.scaleMinBox.setValue(minimum)
         self.scaleMaxBox.setValue(maximum)
         self.set_lut_range()